@@ -129,7 +129,7 @@ class AnalyteHistoryResultSerializer(serializers.ModelSerializer):
     test_date = serializers.DateField(source='submission.test_date', read_only=True)
     analyte_name = serializers.CharField(source='analyte.name', read_only=True)
     unit = serializers.CharField(read_only=True)
-    class Meta: model = TestResult; fields = ['id', 'analyte_name', 'test_date', 'value_numeric','unit', 'is_abnormal', 'status_text', 'reference_range', 'submission']; read_only_fields = fields
+    class Meta: model = TestResult; fields = ['id', 'analyte_name', 'test_date', 'value_numeric','unit', 'is_abnormal', 'status_text', 'reference_range', 'ref_low', 'ref_high', 'submission']; read_only_fields = fields
 
 class SimpleAnalyteSerializer(serializers.ModelSerializer):
     class Meta: model = Analyte; fields = ['id', 'name', 'unit']; read_only_fields = fields
@@ -177,13 +177,15 @@ class MedicalTestSubmissionDetailSerializer(serializers.ModelSerializer):
     # Вложенный сериализатор для результатов, связанных с этой загрузкой
     # related_name='results' в модели MedicalTestSubmission позволяет получить их через submission.results.all()
     results = AnalyteHistoryResultSerializer(many=True, read_only=True) # Используем существующий сериализатор результатов
+    # Сам текст не сериализуется: его отдает постранично SubmissionTextPagesAPIView
+    text_page_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = MedicalTestSubmission
         fields = [
             'id', 'user', 'test_type', 'test_type_name', 'submission_date',
             'test_date', 'notes', 'uploaded_file', 'file_name',
-            'processing_status', 'processing_details', 'extracted_text',
+            'processing_status', 'processing_details', 'processing_metrics', 'text_page_count',
             'created_at', 'updated_at',
             'results', # Включаем вложенные результаты
         ]
@@ -1,3 +1,110 @@
-from django.test import TestCase
+import hashlib
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from data.extraction import PAGE_SEPARATOR
+from data.models import ExtractedTextPage, MedicalTestSubmission, UnrecognizedResultLine
+
+PDF_CONTENT = b'%PDF-1.4\n%%EOF\n'
+
+
+class UploadCapacityTests(TestCase):
+    """Back-pressure загрузки: пул проверяется только для файлов, которые уйдут на обработку."""
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = get_user_model().objects.create_user('upload', 'upload@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.completed = MedicalTestSubmission(
+            user=self.user, content_sha256=hashlib.sha256(PDF_CONTENT).hexdigest(),
+            processing_status=MedicalTestSubmission.StatusChoices.COMPLETED,
+        )
+        self.completed.uploaded_file.save('done.pdf', ContentFile(PDF_CONTENT), save=True)
+        UnrecognizedResultLine.objects.create(
+            submission=self.completed, line_number=3, line='Новый показатель 12 ед', candidate_name='Новый показатель',
+            name_key=UnrecognizedResultLine.make_name_key('Новый показатель'),
+        )
+
+    def _upload(self, *contents):
+        files = [SimpleUploadedFile(f'{i}.pdf', content, 'application/pdf') for i, content in enumerate(contents)]
+        return self.client.post('/api/upload/', {'files': files}, format='multipart')
+
+    @mock.patch('api.views.schedule_submission_processing')
+    @mock.patch('api.views.has_ingest_capacity', return_value=False)
+    def test_duplicate_of_completed_upload_skips_capacity_check(self, has_capacity, schedule):
+        response = self._upload(PDF_CONTENT)
+        self.assertEqual(response.status_code, 201)
+        has_capacity.assert_not_called()
+        schedule.assert_not_called()
+        self.assertEqual(list(response.data['duplicates'].values()), [str(self.completed.id)])
+        clone_id = response.data['submission_ids'][0]
+        self.assertEqual(
+            list(UnrecognizedResultLine.objects.filter(submission_id=clone_id).values_list('line_number', 'name_key')),
+            [(3, 'новый показатель')],
+        )
+
+    @mock.patch('api.views.schedule_submission_processing')
+    @mock.patch('api.views.has_ingest_capacity', return_value=False)
+    def test_full_pool_counts_only_new_files(self, has_capacity, schedule):
+        response = self._upload(PDF_CONTENT, PDF_CONTENT + b'%new\n')
+        self.assertEqual(response.status_code, 503)
+        has_capacity.assert_called_once_with(1)
+        schedule.assert_not_called()
+        self.assertEqual(MedicalTestSubmission.objects.count(), 1)
+
+
+@override_settings(EXTRACTED_TEXT_MAX_PAGES=3)
+class SubmissionTextPagesTests(TestCase):
+    """Постраничная выдача извлеченного текста: диапазон, ограничение числа страниц и владелец."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('reader', 'reader@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.submission = MedicalTestSubmission.objects.create(user=self.user, uploaded_file='medical_tests/text.pdf')
+        self.page_texts = [f'Страница {number}' for number in range(1, 6)]
+        ExtractedTextPage.objects.bulk_create(
+            ExtractedTextPage.from_page_texts(self.submission, self.page_texts, PAGE_SEPARATOR)
+        )
+
+    def _get(self, **params):
+        return self.client.get(f'/api/submissions/{self.submission.id}/text/', params)
+
+    def test_default_range_is_capped(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['page_count'], 5)
+        self.assertEqual([page['page_number'] for page in response.data['pages']], [1, 2, 3])
+
+    def test_explicit_range(self):
+        response = self._get(start=2, end=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([page['text'] for page in response.data['pages']], self.page_texts[1:3])
+        document = PAGE_SEPARATOR.join(self.page_texts)
+        for page in response.data['pages']:
+            self.assertEqual(document[page['start_offset']:page['start_offset'] + page['char_count']], page['text'])
+
+    def test_range_longer_than_cap_is_truncated(self):
+        response = self._get(start=2, end=100)
+        self.assertEqual([page['page_number'] for page in response.data['pages']], [2, 3, 4])
+
+    def test_invalid_ranges(self):
+        for params in ({'start': 0}, {'start': 3, 'end': 2}, {'start': 'x'}, {'end': '1.5'}):
+            with self.subTest(params=params):
+                self.assertEqual(self._get(**params).status_code, 400)
+
+    def test_other_users_submission_is_not_found(self):
+        other = get_user_model().objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_authenticate(other)
+        self.assertEqual(self._get().status_code, 404)
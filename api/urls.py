@@ -16,12 +16,14 @@ from .views import (
     AnalyteListAPIView,
     GenerateHealthSummaryAPIView,
     HealthSummaryCSVExportAPIView,
+    IngestionQueueStatusAPIView,
     TestResultCSVExportAPIView,
     TestTypeListAPIView,
     UserHealthStatisticsAPIView,      
     UserSubmissionsListAPIView,
     UploadLabResultsAPIView, 
     SubmissionDetailAPIView,
+    SubmissionTextPagesAPIView,
     UserHealthSummariesListAPIView,
 )
 
@@ -36,12 +38,18 @@ urlpatterns = [
     # --- Загрузки (Submissions) ---
     path('upload/', UploadLabResultsAPIView.as_view(), name='upload_lab_results_api'),
     
+    # Состояние очереди фоновой обработки (GET, только администраторы)
+    path('upload/queue-status/', IngestionQueueStatusAPIView.as_view(), name='upload-queue-status-api'),
+
     # Для списка загрузок пользователя (GET)
     path('submissions/', UserSubmissionsListAPIView.as_view(), name='submission-list-api'),
     
     # Для получения деталей конкретной загрузки (GET)
     path('submissions/<uuid:id>/', SubmissionDetailAPIView.as_view(), name='submission-detail-api'),
 
+    # Извлеченный текст загрузки по страницам (GET ?start=&end=)
+    path('submissions/<uuid:id>/text/', SubmissionTextPagesAPIView.as_view(), name='submission-text-api'),
+
     # --- URL для УДАЛЕНИЯ конкретной загрузки (DELETE) ---
     # Используем DeleteSubmissionView из data.views
     # Фронтенд вызывает /api/submission/<submissionId>/delete/
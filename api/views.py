@@ -3,10 +3,10 @@
 # Описание: Представления (Views/Viewsets) DRF для API.
 # Включает представления для загрузки файлов и списка загрузок.
 # ==============================================================================
-from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 import json
 import logging
-import threading # Для запуска задачи парсинга в отдельном потоке (для простой демонстрации)
 import os # Для работы с путями файлов
 import datetime
 from urllib.parse import unquote # Для обработки даты
@@ -17,7 +17,7 @@ from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser # Для обработки файлов в POST запросах
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.http import Http404
 from uuid import UUID
 from django.utils.translation import gettext_lazy as _
@@ -32,7 +32,7 @@ from rest_framework import serializers
 # ------------------------------------
 
 # Импортируем модели из приложения data
-from data.models import HealthSummary, TestResult, Analyte, MedicalTestSubmission, TestType
+from data.models import AnalyteSeriesPoint, AnalyteSeriesSummary, HealthSummary, TestResult, Analyte, MedicalTestSubmission, TestType
 # Импортируем модель пользователя (предполагается, что это settings.AUTH_USER_MODEL)
 from api.filters import HealthSummaryExportFilter, TestResultExportFilter
 from users.models import User # Убедитесь, что это правильный импорт для вашего проекта
@@ -41,8 +41,10 @@ from allauth.account.models import EmailConfirmationHMAC
 # Импортируем адаптер allauth для активации пользователя
 from allauth.account.adapter import get_adapter
 
-# Импортируем задачу парсинга PDF из приложения data
-from data.tasks import process_pdf_submission_plain # Убедитесь, что путь правильный
+# Пул фоновой обработки PDF из приложения data
+from data.executor import get_ingest_executor, has_ingest_capacity, ingest_backend, schedule_submission_processing
+from data.ingest_queue import queue_depth
+from data.deduplication import clone_completed_submission, deduplication_enabled, file_sha256, find_duplicate_submission
 
 # Импортируем сериализаторы из текущего приложения api
 from .serializers import (
@@ -245,19 +247,57 @@ class UploadLabResultsAPIView(APIView):
                  return Response({'detail': _('Invalid date format for test date. Use-MM-DD.')}, status=status.HTTP_400_BAD_REQUEST)
 
         submission_ids = []
+        duplicates = {}
         try:
+            # Повторная загрузка того же PDF: переиспользуем файл и, если он уже
+            # обработан, результаты прежней загрузки (такой файл не обрабатывается)
+            uploads = []
+            for file in files:
+                content_sha256 = file_sha256(file)
+                duplicate = find_duplicate_submission(user, content_sha256) if deduplication_enabled() else None
+                uploads.append((file, content_sha256, duplicate))
+            scheduled_count = sum(
+                1 for _, _, duplicate in uploads
+                if not (duplicate and duplicate.processing_status == MedicalTestSubmission.StatusChoices.COMPLETED)
+            )
+
+            # Back-pressure: если пул обработки заполнен, не принимаем новые файлы;
+            # учитываются только файлы, которые уйдут на обработку
+            if scheduled_count and not has_ingest_capacity(scheduled_count):
+                logger.warning(f"User {user.id} upload of {scheduled_count} files rejected: processing pool is full.")
+                return Response(
+                    {'detail': _('The processing queue is full. Please try again later.')},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(getattr(settings, 'INGEST_RETRY_AFTER_SECONDS', 30))},
+                )
+
             # Используем транзакцию на случай загрузки нескольких файлов
             # Это гарантирует, что если один файл вызовет ошибку сохранения,
             # все предыдущие сохранения в этой транзакции будут отменены.
             with transaction.atomic():
-                for file in files:
+                created_by_sha256 = {}
+                for file, content_sha256, duplicate in uploads:
+                    if duplicate is None and deduplication_enabled():
+                        # Тот же файл раньше в этом же запросе: ссылаемся на его сохраненную копию
+                        duplicate = created_by_sha256.get(content_sha256)
+                    if duplicate and duplicate.processing_status == MedicalTestSubmission.StatusChoices.COMPLETED:
+                        submission = clone_completed_submission(
+                            duplicate, user, test_type=test_type, test_date=test_date, notes=notes
+                        )
+                        submission_ids.append(str(submission.id))
+                        duplicates[str(submission.id)] = str(duplicate.id)
+                        logger.info(f"User {user.id} re-uploaded {file.name}; reused results of submission {duplicate.id} for {submission.id}.")
+                        continue
+
                     # Создаем запись MedicalTestSubmission в базе данных
                     submission = MedicalTestSubmission.objects.create(
                         user=user, # Привязываем загрузку к текущему пользователю
                         test_type=test_type, # Может быть None, если не указан
                         test_date=test_date, # Может быть None, если не указана
                         notes=notes, # Может быть None, если не указаны
-                        uploaded_file=file, # Файл автоматически сохраняется в MEDIA_ROOT
+                        # Файл сохраняется в MEDIA_ROOT, а дубликат ссылается на уже сохраненный
+                        uploaded_file=duplicate.uploaded_file.name if duplicate else file,
+                        content_sha256=content_sha256,
                         processing_status=MedicalTestSubmission.StatusChoices.PENDING, # Начальный статус
                         submission_date=timezone.now(), # Дата и время загрузки
                         created_at=timezone.now(),
@@ -265,36 +305,22 @@ class UploadLabResultsAPIView(APIView):
                     )
                     # Добавляем ID созданной загрузки в список для ответа
                     submission_ids.append(str(submission.id))
+                    created_by_sha256.setdefault(content_sha256, submission)
+                    if duplicate:
+                        duplicates[str(submission.id)] = str(duplicate.id)
                     logger.info(f"User {user.id} uploaded file {file.name}. Created submission {submission.id}. Scheduling background processing.")
 
                     # --- Запуск фоновой задачи парсинга ---
-                    # В ПРОДАКШЕНЕ: Используй Celery или другую надежную очередь задач!
-                    # threading.Thread - это простой способ для локальной разработки/демонстрации.
-                    # Он не надежен в продакшене (задачи могут потеряться при падении сервера).
-                    try:
-                        thread = threading.Thread(
-                            target=process_pdf_submission_plain, # Ваша функция парсинга
-                            args=(submission.id,), # Передаем ID созданной загрузки
-                            daemon=True # Поток завершится, когда завершится основная программа
-                        )
-                        thread.start()
-                        logger.info(f"Started background thread {thread.ident} for submission {submission.id}")
-                    except Exception as thread_start_err:
-                         # Если не удалось запустить поток, помечаем загрузку как FAILED
-                         logger.exception(f"Failed to start background thread for submission {submission.id}: {thread_start_err}", exc_info=True)
-                         submission.processing_status = MedicalTestSubmission.StatusChoices.FAILED
-                         submission.processing_details = f"Failed to start processing thread: {str(thread_start_err)}"
-                         submission.save(update_fields=['processing_status', 'processing_details', 'updated_at'])
-                         # Можно также вернуть ошибку фронтенду сразу, или позволить ему отслеживать статус
-                         # В данном случае, просто логируем и помечаем как FAILED на бэкенде.
-                         # Фронтенд увидит статус FAILED при следующем обновлении списка.
-
+                    # Задача уходит в ограниченный пул только после коммита транзакции;
+                    # если пул к тому моменту переполнен, загрузка помечается как FAILED.
+                    schedule_submission_processing(submission.id)
 
             # Возвращаем успешный ответ со списком ID созданных загрузок
             # Фронтенд может использовать эти ID для отслеживания статуса
             return Response({
                 'detail': _('Files uploaded and processing started.'),
-                'submission_ids': submission_ids # Список ID всех созданных загрузок
+                'submission_ids': submission_ids, # Список ID всех созданных загрузок
+                'duplicates': duplicates, # ID новой загрузки -> ID загрузки с тем же файлом
             }, status=status.HTTP_201_CREATED)
 
         except Exception as e:
@@ -323,11 +349,28 @@ class VerifyEmailSerializer(serializers.Serializer):
          pass
 
 
+class IngestionQueueStatusAPIView(APIView):
+    """
+    Состояние фоновой обработки PDF (для администраторов): пул этого процесса
+    и глубина устойчивой очереди в БД.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'backend': ingest_backend(),
+            'pool': get_ingest_executor().stats(),
+            'queue': queue_depth(),
+        }, status=status.HTTP_200_OK)
+
+
 class SubmissionDetailAPIView(generics.RetrieveAPIView):
     """
     Предоставляет детали одной загрузки медицинского теста по ID, включая связанные результаты.
     """
-    queryset = MedicalTestSubmission.objects.select_related('test_type', 'user').prefetch_related('results__analyte').all()
+    queryset = MedicalTestSubmission.objects.select_related('test_type', 'user').prefetch_related('results__analyte').annotate(
+        text_page_count=Count('text_pages', distinct=True)
+    )
     serializer_class = MedicalTestSubmissionDetailSerializer # Используем новый сериализатор
     permission_classes = [permissions.IsAuthenticated] # Требуем аутентификацию
     lookup_field = 'id' # Поле в URL для поиска объекта (по умолчанию 'pk')
@@ -338,6 +381,44 @@ class SubmissionDetailAPIView(generics.RetrieveAPIView):
 
     # Нет необходимости переопределять retrieve, т.к. generics.RetrieveAPIView делает это автоматически
 
+
+class SubmissionTextPagesAPIView(APIView):
+    """
+    Извлеченный текст загрузки по страницам: GET ?start=N&end=M (номера страниц
+    с 1, включительно; по умолчанию — с первой страницы). За запрос отдается не
+    больше EXTRACTED_TEXT_MAX_PAGES страниц; start_offset страницы — ее позиция
+    в тексте всего документа.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, id, *args, **kwargs):
+        submission = get_object_or_404(MedicalTestSubmission.objects.only('id'), id=id, user=request.user)
+        max_pages = getattr(settings, 'EXTRACTED_TEXT_MAX_PAGES', 20)
+        try:
+            start = int(request.query_params.get('start', 1))
+            end = int(request.query_params.get('end', start + max_pages - 1))
+        except (TypeError, ValueError):
+            return Response({'detail': _('Page numbers must be integers.')}, status=status.HTTP_400_BAD_REQUEST)
+        if start < 1 or end < start:
+            return Response({'detail': _('Invalid page range.')}, status=status.HTTP_400_BAD_REQUEST)
+        end = min(end, start + max_pages - 1)
+
+        text_pages = submission.text_pages.all()
+        pages = text_pages.filter(page_number__gte=start, page_number__lte=end).order_by('page_number')
+        return Response({
+            'submission_id': submission.id,
+            'page_count': text_pages.count(),
+            'pages': [
+                {
+                    'page_number': page.page_number,
+                    'start_offset': page.start_offset,
+                    'char_count': page.char_count,
+                    'text': page.text,
+                }
+                for page in pages
+            ],
+        }, status=status.HTTP_200_OK)
+
 class UserHealthStatisticsAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -345,60 +426,33 @@ class UserHealthStatisticsAPIView(APIView):
         user = request.user
         health_stats_data = []
 
-        # Получаем все результаты тестов для пользователя, где есть числовое значение и дата теста
-        user_test_results = TestResult.objects.filter(
-            submission__user=user,
-            submission__test_date__isnull=False, # Убеждаемся, что дата теста существует
-            value_numeric__isnull=False # Используем только результаты с числовым значением
-        ).select_related('submission', 'analyte').order_by('analyte__name', 'submission__test_date')
-
-        if not user_test_results.exists():
-            logger.info(f"No test results with numeric values found for user {user.id} for health statistics.")
-            return Response([], status=status.HTTP_200_OK) # Возвращаем пустой список, если нет данных
-
-        # Группируем результаты по имени анализа (analyte.name)
-        grouped_results = defaultdict(list)
-        for result in user_test_results:
-            grouped_results[result.analyte.name].append({
-                "date": result.submission.test_date, # Дата из связанной загрузки
-                "value": float(result.value_numeric), # Конвертируем Decimal в float для JSON
-                "unit": result.unit or result.analyte.unit # Используем единицу из результата, или стандартную для анализа
-            })
-
-        # Обрабатываем каждую группу для создания структуры MetricData
-        for analyte_name, history_with_units in grouped_results.items():
-            if not history_with_units: # Пропускаем, если группа пуста (маловероятно после фильтрации)
-                continue
-            
-            # Готовим list_of_all_the_values (точки истории: дата и значение)
-            # Список уже отсортирован по дате благодаря order_by в запросе
-            list_of_all_the_values = [{"date": h["date"], "value": h["value"]} for h in history_with_units]
-            
-            # Определяем процент изменения
-            percentage_of_change = 0.0
-            if len(list_of_all_the_values) >= 2:
-                latest_value = list_of_all_the_values[-1]["value"]
-                previous_value = list_of_all_the_values[-2]["value"]
-                
-                # Убеждаемся, что значения не None и previous_value не ноль
-                if previous_value is not None and latest_value is not None:
-                    if previous_value != 0:
-                        change = latest_value - previous_value
-                        percentage_of_change = round((change / previous_value) * 100, 2)
-                    elif latest_value != 0: # Предыдущее значение было 0, текущее - нет
-                        percentage_of_change = 100.0 # Указываем на значительное изменение от нуля
-                    # Если оба значения 0, percentage_of_change остается 0.0
-            
-            # Получаем единицу измерения из последней записи
-            name_of_unit = history_with_units[-1]["unit"] if history_with_units else "N/A"
+        # Ряды и итоги поддерживаются при записи результатов (data/series.py): чтение —
+        # итоги пользователя и его точки по индексу (user, analyte, дата), без
+        # соединения результатов с загрузками
+        summaries = {
+            analyte_name: (unit, percentage_of_change)
+            for analyte_name, unit, percentage_of_change in AnalyteSeriesSummary.objects.filter(user=user)
+            .values_list('analyte__name', 'unit', 'percentage_of_change')
+        }
+        points = (
+            AnalyteSeriesPoint.objects.filter(user=user)
+            .order_by('analyte__name', 'test_date', 'submission_date', 'result_id')
+            .values_list('analyte__name', 'test_date', 'value')
+        )
 
-            metric_data_entry = {
+        # Точки упорядочены по имени анализа и дате — группировка одним проходом
+        for analyte_name, rows in groupby(points, key=itemgetter(0)):
+            name_of_unit, percentage_of_change = summaries.get(analyte_name, (None, 0.0))
+            health_stats_data.append({
                 "name_of_component": analyte_name, # Имя анализа
-                "name_of_unit": name_of_unit,
+                "name_of_unit": name_of_unit, # Единица измерения из последней записи
                 "percentage_of_change": percentage_of_change,
-                "list_of_all_the_values": list_of_all_the_values,
-            }
-            health_stats_data.append(metric_data_entry)
+                "list_of_all_the_values": [{"date": date, "value": value} for _, date, value in rows],
+            })
+
+        if not health_stats_data:
+            logger.info(f"No test results with numeric values found for user {user.id} for health statistics.")
+            return Response([], status=status.HTTP_200_OK) # Возвращаем пустой список, если нет данных
 
         # Сериализуем агрегированные данные
         serializer = MetricDataSerializer(health_stats_data, many=True)
@@ -419,22 +473,20 @@ class GenerateHealthSummaryAPIView(APIView):
         symptoms = input_serializer.validated_data['symptoms']
         logger.info(f"Generating health summary for user {user.id} with symptoms: {symptoms[:100]}...")
 
-        user_test_results = TestResult.objects.filter(
-            submission__user=user,
-            submission__test_date__isnull=False,
-            value_numeric__isnull=False
-        ).select_related('submission', 'analyte').order_by('analyte__name', '-submission__test_date')
+        # Точки рядов аналитов пользователя (data/series.py), новые первыми
+        user_series_points = AnalyteSeriesPoint.objects.filter(user=user).order_by(
+            'analyte__name', '-test_date', '-submission_date', '-result_id'
+        ).values_list('analyte__name', 'test_date', 'value', 'unit', 'reference_range')
 
         analyte_data_for_prompt = {}
         analyte_data_snapshot = []
 
-        for result in user_test_results:
-            analyte_name = result.analyte.name
+        for analyte_name, test_date, value, unit, reference_range in user_series_points:
             data_point = {
-                "date": result.submission.test_date.isoformat(),
-                "value": float(result.value_numeric),
-                "unit": result.unit or result.analyte.unit,
-                "ref_range": result.reference_range or "N/A"
+                "date": test_date.isoformat(),
+                "value": value,
+                "unit": unit,
+                "ref_range": reference_range or "N/A"
             }
             if analyte_name not in analyte_data_for_prompt:
                 analyte_data_for_prompt[analyte_name] = data_point
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import HealthSummary, TestType, MedicalTestSubmission, Analyte, TestResult
+from django.utils.html import format_html
+from .models import HealthSummary, TestType, MedicalTestSubmission, Analyte, TestResult, UnrecognizedResultLine, LabLayoutTemplate, ExtractedTextPage
 
 @admin.register(TestType)
 class TestTypeAdmin(admin.ModelAdmin):
@@ -18,8 +19,8 @@ class AnalyteAdmin(admin.ModelAdmin):
 
 class TestResultInline(admin.TabularInline):
     model = TestResult
-    fields = ('analyte', 'value', 'value_numeric', 'unit', 'reference_range', 'is_abnormal')
-    readonly_fields = ('analyte', 'value', 'value_numeric', 'unit', 'reference_range', 'is_abnormal', 'extracted_at')
+    fields = ('analyte', 'value', 'value_numeric', 'unit', 'reference_range', 'ref_low', 'ref_high', 'is_abnormal')
+    readonly_fields = ('analyte', 'value', 'value_numeric', 'unit', 'reference_range', 'ref_low', 'ref_high', 'is_abnormal', 'extracted_at')
     extra = 0
     can_delete = False
 
@@ -31,14 +32,14 @@ class MedicalTestSubmissionAdmin(admin.ModelAdmin):
     list_display = ('id', 'user_email', 'test_type', 'submission_date', 'test_date', 'processing_status', 'result_count')
     list_filter = ('processing_status', 'test_type', 'submission_date')
     search_fields = ('user__email', 'id', 'uploaded_file')
-    readonly_fields = ('id', 'user', 'submission_date', 'created_at', 'updated_at', 'extracted_text', 'processing_details')
+    readonly_fields = ('id', 'user', 'submission_date', 'created_at', 'updated_at', 'extracted_text', 'processing_details', 'processing_metrics', 'dictionary_version')
     list_select_related = ('user', 'test_type')
     inlines = [TestResultInline]
 
     fieldsets = (
         (None, {'fields': ('user', 'submission_date')}),
         ('Test Info', {'fields': ('test_type', 'test_date', 'notes', 'uploaded_file')}),
-        ('Processing', {'fields': ('processing_status', 'processing_details', 'extracted_text')}),
+        ('Processing', {'fields': ('processing_status', 'trace_processing', 'processing_details', 'processing_metrics', 'dictionary_version', 'extracted_text')}),
         ('Timestamps', {'fields': ('created_at', 'updated_at')}),
     )
 
@@ -51,6 +52,25 @@ class MedicalTestSubmissionAdmin(admin.ModelAdmin):
         return obj.results.count()
     result_count.short_description = 'Results'
 
+    def extracted_text(self, obj):
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', ExtractedTextPage.document_text(obj))
+    extracted_text.short_description = 'Extracted Text'
+
+@admin.register(UnrecognizedResultLine)
+class UnrecognizedResultLineAdmin(admin.ModelAdmin):
+    list_display = ('candidate_name', 'submission', 'line_number', 'detected_at')
+    search_fields = ('name_key', 'line')
+    list_filter = ('detected_at',)
+    list_select_related = ('submission',)
+    readonly_fields = ('submission', 'line_number', 'line', 'candidate_name', 'name_key', 'detected_at')
+
+@admin.register(LabLayoutTemplate)
+class LabLayoutTemplateAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'is_active', 'documents_parsed', 'rows_sliced', 'rows_fallback', 'last_used_at')
+    list_filter = ('is_active',)
+    search_fields = ('fingerprint',)
+    readonly_fields = ('fingerprint', 'header_labels', 'columns', 'sample_submission', 'documents_parsed', 'rows_sliced', 'rows_fallback', 'created_at', 'last_used_at')
+
 @admin.register(HealthSummary)
 class HealthSummaryAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'created_at', 'is_confirmed', 'ai_suggested_diagnosis')
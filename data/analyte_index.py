@@ -0,0 +1,268 @@
+# ==============================================================================
+# Файл: data/analyte_index.py
+# Описание: Кэшируемый в процессе индекс алиасов аналитов для парсера PDF
+# и обратный индекс аналит -> типы тестов для определения типа анализа.
+# ==============================================================================
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .matching import AliasMatcher
+from .models import Analyte, AnalyteDictionarySnapshot, TestType
+
+logger = logging.getLogger(__name__)
+
+# Ключ общего счетчика поколений. При общем кэше (Redis, Memcached, файловый)
+# инвалидация в одном процессе видна всем воркерам; с LocMemCache — только текущему.
+ALIAS_INDEX_GENERATION_KEY = 'data:alias_index:generation'
+# Сколько ячеек названий таблиц хранить в кэше совпадений одного снимка словаря
+CELL_MATCH_CACHE_SIZE = 4096
+
+
+class AnalyteRecord:
+    """Компактная запись аналита для парсера (вместо полного экземпляра модели)."""
+    __slots__ = ('id', 'name', 'unit', 'typical_test_type_ids')
+
+    def __init__(self, id, name, unit, typical_test_type_ids=()):
+        self.id = id
+        self.name = name
+        self.unit = unit
+        self.typical_test_type_ids = tuple(typical_test_type_ids)
+
+    def __repr__(self):
+        return f"AnalyteRecord({self.name!r})"
+
+
+class TestTypeRecord:
+    """Компактная запись типа теста: число типичных аналитов — знаменатель оценки."""
+    __slots__ = ('id', 'name', 'typical_count')
+
+    def __init__(self, id, name, typical_count=0):
+        self.id = id
+        self.name = name
+        self.typical_count = typical_count
+
+    def __repr__(self):
+        return f"TestTypeRecord({self.name!r})"
+
+
+class TestTypeCandidate:
+    """Тип теста с долей найденных типичных аналитов (score, %)."""
+    __slots__ = ('test_type', 'matched', 'score')
+
+    def __init__(self, test_type, matched, score):
+        self.test_type = test_type
+        self.matched = matched
+        self.score = score
+
+    def __repr__(self):
+        return f"TestTypeCandidate({self.test_type.name!r}, {self.matched}/{self.test_type.typical_count}, {self.score:.1f}%)"
+
+
+class AliasIndex:
+    """
+    Неизменяемый снимок словаря аналитов: алиас -> AnalyteRecord, алиасы в порядке
+    приоритета (длиннее — раньше) и построенный по ним AliasMatcher.
+
+    ``test_types`` — записи типов тестов в порядке TestType.Meta.ordering; вместе
+    с AnalyteRecord.typical_test_type_ids образуют обратный индекс для rank_test_types().
+
+    ``version`` — хэш содержимого словаря; одинаков во всех процессах для одних
+    и тех же данных.
+    """
+    __slots__ = ('version', 'generation', 'analytes', 'test_types', 'alias_map', 'sorted_aliases', 'matcher', '_cell_matches')
+
+    def __init__(self, analytes, test_types=(), generation=None):
+        self.generation = generation
+        self.analytes = {record.id: record for record in analytes}
+        self.test_types = {record.id: record for record in test_types}
+        alias_map = {}
+        for record, aliases in analytes.items():
+            for alias in aliases:
+                if not alias: continue
+                existing = alias_map.get(alias)
+                # При конфликте алиасов побеждает аналит с более длинным именем (как раньше)
+                if existing is None or len(record.name) > len(existing.name):
+                    alias_map[alias] = record
+        self.alias_map = alias_map
+        self.sorted_aliases = sorted(alias_map.keys(), key=len, reverse=True)
+        self.matcher = AliasMatcher(self.sorted_aliases)
+        self.version = self._compute_version()
+        self._cell_matches = {}
+
+    def _compute_version(self):
+        digest = hashlib.sha1()
+        for alias in sorted(self.alias_map):
+            record = self.alias_map[alias]
+            digest.update(f"{alias}\x1f{record.id}\x1f{record.name}\x1f{record.unit}\x1e".encode('utf-8'))
+        for record in self.analytes.values():
+            digest.update(f"{record.id}\x1f{sorted(record.typical_test_type_ids)}\x1e".encode('utf-8'))
+        for record in self.test_types.values():
+            digest.update(f"{record.id}\x1f{record.name}\x1e".encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.alias_map)
+
+    def find_in_cell(self, text, accept=None):
+        """
+        find_best() для ячейки названия в таблице (см. data/layouts.py). Названия
+        в отчетах одной лаборатории повторяются дословно, поэтому совпадения ячейки
+        запоминаются (до CELL_MATCH_CACHE_SIZE ячеек на снимок словаря).
+        """
+        ranked = self._cell_matches.get(text)
+        if ranked is None:
+            if len(self._cell_matches) >= CELL_MATCH_CACHE_SIZE:
+                self._cell_matches.clear()
+            ranked = self._cell_matches[text] = self.matcher.ranked_matches(text)
+        return AliasMatcher.pick(ranked, accept)
+
+    def rank_test_types(self, found_analyte_ids):
+        """
+        Кандидаты типа теста по найденным аналитам без обращений к БД: один проход
+        по аналитам через обратный индекс. Оценка — процент типичных аналитов типа,
+        найденных в документе. Сортировка по убыванию оценки, при равенстве —
+        в порядке TestType.Meta.ordering. Типы без совпадений не возвращаются.
+        """
+        matched = defaultdict(int)
+        for analyte_id in set(found_analyte_ids):
+            record = self.analytes.get(analyte_id)
+            if record is None: continue
+            for test_type_id in record.typical_test_type_ids:
+                matched[test_type_id] += 1
+        candidates = [
+            TestTypeCandidate(test_type, matched[test_type.id], matched[test_type.id] / test_type.typical_count * 100)
+            for test_type in self.test_types.values()
+            if test_type.id in matched and test_type.typical_count
+        ]
+        candidates.sort(key=lambda candidate: candidate.score, reverse=True)
+        return candidates
+
+
+_index_lock = threading.Lock()
+_alias_index = None
+_local_generation = 0
+
+
+def _current_generation():
+    try:
+        shared_generation = cache.get(ALIAS_INDEX_GENERATION_KEY, 0)
+    except Exception as cache_err:
+        logger.warning(f"Could not read alias index generation from cache: {cache_err}")
+        shared_generation = 0
+    return (_local_generation, shared_generation)
+
+
+def build_alias_index(generation=None):
+    """Загружает словарь аналитов из БД одной выборкой по нужным колонкам."""
+    type_ids_by_analyte = defaultdict(list)
+    links = Analyte.typical_test_types.through.objects.values_list('analyte_id', 'testtype_id')
+    for analyte_id, test_type_id in links:
+        type_ids_by_analyte[analyte_id].append(test_type_id)
+
+    typical_counts = defaultdict(int)
+    for type_ids in type_ids_by_analyte.values():
+        for test_type_id in type_ids:
+            typical_counts[test_type_id] += 1
+    test_types = [
+        TestTypeRecord(test_type_id, name, typical_counts[test_type_id])
+        for test_type_id, name in TestType.objects.values_list('id', 'name')
+    ]
+
+    analytes = {}
+    rows = Analyte.objects.order_by('name').values_list(
+        'id', 'name', 'name_en', 'name_ru', 'name_kk', 'abbreviations', 'unit'
+    )
+    for analyte_id, name, name_en, name_ru, name_kk, abbreviations, unit in rows:
+        record = AnalyteRecord(analyte_id, name, unit, type_ids_by_analyte.get(analyte_id, ()))
+        analytes[record] = Analyte.collect_names(name, name_en, name_ru, name_kk, abbreviations)
+    return AliasIndex(analytes, test_types, generation=generation)
+
+
+def get_alias_index():
+    """
+    Возвращает индекс алиасов текущего процесса, строя его лениво при первом
+    обращении и после инвалидации.
+    """
+    global _alias_index
+    generation = _current_generation()
+    index = _alias_index
+    if index is not None and index.generation == generation:
+        return index
+    with _index_lock:
+        index = _alias_index
+        if index is None or index.generation != generation:
+            index = build_alias_index(generation=generation)
+            _alias_index = index
+            logger.info(f"Built analyte alias index v{index.version}: {len(index)} aliases for {len(index.analytes)} analytes, {len(index.test_types)} test types.")
+    return index
+
+
+def rank_test_types(found_analyte_ids):
+    """Ранжированные кандидаты типа теста по текущему индексу (см. AliasIndex.rank_test_types)."""
+    return get_alias_index().rank_test_types(found_analyte_ids)
+
+
+def invalidate_alias_index():
+    """Сбрасывает индекс в этом процессе и увеличивает общий счетчик поколений."""
+    global _local_generation
+    with _index_lock:
+        _local_generation += 1
+    try:
+        cache.add(ALIAS_INDEX_GENERATION_KEY, 0, timeout=None)
+        cache.incr(ALIAS_INDEX_GENERATION_KEY)
+    except Exception as cache_err:
+        logger.warning(f"Could not bump alias index generation in cache: {cache_err}")
+
+
+
+# --- Снимки версий словаря (выбор загрузок для повторного разбора, data/reparse.py) ---
+_recorded_versions = set()
+
+
+def dictionary_entries(index):
+    """Алиасы индекса в виде снимка: алиас -> [id аналита, имя, единица]."""
+    return {alias: [str(record.id), record.name, record.unit] for alias, record in index.alias_map.items()}
+
+
+def dictionary_test_types(index):
+    """Типы тестов индекса в виде снимка: id типа -> [имя, отсортированные id типичных аналитов]."""
+    typical = defaultdict(list)
+    for record in index.analytes.values():
+        for test_type_id in record.typical_test_type_ids:
+            typical[test_type_id].append(str(record.id))
+    return {str(record.id): [record.name, sorted(typical[record.id])] for record in index.test_types.values()}
+
+
+def record_dictionary_snapshot(index):
+    """Сохраняет снимок алиасов и типов тестов версии index (в процессе — один раз на версию)."""
+    if index.version in _recorded_versions:
+        return
+    AnalyteDictionarySnapshot.objects.get_or_create(
+        version=index.version,
+        defaults={'aliases': dictionary_entries(index), 'test_types': dictionary_test_types(index)},
+    )
+    _recorded_versions.add(index.version)
+
+
+def changed_aliases(old_entries, new_entries):
+    """Алиасы, добавленные, удаленные или перенесенные на другой аналит (единицу) между снимками."""
+    return {alias for alias in old_entries.keys() | new_entries.keys() if old_entries.get(alias) != new_entries.get(alias)}
+
+
+# --- Сигналы: изменения словаря инвалидируют индекс после коммита транзакции ---
+@receiver(post_save, sender=Analyte)
+@receiver(post_delete, sender=Analyte)
+@receiver(post_save, sender=TestType)
+@receiver(post_delete, sender=TestType)
+@receiver(m2m_changed, sender=Analyte.typical_test_types.through)
+def _invalidate_on_dictionary_change(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('pre_'):
+        return
+    transaction.on_commit(invalidate_alias_index)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class DataConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'data'
+
+    def ready(self):
+        # Регистрирует обработчики сигналов, инвалидирующие кэш словаря аналитов
+        from . import analyte_index  # noqa: F401
+        # PRAGMA для каждого нового соединения SQLite (WAL, busy_timeout и др.)
+        from . import db  # noqa: F401
+        # Пересчет рядов значений аналитов при удалении загрузок
+        from . import series  # noqa: F401
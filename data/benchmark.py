@@ -0,0 +1,340 @@
+# ==============================================================================
+# Файл: data/benchmark.py
+# Описание: Бенчмарк конвейера обработки PDF (data.tasks) на синтетическом корпусе.
+# Каждая стадия замеряется отдельно: пропускная способность, p50/p99 задержки
+# и пиковая память (tracemalloc). Запуск: python manage.py benchmark_ingest
+# ==============================================================================
+import datetime
+import logging
+import math
+import platform
+import random
+import re
+import time
+import tracemalloc
+import uuid
+from decimal import Context, ROUND_HALF_UP
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .analyte_index import get_alias_index
+from .extraction import EXTRACTION_BACKENDS, extraction_processes, get_extraction_backend, iter_pdf_pages
+from .models import Analyte, MedicalTestSubmission, TestResult
+from .tasks import (
+    determine_test_type, extract_test_date, process_pdf_submission_plain,
+    save_results_in_batches, tokenize_result_line,
+)
+
+STAGES = (
+    'extraction', 'date_extraction', 'alias_matching', 'value_parsing',
+    'db_write', 'test_type_detection', 'end_to_end',
+)
+
+_ASCII_RE = re.compile(r'^[\x20-\x7e]+$')
+STATUS_TEXTS = ('В норме', 'Выше нормы', 'Ниже нормы')
+
+# Параметры синтетической страницы PDF (A4, Helvetica 9pt)
+_PAGE_WIDTH, _PAGE_HEIGHT = 595, 842
+_FONT_SIZE, _LINE_HEIGHT, _MARGIN = 9, 12, 40
+
+
+class _RolledBack(Exception):
+    """Откат транзакции бенчмарка: стадии с записью в БД не оставляют данных."""
+
+
+# --- Синтетический корпус ---
+def _latin_alias(analyte_names):
+    """Первый алиас, который можно набрать стандартным шрифтом PDF (только ASCII)."""
+    for name in analyte_names:
+        if name and _ASCII_RE.match(name):
+            return name
+    return None
+
+
+def _result_line(rng, name, unit, with_status=True):
+    low = round(rng.uniform(0.5, 50), 1)
+    high = round(low * rng.uniform(1.5, 4), 1)
+    value = round(rng.uniform(low * 0.6, high * 1.3), 2)
+    line = f"{name} {value} {low} - {high}"
+    if unit:
+        line += f" {unit}"
+    if with_status:
+        line += f" {rng.choice(STATUS_TEXTS)}"
+    return line
+
+
+def build_corpus(documents=10, seed=42):
+    """
+    Синтетические отчеты: в каждом все аналиты словаря в случайном порядке.
+
+    Текстовые отчеты используют основные (кириллические) имена. PDF собираются
+    стандартным шрифтом Helvetica без встраивания, поэтому в них попадают только
+    аналиты с ASCII-алиасом (name_en или аббревиатура) и ASCII-единицей.
+    """
+    rng = random.Random(seed)
+    analytes = list(Analyte.objects.order_by('name').values_list(
+        'name', 'name_en', 'abbreviations', 'unit'
+    ))
+    corpus = {'texts': [], 'pdfs': [], 'analytes': len(analytes), 'pdf_analytes': 0}
+    pdf_rows = []
+    for name, name_en, abbreviations, unit in analytes:
+        alias = _latin_alias([name_en] + [abbr.strip() for abbr in (abbreviations or '').split(',')])
+        if alias:
+            pdf_rows.append((alias, unit if unit and _ASCII_RE.match(unit) else ''))
+    corpus['pdf_analytes'] = len(pdf_rows)
+
+    for number in range(documents):
+        test_date = datetime.date(2024, 1, 1) + datetime.timedelta(days=rng.randrange(600))
+        rows = analytes[:]
+        rng.shuffle(rows)
+        header = [
+            'Лабораторный отчет (синтетический)',
+            f"Дата взятия биоматериала: {test_date.strftime('%d.%m.%Y')}",
+            'Показатель Результат Норма Ед. изм. Статус',
+        ]
+        lines = header + [_result_line(rng, row[0], row[3]) for row in rows]
+        corpus['texts'].append('\n'.join(lines))
+
+        rows = pdf_rows[:]
+        rng.shuffle(rows)
+        lines = [
+            f'Synthetic lab report {number + 1}',
+            f"Test Date: {test_date.strftime('%d.%m.%Y')}",
+        ] + [_result_line(rng, alias, unit, with_status=False) for alias, unit in rows]
+        corpus['pdfs'].append(build_pdf(lines))
+    return corpus
+
+
+def _pdf_string(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_pdf(lines):
+    """Минимальный PDF без внешних зависимостей: строки текста Helvetica, несколько страниц."""
+    per_page = (_PAGE_HEIGHT - 2 * _MARGIN) // _LINE_HEIGHT
+    pages = [lines[i:i + per_page] for i in range(0, len(lines), per_page)] or [[]]
+    # 1 — каталог, 2 — дерево страниц, 3 — шрифт, далее пары (страница, поток содержимого)
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    }
+    kids = []
+    for index, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * index, 5 + 2 * index
+        kids.append(f'{page_id} 0 R')
+        ops = [f'BT /F1 {_FONT_SIZE} Tf {_LINE_HEIGHT} TL {_MARGIN} {_PAGE_HEIGHT - _MARGIN} Td']
+        ops += [f'({_pdf_string(line)}) Tj T*' for line in page_lines]
+        ops.append('ET')
+        stream = '\n'.join(ops).encode('latin-1', 'replace')
+        objects[content_id] = b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream)
+        objects[page_id] = (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_PAGE_WIDTH} {_PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode('ascii')
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode('ascii')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b'%d 0 obj\n%s\nendobj\n' % (object_id, objects[object_id])
+    xref_offset = len(output)
+    size = max(objects) + 1
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % size
+    for object_id in range(1, size):
+        output += b'%010d 00000 n \n' % offsets[object_id]
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref_offset)
+    return bytes(output)
+
+
+# --- Замеры ---
+def _percentile(ordered, percent):
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _measure(items, fn, unit):
+    """
+    Прогоняет fn по items дважды: без трассировки — для задержек, и под
+    tracemalloc — для пиковой памяти (трассировка заметно искажает время).
+    """
+    durations = []
+    for item in items:
+        started = time.perf_counter()
+        fn(item)
+        durations.append(time.perf_counter() - started)
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    for item in items:
+        fn(item)
+    _, peak = tracemalloc.get_traced_memory()
+    if not was_tracing:
+        tracemalloc.stop()
+
+    ordered = sorted(durations)
+    total = sum(durations)
+    return {
+        'unit': unit,
+        'items': len(durations),
+        'total_s': round(total, 4),
+        'throughput_per_s': round(len(durations) / total, 1) if total else None,
+        'p50_ms': round(_percentile(ordered, 50) * 1000, 3) if ordered else None,
+        'p99_ms': round(_percentile(ordered, 99) * 1000, 3) if ordered else None,
+        'peak_memory_kib': round(max(peak - baseline, 0) / 1024, 1),
+    }
+
+
+def _parse_segment(analyte, line, match_end):
+    """Разбор значения/единицы/диапазона/статуса — как в основном цикле data.tasks."""
+    tokens = tokenize_result_line(line, match_end, analyte.unit)
+    if not tokens:
+        return None
+    value_str, unit, ref_range = tokens.value, tokens.unit, tokens.reference_range
+    status_text, is_abnormal = tokens.status_text, tokens.is_abnormal
+    value_numeric = Context(prec=14, rounding=ROUND_HALF_UP).create_decimal(value_str)
+    if is_abnormal is None and ref_range:
+        low, high = tokens.lower_bound, tokens.upper_bound
+        if low is not None and value_numeric < low: is_abnormal = True
+        elif high is not None and value_numeric > high: is_abnormal = True
+        elif low is not None and high is not None: is_abnormal = False
+    return dict(
+        analyte_id=analyte.id, value=value_str[:100], value_numeric=value_numeric,
+        unit=(unit[:50] if unit else analyte.unit), reference_range=ref_range,
+        ref_low=tokens.lower_bound, ref_high=tokens.upper_bound,
+        status_text=status_text, is_abnormal=is_abnormal,
+    )
+
+
+def _match_document(alias_index, text):
+    """Совпадения алиасов по строкам документа: [(analyte, line, match_end)]."""
+    taken, matches = set(), []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        best = alias_index.matcher.find_best(line, accept=lambda alias: alias_index.alias_map[alias].id not in taken)
+        if best:
+            analyte = alias_index.alias_map[best[0]]
+            taken.add(analyte.id)
+            matches.append((analyte, line, best[2]))
+    return matches
+
+
+def _run_in_rollback(fn):
+    """Выполняет fn в транзакции, которая всегда откатывается."""
+    try:
+        with transaction.atomic():
+            fn()
+            raise _RolledBack()
+    except _RolledBack:
+        pass
+
+
+def run_benchmark(documents=10, seed=42, stages=STAGES, backends=None):
+    """Строит корпус, прогоняет выбранные стадии и возвращает отчет (dict, готовый к JSON)."""
+    stages = [stage for stage in STAGES if stage in stages]
+    backends = backends or list(EXTRACTION_BACKENDS)
+    previous_disable = logging.root.manager.disable
+    # Логи парсера (DEBUG на каждую строку) не должны попадать в замеры
+    logging.disable(logging.WARNING)
+    try:
+        corpus_started = time.perf_counter()
+        corpus = build_corpus(documents=documents, seed=seed)
+        alias_index = get_alias_index()
+        report = {
+            'meta': {
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'default_text_backend': get_extraction_backend().name,
+                'lab_layout_templates': getattr(settings, 'LAB_LAYOUT_TEMPLATES', False),
+                'extraction_processes': extraction_processes(),
+                'alias_index_version': alias_index.version,
+                'seed': seed,
+            },
+            'corpus': {
+                'documents': documents,
+                'analytes': corpus['analytes'],
+                'pdf_analytes': corpus['pdf_analytes'],
+                'text_lines': sum(text.count('\n') + 1 for text in corpus['texts']),
+                'pdf_bytes': sum(len(pdf) for pdf in corpus['pdfs']),
+                'build_s': round(time.perf_counter() - corpus_started, 3),
+            },
+            'stages': {},
+        }
+        _run_stages(report['stages'], stages, backends, corpus, alias_index)
+        return report
+    finally:
+        logging.disable(previous_disable)
+
+
+def _run_stages(results, stages, backends, corpus, alias_index):
+    texts = corpus['texts']
+    stored_pdfs = []
+    try:
+        if 'extraction' in stages or 'end_to_end' in stages:
+            for pdf in corpus['pdfs']:
+                stored_pdfs.append(default_storage.save(f'benchmark/{uuid.uuid4().hex}.pdf', ContentFile(pdf)))
+        pdf_paths = [default_storage.path(name) for name in stored_pdfs]
+
+        if 'extraction' in stages:
+            # Тот же путь, что и в обработке: пул процессов извлечения и, с шаблонами
+            # раскладки, страницы вместе с рамками слов
+            layouts = getattr(settings, 'LAB_LAYOUT_TEMPLATES', False)
+            for name in backends:
+                backend = EXTRACTION_BACKENDS[name]
+                results[f'extraction_{name}'] = _measure(
+                    pdf_paths, lambda path: list(iter_pdf_pages(path, backend, layouts)), 'document'
+                )
+
+        if 'date_extraction' in stages:
+            results['date_extraction'] = _measure(texts, extract_test_date, 'document')
+
+        all_lines = [line for text in texts for line in text.split('\n')]
+        if 'alias_matching' in stages:
+            results['alias_matching'] = _measure(all_lines, alias_index.matcher.find_best, 'line')
+
+        matches = [match for text in texts for match in _match_document(alias_index, text)]
+        if 'value_parsing' in stages:
+            results['value_parsing'] = _measure(matches, lambda match: _parse_segment(*match), 'matched line')
+
+        parsed_documents = [
+            [row for row in (_parse_segment(*match) for match in _match_document(alias_index, text)) if row]
+            for text in texts
+        ]
+        if 'db_write' in stages or 'test_type_detection' in stages or 'end_to_end' in stages:
+            def _db_stages():
+                user = get_user_model().objects.create(
+                    username=f'benchmark-{uuid.uuid4().hex[:12]}', email=f'benchmark-{uuid.uuid4().hex[:12]}@example.invalid',
+                )
+                if 'db_write' in stages:
+                    def _write(rows):
+                        submission = MedicalTestSubmission.objects.create(user=user, uploaded_file='benchmark/none.pdf')
+                        save_results_in_batches([TestResult(submission=submission, **row) for row in rows])
+                    results['db_write'] = _measure(parsed_documents, _write, 'document')
+                if 'test_type_detection' in stages:
+                    results['test_type_detection'] = _measure(
+                        [[row['analyte_id'] for row in rows] for rows in parsed_documents],
+                        determine_test_type, 'document',
+                    )
+                if 'end_to_end' in stages:
+                    def _process(name):
+                        submission = MedicalTestSubmission.objects.create(user=user, uploaded_file=name)
+                        process_pdf_submission_plain(submission.id)
+                    results['end_to_end'] = _measure(stored_pdfs, _process, 'document')
+            _run_in_rollback(_db_stages)
+    finally:
+        for name in stored_pdfs:
+            default_storage.delete(name)
@@ -0,0 +1,66 @@
+# ==============================================================================
+# Файл: data/db.py
+# Описание: Настройка соединений SQLite (PRAGMA при открытии каждого соединения):
+# WAL, synchronous, busy_timeout, mmap и размер кэша страниц — чтобы чтение
+# API не ждало записи воркеров загрузки, а конкурирующие записи ждали
+# блокировку, а не падали с "database is locked". Значения — SQLITE_* в settings.
+# Режим журнала хранится в файле БД: смена режима пишется в лог (INFO).
+# ==============================================================================
+import logging
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def sqlite_pragmas():
+    """PRAGMA соединения по настройкам: [(имя, значение), ...]; пустые настройки пропускаются."""
+    pragmas = []
+    journal_mode = (getattr(settings, 'SQLITE_JOURNAL_MODE', 'WAL') or '').upper()
+    if journal_mode:
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"SQLITE_JOURNAL_MODE must be one of {', '.join(JOURNAL_MODES)}, got '{journal_mode}'.")
+        pragmas.append(('journal_mode', journal_mode))
+    synchronous = (getattr(settings, 'SQLITE_SYNCHRONOUS', 'NORMAL') or '').upper()
+    if synchronous:
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SYNCHRONOUS_MODES)}, got '{synchronous}'.")
+        pragmas.append(('synchronous', synchronous))
+    # Пустое значение настройки (None) — PRAGMA не меняется
+    for name, setting, default in (
+        ('busy_timeout', 'SQLITE_BUSY_TIMEOUT_MS', 5000),
+        ('mmap_size', 'SQLITE_MMAP_SIZE', 0),
+        ('cache_size', 'SQLITE_CACHE_SIZE', None),
+    ):
+        value = getattr(settings, setting, default)
+        if value is not None:
+            pragmas.append((name, int(value)))
+    return pragmas
+
+
+@receiver(connection_created, dispatch_uid='data.db.configure_sqlite_connection')
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Обработчик connection_created: PRAGMA для каждого нового соединения SQLite."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas():
+            if name == 'journal_mode':
+                cursor.execute("PRAGMA journal_mode")
+                previous = cursor.fetchone()[0].upper()
+                if previous == value:
+                    continue
+            cursor.execute(f"PRAGMA {name} = {value}")
+            if name == 'journal_mode' and not connection.is_in_memory_db():
+                # Режим журнала хранится в файле БД; он может и не смениться (файл на сетевом диске)
+                applied = cursor.fetchone()[0].upper()
+                if applied != value:
+                    logger.warning(f"SQLite journal_mode {value} requested, database uses {applied}.")
+                else:
+                    logger.info(f"SQLite database {connection.settings_dict['NAME']} switched from journal_mode {previous} to {applied}.")
+
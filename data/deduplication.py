@@ -0,0 +1,118 @@
+# ==============================================================================
+# Файл: data/deduplication.py
+# Описание: Повторные загрузки одного и того же PDF: поиск по SHA-256 содержимого,
+# переиспользование файла и результатов уже обработанной загрузки.
+# ==============================================================================
+import hashlib
+import logging
+
+from django.conf import settings
+
+from .models import ExtractedTextPage, ExtractedTextToken, MedicalTestSubmission, TestResult, UnrecognizedResultLine
+from .series import refresh_submission_series
+
+logger = logging.getLogger(__name__)
+
+Status = MedicalTestSubmission.StatusChoices
+
+
+def _copy_fields(model):
+    """Поля модели, копируемые при клонировании (все, кроме первичного ключа и загрузки)."""
+    return [field.attname for field in model._meta.concrete_fields if field.name not in ('id', 'submission')]
+
+
+_RESULT_COPY_FIELDS = _copy_fields(TestResult)
+_UNRECOGNIZED_COPY_FIELDS = _copy_fields(UnrecognizedResultLine)
+
+
+def deduplication_enabled():
+    return getattr(settings, 'INGEST_DEDUPLICATE_UPLOADS', True)
+
+
+def file_sha256(uploaded_file):
+    """
+    SHA-256 загруженного файла. Обычно уже посчитан обработчиком загрузки
+    (data/uploadhandlers.py); иначе файл читается по чанкам.
+    """
+    digest = getattr(uploaded_file, 'content_sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha256.update(chunk)
+    uploaded_file.seek(0)
+    return sha256.hexdigest()
+
+
+def find_duplicate_submission(user, content_sha256):
+    """
+    Ищет среди загрузок пользователя ту же самую по содержимому, файл которой
+    еще лежит в хранилище. Предпочтение — последней успешно обработанной.
+    """
+    candidates = MedicalTestSubmission.objects.filter(
+        user=user, content_sha256=content_sha256
+    ).exclude(uploaded_file='').order_by('-submission_date')
+    fallback = None
+    for candidate in candidates:
+        if not candidate.uploaded_file.storage.exists(candidate.uploaded_file.name):
+            continue
+        if candidate.processing_status == Status.COMPLETED:
+            return candidate
+        if fallback is None:
+            fallback = candidate
+    return fallback
+
+
+def clone_completed_submission(source, user, test_type=None, test_date=None, notes=None):
+    """
+    Создает новую загрузку, ссылающуюся на файл source, и копирует его
+    извлеченный текст, распознанные результаты и строки неизвестных аналитов
+    (UnrecognizedResultLine) без повторного парсинга.
+    """
+    results = list(source.results.values_list(*_RESULT_COPY_FIELDS))
+    submission = MedicalTestSubmission.objects.create(
+        user=user,
+        test_type=test_type or source.test_type,
+        test_date=test_date or source.test_date,
+        notes=notes,
+        uploaded_file=source.uploaded_file.name,
+        content_sha256=source.content_sha256,
+        dictionary_version=source.dictionary_version,
+        processing_status=Status.COMPLETED,
+        processing_details=(
+            f"Duplicate of submission {source.id}: reused extracted text and {len(results)} parsed results.\n---\n"
+            f"{source.processing_details or ''}"
+        ),
+    )
+    # Страницы текста копируются как есть, без повторного сжатия
+    ExtractedTextPage.objects.bulk_create([
+        ExtractedTextPage(
+            submission=submission, page_number=page.page_number, start_offset=page.start_offset,
+            char_count=page.char_count, compressed_text=page.compressed_text,
+        )
+        for page in source.text_pages.all()
+    ])
+    ExtractedTextToken.objects.bulk_create([
+        ExtractedTextToken(submission=submission, token=token)
+        for token in source.text_tokens.values_list('token', flat=True)
+    ])
+    TestResult.objects.bulk_create([
+        TestResult(submission=submission, **dict(zip(_RESULT_COPY_FIELDS, values)))
+        for values in results
+    ])
+    UnrecognizedResultLine.objects.bulk_create([
+        UnrecognizedResultLine(submission=submission, **dict(zip(_UNRECOGNIZED_COPY_FIELDS, values)))
+        for values in source.unrecognized_lines.values_list(*_UNRECOGNIZED_COPY_FIELDS)
+    ])
+    refresh_submission_series(submission.id)
+    logger.info(f"Submission {submission.id} cloned from duplicate {source.id} ({len(results)} results).")
+    return submission
+
+
+def is_file_shared(submission):
+    """Ссылаются ли на файл этой загрузки другие загрузки (тогда файл удалять нельзя)."""
+    if not submission.uploaded_file:
+        return False
+    return MedicalTestSubmission.objects.filter(
+        uploaded_file=submission.uploaded_file.name
+    ).exclude(id=submission.id).exists()
@@ -0,0 +1,165 @@
+# ==============================================================================
+# Файл: data/executor.py
+# Описание: Ограниченный пул потоков для фоновой обработки загрузок в веб-процессе.
+# ==============================================================================
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .ingest_queue import claim_submission, get_lease_keeper, make_worker_id
+from .models import MedicalTestSubmission
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedExecutor:
+    """
+    Пул из ``max_workers`` потоков с ограничением на число ожидающих задач.
+
+    Всего в пуле одновременно может находиться ``max_workers + queue_limit``
+    задач; при переполнении ``submit`` возвращает False вместо того, чтобы
+    бесконечно наращивать очередь.
+    """
+
+    def __init__(self, max_workers, queue_limit, thread_name_prefix='ingest'):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._slots = threading.BoundedSemaphore(max_workers + queue_limit)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._running = 0
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.queue_limit
+
+    def free_slots(self):
+        with self._lock:
+            return self.capacity - self._in_flight
+
+    def submit(self, fn, *args, **kwargs):
+        """Ставит задачу в пул; возвращает False, если пул заполнен."""
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._in_flight += 1
+        try:
+            self._pool.submit(self._run, fn, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        return True
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self._running += 1
+        try:
+            fn(*args, **kwargs)
+        except Exception as exc:
+            logger.exception(f"Background job {getattr(fn, '__name__', fn)} failed: {exc}")
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            in_flight, running = self._in_flight, self._running
+        return {
+            'workers': self.max_workers,
+            'queue_limit': self.queue_limit,
+            'running': running,
+            'queued': in_flight - running,
+            'free_slots': self.capacity - in_flight,
+        }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_ingest_executor():
+    """Возвращает общий для процесса пул обработки загрузок (создается лениво)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BoundedExecutor(
+                    max_workers=getattr(settings, 'INGEST_WORKER_POOL_SIZE', 2),
+                    queue_limit=getattr(settings, 'INGEST_WORKER_QUEUE_LIMIT', 50),
+                )
+    return _executor
+
+
+def ingest_backend():
+    """'thread' — ограниченный пул в веб-процессе, 'queue' — воркеры run_ingest_worker."""
+    return getattr(settings, 'INGEST_BACKEND', 'thread')
+
+
+def has_ingest_capacity(count):
+    """Можно ли сейчас принять count новых файлов на обработку."""
+    if ingest_backend() == 'queue':
+        return True
+    return get_ingest_executor().free_slots() >= count
+
+
+def _run_submission_job(submission_id):
+    """
+    Обертка задачи: свежее соединение с БД на входе, захват аренды с heartbeat
+    на время обработки и закрытие соединения на выходе.
+    """
+    from .tasks import process_pdf_submission_plain
+
+    close_old_connections()
+    owner = make_worker_id('web')
+    try:
+        if not claim_submission(submission_id, owner):
+            logger.warning(f"Submission {submission_id} was already claimed; skipping in-process job.")
+            return
+        with get_lease_keeper().hold(owner):
+            process_pdf_submission_plain(submission_id, lease_owner=owner)
+    finally:
+        connection.close()
+
+
+def _dispatch_submission(submission_id):
+    try:
+        accepted = get_ingest_executor().submit(_run_submission_job, submission_id)
+    except Exception as exc:
+        logger.exception(f"Failed to queue background processing for submission {submission_id}: {exc}")
+        accepted, reason = False, f"Failed to queue processing: {str(exc)[:500]}"
+    else:
+        reason = "Processing queue is full. Please re-upload the file later."
+    if accepted:
+        logger.info(f"Queued submission {submission_id} for background processing.")
+        return
+    logger.warning(f"Could not queue submission {submission_id}: {reason}")
+    MedicalTestSubmission.objects.filter(
+        id=submission_id, processing_status=MedicalTestSubmission.StatusChoices.PENDING
+    ).update(
+        processing_status=MedicalTestSubmission.StatusChoices.FAILED,
+        processing_details=reason, updated_at=timezone.now()
+    )
+
+
+def schedule_submission_processing(submission_id):
+    """
+    Планирует обработку загрузки после коммита текущей транзакции, чтобы поток
+    не начал читать запись, которая еще не видна другим соединениям.
+    В режиме INGEST_BACKEND='queue' запись просто остается PENDING и будет
+    забрана командой run_ingest_worker.
+    """
+    if ingest_backend() == 'queue':
+        logger.info(f"Submission {submission_id} left PENDING for the durable ingest queue.")
+        return
+    transaction.on_commit(lambda: _dispatch_submission(submission_id))
@@ -0,0 +1,290 @@
+# ==============================================================================
+# Файл: data/extraction.py
+# Описание: Извлечение текста из PDF. Бэкенды: pypdfium2 (нативный, быстрый)
+# и pdfplumber (посимвольная раскладка на чистом Python, медленнее, но точнее
+# восстанавливает строки). Длинные документы можно разбирать диапазонами
+# страниц в пуле процессов. Вместе с текстом бэкенды отдают рамки слов/ячеек
+# страницы (PageLayout) для разбора таблиц по колонкам (см. data/layouts.py).
+# Модуль не импортирует модели: при spawn он загружается в дочерних процессах.
+# ==============================================================================
+import datetime
+import logging
+import math
+import multiprocessing
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pdfplumber
+import pypdfium2 as pdfium
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger('data.tasks')
+
+PAGE_BREAK_MARKER = '<-- Page Break -->'
+PAGE_SEPARATOR = f"\n{PAGE_BREAK_MARKER}\n"
+
+# Дата PDF: "D:YYYYMMDDHHmmSS+hh'mm'" (часть после даты не нужна)
+PDF_DATE_PATTERN = re.compile(r'^(?:D:)?(\d{4})(\d{2})(\d{2})')
+
+EXTRACT_TEXT_OPTIONS = {'x_tolerance': 1.5, 'y_tolerance': 1.5, 'layout': False}
+EXTRACT_WORDS_OPTIONS = {'x_tolerance': 1.5, 'y_tolerance': 1.5}
+
+WORD_PATTERN = re.compile(r'\S+')
+
+# Рамка слова на странице: top — от верхнего края страницы, x0/x1 — слева
+TextBox = namedtuple('TextBox', 'top x0 x1 text')
+# Текст страницы, ее размеры и рамки текста
+PageLayout = namedtuple('PageLayout', 'text width height boxes')
+
+# PDFium не потокобезопасен: все обращения к нему в процессе сериализуются
+_pdfium_lock = threading.Lock()
+
+
+class PdfplumberBackend:
+    """Текст по раскладке символов pdfplumber (исходный способ извлечения)."""
+    name = 'pdfplumber'
+
+    def page_count(self, pdf_path):
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
+
+    def iter_pages(self, pdf_path, start=0, stop=None):
+        """
+        Тексты страниц по одной. Кэш разобранных объектов страницы сбрасывается
+        сразу после извлечения, иначе pdfplumber держит в памяти все страницы документа.
+        """
+        return self._iter(pdf_path, start, stop, lambda page, text: text)
+
+    def iter_page_layouts(self, pdf_path, start=0, stop=None):
+        """PageLayout страниц: слова извлекаются из уже разобранных символов страницы."""
+        return self._iter(pdf_path, start, stop, lambda page, text: PageLayout(
+            text, float(page.width), float(page.height),
+            [TextBox(word['top'], word['x0'], word['x1'], word['text'])
+             for word in page.extract_words(**EXTRACT_WORDS_OPTIONS)],
+        ))
+
+    def _iter(self, pdf_path, start, stop, read):
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages[start:stop]:
+                try:
+                    yield read(page, page.extract_text(**EXTRACT_TEXT_OPTIONS) or "")
+                finally:
+                    page.close()
+
+
+class PdfiumBackend:
+    """Нативное извлечение текста PDFium (pypdfium2, уже зависимость pdfplumber)."""
+    name = 'pdfium'
+
+    def page_count(self, pdf_path):
+        with _pdfium_lock:
+            document = pdfium.PdfDocument(pdf_path)
+            try:
+                return len(document)
+            finally:
+                document.close()
+
+    def iter_pages(self, pdf_path, start=0, stop=None):
+        return self._iter(pdf_path, start, stop, lambda page, text_page, text: text)
+
+    def iter_page_layouts(self, pdf_path, start=0, stop=None):
+        """
+        PageLayout страниц. Рамка слова — по первому и последнему символу (loose:
+        высота по шрифту, а не по глифу, чтобы слова строки имели общий верх);
+        текст get_text_range совпадает с индексами символов PDFium.
+        """
+        return self._iter(pdf_path, start, stop, self._read_layout)
+
+    @staticmethod
+    def _read_layout(page, text_page, text):
+        width, height = page.get_size()
+        boxes = []
+        for word in WORD_PATTERN.finditer(text_page.get_text_range(0, text_page.count_chars())):
+            left, _, _, top = text_page.get_charbox(word.start(), loose=True)
+            right = text_page.get_charbox(word.end() - 1, loose=True)[2]
+            boxes.append(TextBox(height - top, left, right, word.group()))
+        return PageLayout(text, width, height, boxes)
+
+    def _iter(self, pdf_path, start, stop, read):
+        with _pdfium_lock:
+            document = pdfium.PdfDocument(pdf_path)
+            total = len(document)
+        try:
+            for index in range(start, total if stop is None else min(stop, total)):
+                with _pdfium_lock:
+                    page = document[index]
+                    text_page = page.get_textpage()
+                    try:
+                        text = text_page.get_text_bounded().replace('\r\n', '\n').replace('\r', '\n')
+                        item = read(page, text_page, text)
+                    finally:
+                        text_page.close()
+                        page.close()
+                yield item
+        finally:
+            with _pdfium_lock:
+                document.close()
+
+
+EXTRACTION_BACKENDS = {
+    backend.name: backend for backend in (PdfiumBackend(), PdfplumberBackend())
+}
+
+
+def get_extraction_backend(name=None):
+    """Бэкенд по имени; по умолчанию — PDF_TEXT_BACKEND из настроек."""
+    name = name or getattr(settings, 'PDF_TEXT_BACKEND', 'pdfium')
+    try:
+        return EXTRACTION_BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown PDF text backend '{name}'. Available: {', '.join(EXTRACTION_BACKENDS)}."
+        )
+
+
+def get_fallback_backend():
+    """
+    Бэкенд для повторного извлечения, если быстрый дал непригодный текст
+    (PDF_TEXT_FALLBACK_BACKEND; None — без повтора).
+    """
+    name = getattr(settings, 'PDF_TEXT_FALLBACK_BACKEND', 'pdfplumber')
+    return get_extraction_backend(name) if name else None
+
+
+def _iter_backend_pages(backend, pdf_path, start=0, stop=None, layouts=False):
+    if layouts:
+        return backend.iter_page_layouts(pdf_path, start, stop)
+    return backend.iter_pages(pdf_path, start, stop)
+
+
+def _extract_page_range(backend_name, pdf_path, start, stop, layouts=False):
+    """Тексты (или PageLayout) страниц [start, stop) — выполняется в дочернем процессе."""
+    return list(_iter_backend_pages(EXTRACTION_BACKENDS[backend_name], pdf_path, start, stop, layouts))
+
+
+def _page_ranges(page_count, parts):
+    """Делит страницы на не более чем parts непрерывных диапазонов."""
+    size = math.ceil(page_count / parts)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def extraction_processes():
+    return getattr(settings, 'PDF_EXTRACTION_PROCESSES', 0)
+
+
+def _get_pool():
+    """Общий для процесса пул извлечения (создается лениво, spawn — безопасно для потоков)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=extraction_processes(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_pdf_pages(pdf_path, backend=None, layouts=False):
+    """
+    Тексты страниц PDF в исходном порядке, по мере извлечения
+    (с layouts=True — PageLayout с рамками текста).
+
+    Если PDF_EXTRACTION_PROCESSES > 1 и страниц не меньше
+    PDF_PARALLEL_MIN_PAGES, диапазоны страниц разбираются в пуле процессов
+    и отдаются по порядку; при сбое пула оставшиеся страницы извлекаются
+    последовательно.
+    """
+    backend = backend or get_extraction_backend()
+    processes = extraction_processes()
+    if processes <= 1:
+        yield from _iter_backend_pages(backend, pdf_path, layouts=layouts)
+        return
+    page_count = backend.page_count(pdf_path)
+    if page_count < getattr(settings, 'PDF_PARALLEL_MIN_PAGES', 4):
+        yield from _iter_backend_pages(backend, pdf_path, layouts=layouts)
+        return
+
+    ranges = _page_ranges(page_count, processes)
+    done_pages = 0
+    try:
+        pool = _get_pool()
+        futures = [
+            pool.submit(_extract_page_range, backend.name, pdf_path, start, stop, layouts)
+            for start, stop in ranges
+        ]
+        for future in futures:
+            pages = future.result()
+            done_pages += len(pages)
+            yield from pages
+        return
+    except BrokenProcessPool as exc:
+        logger.warning(f"PDF extraction pool broke ({exc}); extracting the rest of {pdf_path} serially.")
+        _reset_pool()
+    yield from _iter_backend_pages(backend, pdf_path, done_pages, layouts=layouts)
+
+
+def extract_pdf_pages(pdf_path, backend=None):
+    """Тексты всех страниц PDF списком."""
+    return list(iter_pdf_pages(pdf_path, backend))
+
+
+def extract_pdf_text(pdf_path, backend=None):
+    """Текст всего PDF со страницами, разделенными PAGE_SEPARATOR; возвращает (текст, число страниц)."""
+    pages = extract_pdf_pages(pdf_path, backend)
+    return PAGE_SEPARATOR.join(pages), len(pages)
+
+
+def pdf_creation_date(pdf_path):
+    """
+    Дата создания документа из метаданных PDF (CreationDate) или None.
+    Читается только словарь Info, страницы не разбираются.
+    """
+    try:
+        with _pdfium_lock:
+            document = pdfium.PdfDocument(pdf_path)
+            try:
+                raw_date = document.get_metadata_value('CreationDate')
+            finally:
+                document.close()
+    except Exception as exc:
+        logger.warning(f"Could not read PDF metadata of {pdf_path}: {exc}")
+        return None
+    match = PDF_DATE_PATTERN.match(raw_date or '')
+    if not match:
+        return None
+    try:
+        return datetime.date(*(int(part) for part in match.groups()))
+    except ValueError:
+        return None
+
+
+def iter_document_lines(pages):
+    """
+    Пары (номер строки, строка) по всему документу без построения общего текста.
+    Нумерация совпадает с PAGE_SEPARATOR.join(pages).split('\n').
+    """
+    line_number = 0
+    for page_number, page_text in enumerate(pages):
+        if page_number:
+            yield line_number, PAGE_BREAK_MARKER
+            line_number += 1
+        for line in page_text.split('\n'):
+            yield line_number, line
+            line_number += 1
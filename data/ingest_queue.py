@@ -0,0 +1,209 @@
+# ==============================================================================
+# Файл: data/ingest_queue.py
+# Описание: Устойчивая очередь обработки PDF поверх MedicalTestSubmission.
+# Очередь = записи со статусом PENDING; взятая в работу запись получает аренду
+# (lease_owner + lease_expires_at), которую воркер продлевает heartbeat-ом.
+# Если воркер упал, аренда истекает и запись снова становится доступной.
+# ==============================================================================
+import datetime
+import logging
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import MedicalTestSubmission
+
+logger = logging.getLogger(__name__)
+
+Status = MedicalTestSubmission.StatusChoices
+
+# Внутри процесса захват сериализуется всегда; для БД без SKIP LOCKED (SQLite)
+# это и есть режим единственного захватчика.
+_claim_lock = threading.Lock()
+
+
+def lease_duration():
+    return datetime.timedelta(seconds=getattr(settings, 'INGEST_LEASE_SECONDS', 300))
+
+
+def max_attempts():
+    return getattr(settings, 'INGEST_MAX_ATTEMPTS', 3)
+
+
+def make_worker_id(prefix='worker'):
+    """Уникальный идентификатор владельца аренды: хост, pid и случайный суффикс."""
+    return f"{prefix}:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _claimable_filter(now):
+    return (
+        Q(processing_status=Status.PENDING)
+        | Q(processing_status=Status.PROCESSING, lease_expires_at__lt=now)
+    ) & Q(processing_attempts__lt=max_attempts())
+
+
+def _lease_update(owner, now):
+    return dict(
+        processing_status=Status.PROCESSING,
+        lease_owner=owner,
+        lease_expires_at=now + lease_duration(),
+        heartbeat_at=now,
+        processing_attempts=F('processing_attempts') + 1,
+        updated_at=now,
+    )
+
+
+def claim_submission(submission_id, owner, statuses=(Status.PENDING, Status.FAILED)):
+    """
+    Берет в работу конкретную загрузку (используется пулом веб-процесса).
+    Возвращает True, если аренда получена.
+    """
+    now = timezone.now()
+    return MedicalTestSubmission.objects.filter(
+        id=submission_id, processing_status__in=statuses
+    ).update(**_lease_update(owner, now)) > 0
+
+
+def claim_next_submission(owner):
+    """
+    Берет в работу самую старую доступную загрузку и возвращает ее id (или None).
+
+    На PostgreSQL и других БД с SKIP LOCKED кандидат блокируется через
+    select_for_update(skip_locked=True), поэтому воркеры на разных узлах не
+    ждут друг друга. На SQLite захват выполняется условным UPDATE (compare-and-set)
+    по одному кандидату за раз — запись в SQLite все равно сериализуется.
+    """
+    now = timezone.now()
+    claimable = MedicalTestSubmission.objects.filter(_claimable_filter(now)).order_by('submission_date')
+    with _claim_lock:
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                submission_id = next(iter(
+                    claimable.select_for_update(skip_locked=True).values_list('id', flat=True)[:1]
+                ), None)
+                if submission_id is None:
+                    return None
+                MedicalTestSubmission.objects.filter(id=submission_id).update(**_lease_update(owner, now))
+                return submission_id
+        for submission_id in claimable.values_list('id', flat=True)[:10]:
+            claimed = MedicalTestSubmission.objects.filter(
+                _claimable_filter(now), id=submission_id
+            ).update(**_lease_update(owner, now))
+            if claimed:
+                return submission_id
+    return None
+
+
+def renew_leases(owners):
+    """Продлевает аренды перечисленных владельцев; возвращает число обновленных записей."""
+    owners = list(owners)
+    if not owners:
+        return 0
+    now = timezone.now()
+    return MedicalTestSubmission.objects.filter(
+        processing_status=Status.PROCESSING, lease_owner__in=owners
+    ).update(lease_expires_at=now + lease_duration(), heartbeat_at=now)
+
+
+def fail_exhausted_submissions():
+    """
+    Помечает FAILED загрузки, аренда которых истекла, а попытки исчерпаны
+    (иначе они навсегда остались бы в PROCESSING).
+    """
+    now = timezone.now()
+    failed = MedicalTestSubmission.objects.filter(
+        processing_status=Status.PROCESSING, lease_expires_at__lt=now,
+        processing_attempts__gte=max_attempts(),
+    ).update(
+        processing_status=Status.FAILED,
+        processing_details=f"Processing abandoned after {max_attempts()} attempts (worker lease expired).",
+        lease_owner=None, lease_expires_at=None, updated_at=now,
+    )
+    if failed:
+        logger.warning(f"Marked {failed} submissions as FAILED after exhausting processing attempts.")
+    return failed
+
+
+def queue_depth():
+    """Число загрузок, ожидающих обработки или удерживаемых воркерами."""
+    counts = dict.fromkeys((Status.PENDING, Status.PROCESSING), 0)
+    rows = MedicalTestSubmission.objects.filter(
+        processing_status__in=list(counts)
+    ).values_list('processing_status').order_by().annotate(total=Count('id'))
+    counts.update(dict(rows))
+    return {'pending': counts[Status.PENDING], 'processing': counts[Status.PROCESSING]}
+
+
+class LeaseKeeper:
+    """
+    Фоновый heartbeat: раз в INGEST_HEARTBEAT_SECONDS продлевает аренды всех
+    задач, удерживаемых этим процессом.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or getattr(settings, 'INGEST_HEARTBEAT_SECONDS', 30)
+        self._owners = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name='ingest-heartbeat', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def add(self, owner):
+        self.start()
+        with self._lock:
+            self._owners.add(owner)
+
+    def discard(self, owner):
+        with self._lock:
+            self._owners.discard(owner)
+
+    @contextmanager
+    def hold(self, owner):
+        """Держит аренду owner живой, пока выполняется блок."""
+        self.add(owner)
+        try:
+            yield owner
+        finally:
+            self.discard(owner)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                owners = list(self._owners)
+            if not owners:
+                continue
+            try:
+                renew_leases(owners)
+            except Exception as exc:
+                logger.warning(f"Lease heartbeat failed: {exc}")
+            finally:
+                connection.close()
+
+
+_lease_keeper = None
+_lease_keeper_lock = threading.Lock()
+
+
+def get_lease_keeper():
+    global _lease_keeper
+    if _lease_keeper is None:
+        with _lease_keeper_lock:
+            if _lease_keeper is None:
+                _lease_keeper = LeaseKeeper()
+    return _lease_keeper
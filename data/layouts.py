@@ -0,0 +1,258 @@
+# ==============================================================================
+# Файл: data/layouts.py
+# Описание: Раскладка таблицы результатов лаборатории: поиск строки заголовка
+# таблицы по рамкам текста страницы (см. PageLayout в data/extraction.py),
+# отпечаток раскладки (подписи и x-позиции колонок) и шаблон колонок, по
+# которому строки таблицы разрезаются на ячейки без построчных regex.
+# Модуль не импортирует модели: шаблоны хранятся в LabLayoutTemplate.
+# ==============================================================================
+import bisect
+import hashlib
+import re
+from collections import deque
+
+from .extraction import PAGE_BREAK_MARKER
+
+# Роли колонок и начала слов их подписей в заголовке таблицы (в нижнем регистре)
+COLUMN_ROLE_KEYWORDS = {
+    'name': ('показател', 'наименован', 'исследован', 'тест', 'анализ', 'parameter', 'test'),
+    'value': ('результат', 'значение', 'result', 'value'),
+    'reference': ('норм', 'референс', 'реф', 'reference', 'range'),
+    'unit': ('ед', 'единиц', 'unit'),
+    'status': ('статус', 'оценка', 'отклонен', 'комментар', 'flag', 'status'),
+}
+COLUMN_ROLES = tuple(COLUMN_ROLE_KEYWORDS)
+# Без колонок названия и значения разбор по колонкам невозможен
+REQUIRED_ROLES = ('name', 'value')
+MIN_HEADER_ROLES = 3
+
+ROW_Y_TOLERANCE = 3.0
+# Слова с промежутком не больше CELL_GAP (пункты PDF) — одна ячейка заголовка
+CELL_GAP = 4.0
+# Шаг округления x-позиций колонок в отпечатке (пункты PDF)
+FINGERPRINT_X_STEP = 10
+
+# Роль по первому слову подписи: одна альтернатива-группа на роль
+COLUMN_ROLE_PATTERN = re.compile(
+    r'\W*(?:' + '|'.join(
+        f"(?P<{role}>{'|'.join(re.escape(keyword) for keyword in keywords)})"
+        for role, keywords in COLUMN_ROLE_KEYWORDS.items()
+    ) + ')',
+    re.IGNORECASE,
+)
+
+
+def group_rows(boxes, y_tolerance=ROW_Y_TOLERANCE):
+    """Рамки слов страницы, сгруппированные в строки (сверху вниз, внутри строки — слева направо)."""
+    rows = []
+    row = []
+    row_top = None
+    for box in sorted(boxes, key=lambda box: (box.top, box.x0)):
+        if row and box.top - row_top > y_tolerance:
+            rows.append(sorted(row, key=lambda box: box.x0))
+            row = []
+        if not row:
+            row_top = box.top
+        row.append(box)
+    if row:
+        rows.append(sorted(row, key=lambda box: box.x0))
+    return rows
+
+
+def row_text(row):
+    """Строка таблицы одной строкой текста (слова через пробел)."""
+    return ' '.join(box.text for box in row)
+
+
+def merge_cells(row, max_gap=CELL_GAP):
+    """Соседние слова строки, разделенные не больше чем max_gap, — одной рамкой (ячейкой)."""
+    cells = []
+    for box in row:
+        if cells and box.x0 - cells[-1].x1 <= max_gap:
+            previous = cells[-1]
+            cells[-1] = previous._replace(x1=box.x1, text=f"{previous.text} {box.text}")
+        else:
+            cells.append(box)
+    return cells
+
+
+def column_role(label):
+    """Роль колонки по началу первого слова подписи заголовка или None."""
+    match = COLUMN_ROLE_PATTERN.match(label)
+    return match.lastgroup if match else None
+
+
+class TableHeader:
+    """Найденная строка заголовка таблицы: ее индекс среди строк страницы и колонки."""
+    __slots__ = ('row_index', 'columns')
+
+    def __init__(self, row_index, columns):
+        self.row_index = row_index
+        # ((роль, центр колонки по x, подпись), ...) слева направо
+        self.columns = columns
+
+    @property
+    def labels(self):
+        return [label for _, _, label in self.columns]
+
+
+def detect_header(rows):
+    """
+    Первая строка, подписи которой распознаются как колонки таблицы результатов
+    (название и значение обязательны, всего не меньше MIN_HEADER_ROLES ролей),
+    или None. Подписи ролей, не попавших в COLUMN_ROLE_KEYWORDS, пропускаются.
+    """
+    for row_index, row in enumerate(rows):
+        if len(row) < MIN_HEADER_ROLES:
+            continue
+        columns = []
+        seen_roles = set()
+        for box in merge_cells(row):
+            role = column_role(box.text)
+            if role is None or role in seen_roles:
+                continue
+            seen_roles.add(role)
+            columns.append((role, (box.x0 + box.x1) / 2, box.text))
+        if len(seen_roles) >= MIN_HEADER_ROLES and all(role in seen_roles for role in REQUIRED_ROLES):
+            return TableHeader(row_index, tuple(columns))
+    return None
+
+
+def layout_fingerprint(header, page_width, page_height):
+    """
+    Отпечаток раскладки: размер страницы, подписи колонок и их x-позиции
+    (с округлением до FINGERPRINT_X_STEP). Отчеты одной лаборатории на одном
+    бланке дают один отпечаток, данные пациента в него не входят.
+    """
+    parts = [f"{round(page_width)}x{round(page_height)}"]
+    for role, center, label in header.columns:
+        label_key = ' '.join(label.lower().split())
+        parts.append(f"{role}:{label_key}:{round(center / FINGERPRINT_X_STEP)}")
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ColumnTemplate:
+    """
+    Колонки таблицы как полосы по x: граница между соседними колонками — середина
+    между центрами их заголовков (подписи обычно центрированы над значениями).
+    Ячейка получает слова строки, центр которых попадает в полосу колонки.
+    """
+
+    def __init__(self, columns):
+        # ((роль, центр), ...) в порядке слева направо
+        self.columns = tuple(sorted(((role, float(center)) for role, center in columns), key=lambda column: column[1]))
+        centers = [center for _, center in self.columns]
+        self.bounds = [(left + right) / 2 for left, right in zip(centers, centers[1:])]
+
+    @classmethod
+    def from_header(cls, header):
+        return cls((role, center) for role, center, _ in header.columns)
+
+    @classmethod
+    def from_list(cls, data):
+        return cls((column['role'], column['center']) for column in data)
+
+    def as_list(self):
+        return [{'role': role, 'center': round(center, 2)} for role, center in self.columns]
+
+    def column_of(self, box):
+        return self.columns[bisect.bisect_right(self.bounds, (box.x0 + box.x1) / 2)][0]
+
+    def slice_row(self, row):
+        """Тексты ячеек строки по ролям колонок (пустые колонки отсутствуют); слова — слева направо."""
+        cells = {}
+        for box in row:
+            role = self.column_of(box)
+            cells[role] = f"{cells[role]} {box.text}" if role in cells else box.text
+        return cells
+
+
+class LayoutPass:
+    """
+    Режим разбора по колонкам для одного прохода по документу и его счетчики.
+    mode: None — построчный разбор (заголовок таблицы не найден), 'template' —
+    по сохраненному шаблону, 'learning' — строки разбираются построчно, а разбор
+    по колонкам только сверяется с ними (решение о сохранении шаблона).
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.mode = None
+        self.fingerprint = None
+        self.template_id = None
+        self.header_labels = []
+        self.columns = None
+        self.rows_sliced = 0
+        self.rows_fallback = 0
+        self.rows_compared = 0
+        self.rows_agreed = 0
+
+    def start(self, header, page, find_template):
+        """Режим по заголовку первой страницы; find_template(fingerprint) -> (id, columns) или None."""
+        if header is None:
+            return
+        self.fingerprint = layout_fingerprint(header, page.width, page.height)
+        self.header_labels = [' '.join(label.split()) for label in header.labels]
+        template = find_template(self.fingerprint)
+        if template is not None:
+            self.mode = 'template'
+            self.template_id, columns = template
+            self.columns = ColumnTemplate.from_list(columns)
+        else:
+            self.mode = 'learning'
+            self.columns = ColumnTemplate.from_header(header)
+
+    def agreement(self):
+        return self.rows_agreed / self.rows_compared if self.rows_compared else 0.0
+
+    def as_dict(self):
+        if self.mode is None:
+            return {'layout': None}
+        data = {'layout': self.mode, 'layout_fingerprint': self.fingerprint}
+        if self.mode == 'template':
+            data.update(layout_rows_sliced=self.rows_sliced, layout_rows_fallback=self.rows_fallback)
+        else:
+            data.update(layout_rows_compared=self.rows_compared, layout_rows_agreed=self.rows_agreed)
+        return data
+
+
+def iter_layout_rows(pages, layout_pass, find_template):
+    """
+    Строки документа из PageLayout: (номер строки, текст, ячейки по колонкам или None).
+
+    Режим выбирается по первой странице (LayoutPass.start). Строки — всегда строки
+    текста страниц (тот же текст сохраняется в ExtractedTextPage и разбирается при
+    повторном разборе), нумерация совпадает с iter_document_lines. Рамки служат
+    только для ячеек: строка текста получает ячейки строки рамок с тем же текстом
+    (с точностью до пробелов) ниже заголовка, а на следующих страницах — любой
+    строки рамок, если на странице нет заголовка другой таблицы.
+    """
+    line_number = 0
+    for page_number, page in enumerate(pages):
+        if page_number:
+            yield line_number, PAGE_BREAK_MARKER, None
+            line_number += 1
+        rows = group_rows(page.boxes)
+        header = detect_header(rows)
+        if page_number == 0:
+            layout_pass.start(header, page, find_template)
+
+        # Ячейки строк таблицы по тексту строки; одинаковые строки — по порядку
+        cells_by_text = {}
+        if layout_pass.columns is not None:
+            table_start = 0
+            if header is not None:
+                same_layout = layout_fingerprint(header, page.width, page.height) == layout_pass.fingerprint
+                table_start = header.row_index + 1 if same_layout else len(rows)
+            for row in rows[table_start:]:
+                cells_by_text.setdefault(row_text(row), deque()).append(layout_pass.columns.slice_row(row))
+        for line in page.text.split('\n'):
+            cells = None
+            if cells_by_text:
+                queued = cells_by_text.get(' '.join(line.split()))
+                if queued:
+                    cells = queued.popleft()
+            yield line_number, line, cells
+            line_number += 1
@@ -0,0 +1,60 @@
+# ==============================================================================
+# Файл: data/management/commands/backfill_reference_bounds.py
+# Описание: Заполняет TestResult.ref_low/ref_high для результатов, сохраненных
+# до появления этих полей (разбор строки reference_range).
+# Пример: python manage.py backfill_reference_bounds --batch-size 2000
+# ==============================================================================
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from data.models import TestResult
+from data.tasks import parse_reference_range
+
+
+class Command(BaseCommand):
+    help = (
+        "Разбирает reference_range существующих результатов и сохраняет границы "
+        "в ref_low/ref_high. Обход по первичному ключу пачками, каждая пачка — "
+        "отдельная короткая транзакция; команду можно прерывать и запускать повторно."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Число результатов в пачке.")
+        parser.add_argument(
+            '--recompute', action='store_true',
+            help="Пересчитать и результаты, у которых границы уже заполнены.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        queryset = TestResult.objects.exclude(reference_range__isnull=True).exclude(reference_range='')
+        if not options['recompute']:
+            queryset = queryset.filter(ref_low__isnull=True, ref_high__isnull=True)
+
+        last_id = None
+        scanned = updated = 0
+        while True:
+            chunk = queryset.order_by('id')
+            if last_id is not None:
+                chunk = chunk.filter(id__gt=last_id)
+            rows = list(chunk.values_list('id', 'reference_range', 'ref_low', 'ref_high')[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            scanned += len(rows)
+
+            changed = []
+            for result_id, reference_range, ref_low, ref_high in rows:
+                low, high = parse_reference_range(reference_range)
+                if (low, high) != (ref_low, ref_high):
+                    changed.append(TestResult(id=result_id, ref_low=low, ref_high=high))
+            if changed:
+                with transaction.atomic():
+                    TestResult.objects.bulk_update(changed, ['ref_low', 'ref_high'])
+                updated += len(changed)
+            self.stdout.write(f"Scanned {scanned} results, updated {updated}.")
+
+        self.stdout.write(f"Reference bounds backfilled: {updated} of {scanned} scanned results updated.")
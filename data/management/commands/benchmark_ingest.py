@@ -0,0 +1,55 @@
+# ==============================================================================
+# Файл: data/management/commands/benchmark_ingest.py
+# Описание: Бенчмарк стадий обработки PDF на синтетическом корпусе (см. data/benchmark.py).
+# Пример: python manage.py benchmark_ingest --documents 20 --output bench.json
+# ==============================================================================
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data.benchmark import STAGES, run_benchmark
+from data.extraction import EXTRACTION_BACKENDS
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет стадии обработки PDF (извлечение текста, дата, алиасы, разбор значений, "
+        "запись в БД, тип теста, полный прогон) и выводит отчет в JSON. "
+        "Записи в БД откатываются, синтетические PDF удаляются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=10, help="Число синтетических отчетов.")
+        parser.add_argument('--seed', type=int, default=42, help="Seed генератора корпуса.")
+        parser.add_argument(
+            '--stages', default=','.join(STAGES),
+            help=f"Стадии через запятую (по умолчанию все: {','.join(STAGES)}).",
+        )
+        parser.add_argument(
+            '--backends', default=','.join(EXTRACTION_BACKENDS),
+            help="Бэкенды для стадии extraction через запятую.",
+        )
+        parser.add_argument('--output', help="Файл для JSON-отчета (по умолчанию stdout).")
+
+    def handle(self, *args, **options):
+        stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f"Unknown stages: {', '.join(sorted(unknown))}.")
+        backends = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        unknown = set(backends) - set(EXTRACTION_BACKENDS)
+        if unknown:
+            raise CommandError(f"Unknown text backends: {', '.join(sorted(unknown))}.")
+        if options['documents'] < 1:
+            raise CommandError("--documents must be at least 1.")
+
+        report = run_benchmark(
+            documents=options['documents'], seed=options['seed'], stages=stages, backends=backends,
+        )
+        payload = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(payload + '\n')
+            self.stdout.write(f"Benchmark report written to {options['output']}.")
+        else:
+            self.stdout.write(payload)
@@ -0,0 +1,87 @@
+# ==============================================================================
+# Файл: data/management/commands/db_maintenance.py
+# Описание: Обслуживание БД SQLite: ANALYZE (статистика для планировщика),
+# контрольная точка WAL (перенос журнала в файл БД) и VACUUM (сжатие файла).
+# Пример: python manage.py db_maintenance --analyze --checkpoint TRUNCATE
+# ==============================================================================
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+# PRAGMA соединения, которые настраивает data/db.py
+STATUS_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size')
+
+
+class Command(BaseCommand):
+    help = (
+        "Обслуживание БД SQLite. Без флагов выполняет ANALYZE и контрольную точку "
+        "WAL (TRUNCATE). VACUUM переписывает весь файл БД и блокирует запись на время "
+        "работы — только по флагу --vacuum, лучше при остановленных воркерах."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help="Обновить статистику планировщика (ANALYZE).")
+        parser.add_argument(
+            '--checkpoint', nargs='?', const='TRUNCATE', choices=CHECKPOINT_MODES,
+            help="Контрольная точка WAL (по умолчанию TRUNCATE — с обнулением файла журнала).",
+        )
+        parser.add_argument('--vacuum', action='store_true', help="Сжать файл БД (VACUUM).")
+        parser.add_argument('--status', action='store_true', help="Только показать PRAGMA соединения и размеры файлов.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"db_maintenance supports SQLite only, database is {connection.vendor}.")
+        if connection.is_in_memory_db():
+            raise CommandError("Database is in memory; nothing to maintain.")
+
+        self._report_status()
+        if options['status']:
+            return
+        if not (options['analyze'] or options['checkpoint'] or options['vacuum']):
+            options['analyze'] = True
+            options['checkpoint'] = 'TRUNCATE'
+
+        with connection.cursor() as cursor:
+            if options['analyze']:
+                started = time.perf_counter()
+                cursor.execute("ANALYZE")
+                self.stdout.write(f"ANALYZE done in {time.perf_counter() - started:.2f}s.")
+            if options['vacuum']:
+                size_before = self._file_size('')
+                started = time.perf_counter()
+                cursor.execute("VACUUM")
+                self.stdout.write(
+                    f"VACUUM done in {time.perf_counter() - started:.2f}s: "
+                    f"{size_before / 1048576:.1f} -> {self._file_size('') / 1048576:.1f} MiB."
+                )
+            if options['checkpoint']:
+                cursor.execute(f"PRAGMA wal_checkpoint({options['checkpoint']})")
+                busy, wal_pages, checkpointed = cursor.fetchone()
+                if wal_pages < 0:
+                    self.stdout.write("Checkpoint skipped: database is not in WAL mode.")
+                else:
+                    self.stdout.write(
+                        f"Checkpoint {options['checkpoint']}: {checkpointed}/{wal_pages} WAL pages written"
+                        + (" (blocked by active readers or writers)." if busy else ".")
+                    )
+        self._report_status()
+
+    def _file_size(self, suffix):
+        try:
+            return os.path.getsize(f"{connection.settings_dict['NAME']}{suffix}")
+        except OSError:
+            return 0
+
+    def _report_status(self):
+        with connection.cursor() as cursor:
+            values = []
+            for name in STATUS_PRAGMAS:
+                cursor.execute(f"PRAGMA {name}")
+                values.append(f"{name}={cursor.fetchone()[0]}")
+        self.stdout.write(
+            f"{connection.settings_dict['NAME']}: {', '.join(values)}; "
+            f"db {self._file_size('') / 1048576:.1f} MiB, wal {self._file_size('-wal') / 1048576:.1f} MiB."
+        )
@@ -0,0 +1,38 @@
+# ==============================================================================
+# Файл: data/management/commands/rebuild_analyte_series.py
+# Описание: Пересборка рядов значений аналитов (AnalyteSeriesPoint) и их итогов
+# (AnalyteSeriesSummary) по сохраненным результатам (см. data/series.py).
+# Нужна после правок результатов или дат теста в обход обработки (админка, скрипты).
+# Пример: python manage.py rebuild_analyte_series --user user@example.com
+# ==============================================================================
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from data.models import MedicalTestSubmission
+from data.series import rebuild_user_series
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобирает ряды значений аналитов и их итоги по результатам загрузок. "
+        "Каждый пользователь — отдельная транзакция; команду можно прерывать и запускать повторно."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Email пользователя (по умолчанию — все пользователи с загрузками).")
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                user_ids = [get_user_model().objects.get(email__iexact=options['user']).id]
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"User '{options['user']}' not found.")
+        else:
+            user_ids = list(MedicalTestSubmission.objects.order_by().values_list('user_id', flat=True).distinct())
+
+        total_points = 0
+        for done, user_id in enumerate(user_ids, start=1):
+            points = rebuild_user_series(user_id)
+            total_points += points
+            self.stdout.write(f"[{done}/{len(user_ids)}] User {user_id}: {points} points.")
+        self.stdout.write(f"Rebuilt analyte series of {len(user_ids)} users: {total_points} points.")
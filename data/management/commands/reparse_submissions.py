@@ -0,0 +1,151 @@
+# ==============================================================================
+# Файл: data/management/commands/reparse_submissions.py
+# Описание: Повторный разбор загрузок по сохраненному тексту без чтения PDF
+# (после изменений словаря аналитов), пачками в пуле процессов (см. data/reparse.py).
+# Пример: python manage.py reparse_submissions --processes 4 --since 2025-01-01
+# ==============================================================================
+import datetime
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from data.models import TestType
+from data.process_pool import init_django_worker, reparse_submission_chunk
+from data.analyte_index import get_alias_index
+from data.reparse import (
+    REPARSE_STATUSES, fast_forward_submissions, reparse_chunk, reparse_queryset, split_stale_submissions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Заново разбирает сохраненный текст загрузок текущим словарем аналитов и заменяет "
+        "их результаты. PDF не читаются. Загрузки делятся на пачки по --chunk-size, "
+        "каждая пачка разбирается в дочернем процессе и записывается одной транзакцией; "
+        "команду можно прерывать и запускать повторно. С --stale-only разбираются только "
+        "загрузки, текст которых может содержать алиасы, измененные с версии словаря их разбора."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Email пользователя.")
+        parser.add_argument('--since', type=datetime.date.fromisoformat, help="Загружены не раньше даты (YYYY-MM-DD).")
+        parser.add_argument('--until', type=datetime.date.fromisoformat, help="Загружены не позже даты (YYYY-MM-DD).")
+        parser.add_argument('--test-type', help="Название типа теста.")
+        parser.add_argument(
+            '--status', action='append', choices=[str(status) for status in REPARSE_STATUSES],
+            help="Статус загрузок (можно несколько раз; по умолчанию COMPLETED).",
+        )
+        parser.add_argument('--processes', type=int, default=1, help="Число дочерних процессов (1 — в текущем процессе).")
+        parser.add_argument('--chunk-size', type=int, default=50, help="Число загрузок в пачке (одна транзакция).")
+        parser.add_argument('--limit', type=int, help="Разобрать не больше N загрузок.")
+        parser.add_argument(
+            '--stale-only', action='store_true',
+            help="Только загрузки, затронутые изменениями словаря аналитов; остальным загрузкам "
+                 "с устаревшей версией словаря версия обновляется без разбора.",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Только разобрать и посчитать результаты, без записи.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        processes = max(1, options['processes'])
+
+        user = test_type = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email__iexact=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"User '{options['user']}' not found.")
+        if options['test_type']:
+            try:
+                test_type = TestType.objects.get(name=options['test_type'])
+            except TestType.DoesNotExist:
+                raise CommandError(f"Test type '{options['test_type']}' not found.")
+
+        queryset = reparse_queryset(
+            user=user, date_from=options['since'], date_to=options['until'], test_type=test_type,
+            statuses=options['status'],
+        )
+        if options['stale_only']:
+            submission_ids = self._stale_submission_ids(queryset, options['dry_run'])
+        else:
+            submission_ids = list(queryset.values_list('id', flat=True))
+        submission_ids = submission_ids[:options['limit']]
+        total = len(submission_ids)
+        if not total:
+            self.stdout.write("No submissions with stored text match the filters.")
+            return
+        chunks = [submission_ids[start:start + chunk_size] for start in range(0, total, chunk_size)]
+        mode = "dry run" if options['dry_run'] else "write"
+        self.stdout.write(f"Reparsing {total} submissions in {len(chunks)} chunks ({processes} processes, {mode}).")
+
+        totals = {'reparsed': 0, 'conflicts': 0, 'failed': 0, 'results': 0, 'previous_results': 0}
+        started = time.perf_counter()
+        done = 0
+        try:
+            for chunk, stats in self._run_chunks(chunks, processes, options['dry_run']):
+                done += len(chunk)
+                for name, value in stats.items():
+                    totals[name] += value
+                self._report_progress(done, total, started, totals)
+        except KeyboardInterrupt:
+            self.stdout.write(f"Interrupted after {done}/{total} submissions; finished chunks are committed.")
+            raise CommandError("Reparse interrupted.")
+        finally:
+            connection.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Reparse finished in {datetime.timedelta(seconds=round(elapsed))}: {totals['reparsed']} reparsed, "
+            f"{totals['conflicts']} skipped as changed, {totals['failed']} failed; "
+            f"results {totals['previous_results']} -> {totals['results']}."
+        )
+
+    def _stale_submission_ids(self, queryset, dry_run):
+        """id загрузок, затронутых изменениями словаря (в порядке queryset)."""
+        alias_index = get_alias_index()
+        affected, unaffected = split_stale_submissions(queryset, alias_index)
+        unaffected_count = sum(len(submission_ids) for submission_ids in unaffected.values())
+        if dry_run:
+            self.stdout.write(f"Dictionary v{alias_index.version}: {len(affected)} affected, {unaffected_count} would be marked current without parsing.")
+        else:
+            fast_forwarded = fast_forward_submissions(unaffected, alias_index)
+            self.stdout.write(f"Dictionary v{alias_index.version}: {len(affected)} affected, {fast_forwarded} marked current without parsing.")
+        return [submission_id for submission_id in queryset.values_list('id', flat=True) if submission_id in affected]
+
+    def _run_chunks(self, chunks, processes, dry_run):
+        """Пары (пачка, счетчики) в порядке завершения пачек."""
+        if processes == 1:
+            for chunk in chunks:
+                yield chunk, reparse_chunk(chunk, dry_run=dry_run)
+            return
+        # Дочерние процессы открывают свои соединения с БД
+        connection.close()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_django_worker) as pool:
+            futures = {pool.submit(reparse_submission_chunk, chunk, dry_run): chunk for chunk in chunks}
+            try:
+                for future in as_completed(futures):
+                    chunk = futures[future]
+                    try:
+                        yield chunk, future.result()
+                    except Exception as exc:
+                        self.stderr.write(f"Chunk of {len(chunk)} submissions failed in worker process: {exc}")
+                        yield chunk, {'failed': len(chunk)}
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _report_progress(self, done, total, started, totals):
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed else 0.0
+        eta = datetime.timedelta(seconds=round((total - done) / rate)) if rate else '?'
+        self.stdout.write(
+            f"[{done}/{total}] {rate:.1f} submissions/s, ETA {eta}; "
+            f"reparsed {totals['reparsed']}, changed {totals['conflicts']}, failed {totals['failed']}."
+        )
@@ -0,0 +1,113 @@
+# ==============================================================================
+# Файл: data/management/commands/run_ingest_worker.py
+# Описание: Воркер устойчивой очереди обработки PDF (см. data/ingest_queue.py).
+# Пример: python manage.py run_ingest_worker --concurrency 4
+# ==============================================================================
+import logging
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from data.ingest_queue import (
+    LeaseKeeper,
+    claim_next_submission,
+    fail_exhausted_submissions,
+    make_worker_id,
+)
+from data.process_pool import init_django_worker, process_claimed_submission
+
+logger = logging.getLogger('data.tasks')
+
+
+class Command(BaseCommand):
+    help = (
+        "Обрабатывает очередь загрузок PDF (записи PENDING и записи с истекшей арендой). "
+        "Родительский процесс захватывает задачи и продлевает аренды, обработка идет "
+        "в --concurrency дочерних процессах."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Число дочерних процессов обработки.")
+        parser.add_argument(
+            '--poll-interval', type=float, default=getattr(settings, 'INGEST_POLL_SECONDS', 5),
+            help="Пауза между опросами пустой очереди (секунды).",
+        )
+        parser.add_argument('--once', action='store_true', help="Обработать текущую очередь и завершиться.")
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        poll_interval = options['poll_interval']
+        self._stop = threading.Event()
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGTERM, self._request_stop)
+
+        if not connection.features.has_select_for_update_skip_locked:
+            self.stdout.write(
+                f"{connection.vendor}: no SKIP LOCKED support, claiming in single-claimer mode "
+                f"(run one worker command per database)."
+            )
+        self.stdout.write(f"Ingest worker started with concurrency={concurrency}.")
+
+        keeper = LeaseKeeper()
+        keeper.start()
+        try:
+            while not self._stop.is_set():
+                try:
+                    drained = self._run_pool(concurrency, poll_interval, keeper, options['once'])
+                except BrokenProcessPool as exc:
+                    # Упавший дочерний процесс: его аренда истечет, задача будет захвачена снова
+                    logger.error(f"Ingest worker pool broke ({exc}); restarting pool.")
+                    continue
+                if drained:
+                    break
+        finally:
+            keeper.stop()
+            connection.close()
+        self.stdout.write("Ingest worker stopped.")
+
+    def _request_stop(self, signum, frame):
+        if not self._stop.is_set():
+            self.stdout.write("Stop requested, finishing in-flight submissions...")
+        self._stop.set()
+
+    def _run_pool(self, concurrency, poll_interval, keeper, once):
+        """Возвращает True, если очередь опустела в режиме --once."""
+        in_flight = {}
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=concurrency, mp_context=context, initializer=init_django_worker) as pool:
+            try:
+                while True:
+                    if not self._stop.is_set():
+                        fail_exhausted_submissions()
+                        while len(in_flight) < concurrency:
+                            owner = make_worker_id()
+                            submission_id = claim_next_submission(owner)
+                            if submission_id is None:
+                                break
+                            keeper.add(owner)
+                            logger.info(f"Claimed submission {submission_id} as {owner}.")
+                            future = pool.submit(process_claimed_submission, submission_id, owner)
+                            in_flight[future] = (submission_id, owner)
+                    if not in_flight:
+                        if self._stop.is_set() or once:
+                            return True
+                        self._stop.wait(poll_interval)
+                        continue
+                    done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        submission_id, owner = in_flight.pop(future)
+                        keeper.discard(owner)
+                        error = future.exception()
+                        if isinstance(error, BrokenProcessPool):
+                            raise error
+                        if error:
+                            logger.error(f"Submission {submission_id} failed in worker process: {error}")
+            finally:
+                for submission_id, owner in in_flight.values():
+                    keeper.discard(owner)
@@ -0,0 +1,153 @@
+# ==============================================================================
+# Файл: data/matching.py
+# Описание: Многошаблонный поиск алиасов аналитов (автомат Ахо-Корасик).
+# ==============================================================================
+import re
+from collections import deque
+
+# Слова текста для индекса загрузок (см. index_tokens)
+INDEX_TOKEN_PATTERN = re.compile(r'\w+')
+INDEX_TOKEN_MAX_LENGTH = 64
+
+
+def _is_word_char(char):
+    """Аналог класса \\w модуля re для одного символа (Unicode)."""
+    return char.isalnum() or char == '_'
+
+
+def _lower_preserving_length(text):
+    """
+    Приводит строку к нижнему регистру, сохраняя длину (и, значит, индексы).
+    Символы, у которых lower() меняет длину (например, 'İ'), остаются как есть.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def index_tokens(text):
+    """
+    Множество слов текста для индекса загрузок (ExtractedTextToken): в нижнем
+    регистре, как их сравнивает AliasMatcher, без чисел и слов длиннее
+    INDEX_TOKEN_MAX_LENGTH. Каждое слово найденного алиаса — целое слово строки
+    (совпадение начинается на границе слова и заканчивается перед несловесным
+    символом), поэтому текст может содержать алиас, только если в нем есть все
+    index_tokens(alias).
+    """
+    return {
+        token for token in INDEX_TOKEN_PATTERN.findall(_lower_preserving_length(text))
+        if len(token) <= INDEX_TOKEN_MAX_LENGTH and not token.isdigit()
+    }
+
+
+class AliasMatcher:
+    """
+    Автомат Ахо-Корасик, построенный один раз по списку алиасов.
+
+    Алиасы передаются в порядке приоритета (как ``sorted_aliases`` в парсере:
+    длиннее — раньше). Поиск по строке выполняется за один проход и повторяет
+    семантику ``re.search(r'(?i)\\b' + re.escape(alias) + r'(?=\\W|$)', line)``:
+    начало совпадения должно быть на границе слова, а за концом алиаса — не
+    «словесный» символ или конец строки.
+    """
+    __slots__ = ('aliases', '_goto', '_fail', '_output')
+
+    def __init__(self, aliases):
+        self.aliases = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        seen = set()
+        for alias in aliases:
+            if not alias or alias in seen:
+                continue
+            seen.add(alias)
+            self._add(alias, len(self.aliases))
+            self.aliases.append(alias)
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def _add(self, alias, rank):
+        node = 0
+        for char in alias:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = next_node
+        self._output[node] = self._output[node] + (rank,)
+
+    def _build_failure_links(self):
+        goto, fail, output = self._goto, self._fail, self._output
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fallback = goto[state].get(char, 0)
+                fail[child] = fallback if fallback != child else 0
+                # Выходы по суффиксной ссылке сливаем заранее, чтобы при поиске
+                # не ходить по цепочке fail-ссылок.
+                if output[fail[child]]:
+                    output[child] = output[child] + output[fail[child]]
+
+    def iter_matches(self, line):
+        """
+        Возвращает (rank, start, end) для каждого вхождения алиаса в строку,
+        удовлетворяющего границам слова. ``rank`` — индекс алиаса в ``aliases``.
+        """
+        text = _lower_preserving_length(line)
+        goto, fail, output, aliases = self._goto, self._fail, self._output, self.aliases
+        length = len(text)
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if not output[node]:
+                continue
+            end = index + 1
+            if end < length and _is_word_char(text[end]):
+                continue
+            for rank in output[node]:
+                start = end - len(aliases[rank])
+                # \b перед первым символом алиаса
+                before = start > 0 and _is_word_char(text[start - 1])
+                if before != _is_word_char(text[start]):
+                    yield rank, start, end
+
+    def find_best(self, line, accept=None):
+        """
+        Находит алиас с наивысшим приоритетом, встречающийся в строке.
+
+        ``accept`` — необязательный предикат по алиасу; отклоненные алиасы
+        пропускаются (аналог ``continue`` в исходном цикле по ``sorted_aliases``).
+        Для выбранного алиаса берется самое левое вхождение, как у ``re.search``.
+        Возвращает (alias, start, end) или None.
+        """
+        return self.pick(self.ranked_matches(line), accept)
+
+    def ranked_matches(self, line):
+        """Все алиасы строки: (alias, start, end) самого левого вхождения, по приоритету."""
+        best = {}
+        for rank, start, end in self.iter_matches(line):
+            if rank not in best or start < best[rank][0]:
+                best[rank] = (start, end)
+        return tuple((self.aliases[rank], *best[rank]) for rank in sorted(best))
+
+    @staticmethod
+    def pick(ranked, accept=None):
+        """Первое совпадение из ranked_matches(), принятое предикатом accept, или None."""
+        for match in ranked:
+            if accept is None or accept(match[0]):
+                return match
+        return None
@@ -0,0 +1,82 @@
+# ==============================================================================
+# Файл: data/metrics.py
+# Описание: Замеры стадий обработки загрузки (телеметрия без профилировщика)
+# и трассировка решений парсера по строкам для отдельной загрузки.
+# Результат сохраняется в MedicalTestSubmission.processing_metrics.
+# ==============================================================================
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Накапливает длительности стадий (time.perf_counter) и счетчики обработки.
+    Повторный вход в стадию суммируется (например, повторный проход запасным бэкендом).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def timed_iter(self, iterable, stage):
+        """Отдает элементы iterable, относя ко stage только время их получения."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - started)
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+    def elapsed(self, stage):
+        return self.stages.get(stage, 0.0)
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def as_dict(self):
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            **self.counts,
+        }
+
+
+class LineTrace:
+    """
+    Кольцевой буфер решений парсера по строкам документа: хранит последние
+    max_entries записей. Включается для отдельной загрузки
+    (MedicalTestSubmission.trace_processing) вместо построчного DEBUG-лога.
+    """
+
+    def __init__(self, max_entries=500, max_text=200):
+        self.entries = deque(maxlen=max_entries)
+        self.max_text = max_text
+        self.recorded = 0
+
+    def add(self, line_number, text, decision, **details):
+        self.recorded += 1
+        self.entries.append({'line': line_number, 'text': text[:self.max_text], 'decision': decision, **details})
+
+    def clear(self):
+        self.entries.clear()
+        self.recorded = 0
+
+    def as_dict(self):
+        return {'recorded': self.recorded, 'kept': len(self.entries), 'entries': list(self.entries)}
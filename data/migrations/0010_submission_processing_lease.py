@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-17 01:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0009_healthsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Heartbeat'),
+        ),
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Lease Expires At'),
+        ),
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='lease_owner',
+            field=models.CharField(blank=True, help_text='Worker currently processing this submission.', max_length=100, null=True, verbose_name='Lease Owner'),
+        ),
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Processing Attempts'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-17 02:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0010_submission_processing_lease'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='content_sha256',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the uploaded file, used to detect re-uploads of the same report.', max_length=64, null=True, verbose_name='Content SHA-256'),
+        ),
+        migrations.AddIndex(
+            model_name='medicaltestsubmission',
+            index=models.Index(fields=['user', 'content_sha256'], name='submission_user_sha256_idx'),
+        ),
+    ]
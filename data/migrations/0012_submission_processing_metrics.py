@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0011_submission_content_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='processing_metrics',
+            field=models.JSONField(blank=True, editable=False, help_text='Per-stage timings (ms) and counters of the last processing run.', null=True, verbose_name='Processing Metrics'),
+        ),
+    ]
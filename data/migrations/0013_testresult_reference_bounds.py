@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-17 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0012_submission_processing_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testresult',
+            name='ref_high',
+            field=models.DecimalField(blank=True, decimal_places=4, help_text='Upper bound parsed from the reference range (empty if open or unparsed).', max_digits=14, null=True, verbose_name='Reference High'),
+        ),
+        migrations.AddField(
+            model_name='testresult',
+            name='ref_low',
+            field=models.DecimalField(blank=True, decimal_places=4, help_text='Lower bound parsed from the reference range (empty if open or unparsed).', max_digits=14, null=True, verbose_name='Reference Low'),
+        ),
+    ]
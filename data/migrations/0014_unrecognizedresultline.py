@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-17 02:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0013_testresult_reference_bounds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnrecognizedResultLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.PositiveIntegerField(verbose_name='Line Number')),
+                ('line', models.TextField(verbose_name='Line')),
+                ('candidate_name', models.CharField(help_text='Text before the first number, as found in the report.', max_length=255, verbose_name='Candidate Name')),
+                ('name_key', models.CharField(db_index=True, help_text='Lower-cased candidate name with collapsed whitespace, used for grouping.', max_length=255, verbose_name='Name Key')),
+                ('detected_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Detected At')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unrecognized_lines', to='data.medicaltestsubmission', verbose_name='Submission')),
+            ],
+            options={
+                'verbose_name': 'Unrecognized Result Line',
+                'verbose_name_plural': 'Unrecognized Result Lines',
+                'ordering': ['name_key', 'submission', 'line_number'],
+            },
+        ),
+    ]
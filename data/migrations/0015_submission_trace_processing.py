@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0014_unrecognizedresultline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='trace_processing',
+            field=models.BooleanField(default=False, help_text='Record per-line parser decisions into processing metrics on the next processing run.', verbose_name='Trace Processing'),
+        ),
+    ]
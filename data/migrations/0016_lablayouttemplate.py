@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-17 02:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0015_submission_trace_processing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabLayoutTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(help_text='Hash of the page size, table header labels and column positions.', max_length=64, unique=True, verbose_name='Fingerprint')),
+                ('header_labels', models.JSONField(default=list, help_text='Table header labels, left to right.', verbose_name='Header Labels')),
+                ('columns', models.JSONField(default=list, help_text="Column roles and x-centers: [{'role': ..., 'center': ...}].", verbose_name='Columns')),
+                ('is_active', models.BooleanField(db_index=True, default=True, help_text='Inactive templates are ignored; reports with this layout are parsed line by line.', verbose_name='Is Active')),
+                ('documents_parsed', models.PositiveIntegerField(default=0, verbose_name='Documents Parsed')),
+                ('rows_sliced', models.PositiveIntegerField(default=0, verbose_name='Rows Parsed by Columns')),
+                ('rows_fallback', models.PositiveIntegerField(default=0, help_text='Table rows where column slicing gave no result and the line patterns were used.', verbose_name='Rows Parsed by Line Patterns')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('last_used_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Used At')),
+                ('sample_submission', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='data.medicaltestsubmission', verbose_name='Sample Submission')),
+            ],
+            options={
+                'verbose_name': 'Lab Layout Template',
+                'verbose_name_plural': 'Lab Layout Templates',
+                'ordering': ['-last_used_at', '-created_at'],
+            },
+        ),
+    ]
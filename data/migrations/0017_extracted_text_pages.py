@@ -0,0 +1,72 @@
+# Generated by Django 5.2 on 2026-10-17 02:39
+
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Разделитель страниц в извлеченном тексте (data.extraction.PAGE_SEPARATOR на момент миграции)
+PAGE_SEPARATOR = "\n<-- Page Break -->\n"
+CHUNK_SIZE = 200
+
+
+def split_extracted_text(apps, schema_editor):
+    """Переносит extracted_text загрузок в сжатые страницы ExtractedTextPage."""
+    MedicalTestSubmission = apps.get_model('data', 'MedicalTestSubmission')
+    ExtractedTextPage = apps.get_model('data', 'ExtractedTextPage')
+    submissions = MedicalTestSubmission.objects.exclude(extracted_text__isnull=True).exclude(extracted_text='')
+    for submission_id, text in submissions.values_list('id', 'extracted_text').iterator(chunk_size=CHUNK_SIZE):
+        pages = []
+        offset = 0
+        for page_number, page_text in enumerate(text.split(PAGE_SEPARATOR), start=1):
+            pages.append(ExtractedTextPage(
+                submission_id=submission_id, page_number=page_number, start_offset=offset,
+                char_count=len(page_text), compressed_text=zlib.compress(page_text.encode('utf-8')),
+            ))
+            offset += len(page_text) + len(PAGE_SEPARATOR)
+        ExtractedTextPage.objects.bulk_create(pages)
+
+
+def join_extracted_text(apps, schema_editor):
+    """Собирает extracted_text загрузок обратно из страниц."""
+    MedicalTestSubmission = apps.get_model('data', 'MedicalTestSubmission')
+    ExtractedTextPage = apps.get_model('data', 'ExtractedTextPage')
+    texts = {}
+    for submission_id, compressed_text in ExtractedTextPage.objects.order_by('submission_id', 'page_number').values_list(
+        'submission_id', 'compressed_text'
+    ).iterator(chunk_size=CHUNK_SIZE):
+        texts.setdefault(submission_id, []).append(zlib.decompress(compressed_text).decode('utf-8'))
+    for submission_id, pages in texts.items():
+        MedicalTestSubmission.objects.filter(id=submission_id).update(extracted_text=PAGE_SEPARATOR.join(pages))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0016_lablayouttemplate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedTextPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField(help_text='1-based page number.', verbose_name='Page Number')),
+                ('start_offset', models.PositiveIntegerField(help_text='Offset of the page in the text of the whole document.', verbose_name='Start Offset')),
+                ('char_count', models.PositiveIntegerField(verbose_name='Characters')),
+                ('compressed_text', models.BinaryField(verbose_name='Compressed Text')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='text_pages', to='data.medicaltestsubmission', verbose_name='Submission')),
+            ],
+            options={
+                'verbose_name': 'Extracted Text Page',
+                'verbose_name_plural': 'Extracted Text Pages',
+                'ordering': ['submission', 'page_number'],
+                'unique_together': {('submission', 'page_number')},
+            },
+        ),
+        migrations.RunPython(split_extracted_text, join_extracted_text),
+        migrations.RemoveField(
+            model_name='medicaltestsubmission',
+            name='extracted_text',
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.2 on 2026-10-17 02:45
+
+import re
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Правила data.matching.index_tokens на момент миграции
+TOKEN_PATTERN = re.compile(r'\w+')
+TOKEN_MAX_LENGTH = 64
+
+
+def lower_preserving_length(text):
+    # Как data.matching._lower_preserving_length: символы, у которых lower()
+    # меняет длину (например, 'İ'), остаются как есть
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def build_text_tokens(apps, schema_editor):
+    """Строит индекс слов для уже сохраненного текста загрузок."""
+    ExtractedTextPage = apps.get_model('data', 'ExtractedTextPage')
+    ExtractedTextToken = apps.get_model('data', 'ExtractedTextToken')
+    def flush(submission_id, tokens):
+        ExtractedTextToken.objects.bulk_create([
+            ExtractedTextToken(submission_id=submission_id, token=token) for token in sorted(tokens)
+        ])
+
+    # Страницы по загрузкам подряд: в памяти слова только одной загрузки
+    current_id, tokens = None, set()
+    pages = ExtractedTextPage.objects.order_by('submission_id', 'page_number').values_list('submission_id', 'compressed_text')
+    for submission_id, compressed_text in pages.iterator(chunk_size=200):
+        if submission_id != current_id:
+            if current_id is not None:
+                flush(current_id, tokens)
+            current_id, tokens = submission_id, set()
+        text = lower_preserving_length(zlib.decompress(compressed_text).decode('utf-8'))
+        tokens.update(
+            token for token in TOKEN_PATTERN.findall(text)
+            if len(token) <= TOKEN_MAX_LENGTH and not token.isdigit()
+        )
+    if current_id is not None:
+        flush(current_id, tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0017_extracted_text_pages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyteDictionarySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=16, unique=True, verbose_name='Version')),
+                ('aliases', models.JSONField(default=dict, verbose_name='Aliases')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Analyte Dictionary Snapshot',
+                'verbose_name_plural': 'Analyte Dictionary Snapshots',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='medicaltestsubmission',
+            name='dictionary_version',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='Analyte dictionary version (AliasIndex.version) the current results were parsed with.', max_length=16, verbose_name='Dictionary Version'),
+        ),
+        migrations.CreateModel(
+            name='ExtractedTextToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, verbose_name='Token')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='text_tokens', to='data.medicaltestsubmission', verbose_name='Submission')),
+            ],
+            options={
+                'verbose_name': 'Extracted Text Token',
+                'verbose_name_plural': 'Extracted Text Tokens',
+                'indexes': [models.Index(fields=['token', 'submission'], name='text_token_lookup_idx')],
+                'unique_together': {('submission', 'token')},
+            },
+        ),
+        migrations.RunPython(build_text_tokens, migrations.RunPython.noop),
+    ]
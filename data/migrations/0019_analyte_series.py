@@ -0,0 +1,117 @@
+# Generated by Django 5.2 on 2026-10-17 02:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def percentage_change(latest_value, previous_value):
+    # Правила data.series.percentage_change на момент миграции
+    if previous_value is None:
+        return 0.0
+    if previous_value != 0:
+        return round((latest_value - previous_value) / previous_value * 100, 2)
+    return 100.0 if latest_value != 0 else 0.0
+
+
+def build_series(apps, schema_editor):
+    """Строит ряды и итоги по уже сохраненным числовым результатам с датой теста."""
+    TestResult = apps.get_model('data', 'TestResult')
+    AnalyteSeriesPoint = apps.get_model('data', 'AnalyteSeriesPoint')
+    AnalyteSeriesSummary = apps.get_model('data', 'AnalyteSeriesSummary')
+    rows = TestResult.objects.filter(
+        submission__test_date__isnull=False, value_numeric__isnull=False,
+    ).order_by('submission__user_id', 'analyte_id', 'submission__test_date', 'submission__submission_date', 'id').values_list(
+        'id', 'submission_id', 'submission__user_id', 'analyte_id', 'submission__test_date',
+        'submission__submission_date', 'value_numeric', 'unit', 'analyte__unit', 'reference_range',
+    )
+    points, summaries = [], []
+    # Точки одного ряда подряд: итог ряда — по двум последним
+    series_key, series = None, []
+
+    def close_series():
+        if not series:
+            return
+        latest = series[-1]
+        previous = series[-2] if len(series) > 1 else None
+        summaries.append(AnalyteSeriesSummary(
+            user_id=latest.user_id, analyte_id=latest.analyte_id, unit=latest.unit,
+            latest_date=latest.test_date, latest_value=latest.value,
+            previous_date=previous.test_date if previous else None,
+            previous_value=previous.value if previous else None,
+            percentage_of_change=percentage_change(latest.value, previous.value if previous else None),
+            point_count=len(series),
+        ))
+
+    for (result_id, submission_id, user_id, analyte_id, test_date, submission_date,
+         value_numeric, unit, analyte_unit, reference_range) in rows.iterator(chunk_size=2000):
+        if (user_id, analyte_id) != series_key:
+            close_series()
+            series_key, series = (user_id, analyte_id), []
+        point = AnalyteSeriesPoint(
+            result_id=result_id, submission_id=submission_id, user_id=user_id, analyte_id=analyte_id,
+            test_date=test_date, submission_date=submission_date, value=float(value_numeric),
+            unit=unit or analyte_unit, reference_range=reference_range,
+        )
+        series.append(point)
+        points.append(point)
+        if len(points) >= 2000:
+            AnalyteSeriesPoint.objects.bulk_create(points)
+            points = []
+    close_series()
+    AnalyteSeriesPoint.objects.bulk_create(points)
+    AnalyteSeriesSummary.objects.bulk_create(summaries, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0018_dictionary_versions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyteSeriesPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test_date', models.DateField(verbose_name='Test Date')),
+                ('submission_date', models.DateTimeField(verbose_name='Submission Date')),
+                ('value', models.FloatField(verbose_name='Numeric Value')),
+                ('unit', models.CharField(blank=True, max_length=50, verbose_name='Unit')),
+                ('reference_range', models.CharField(blank=True, max_length=150, null=True, verbose_name='Reference Range')),
+                ('analyte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_points', to='data.analyte', verbose_name='Analyte')),
+                ('result', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='series_point', to='data.testresult', verbose_name='Test Result')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_points', to='data.medicaltestsubmission', verbose_name='Submission')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analyte_series_points', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Analyte Series Point',
+                'verbose_name_plural': 'Analyte Series Points',
+                'ordering': ['user', 'analyte', 'test_date', 'submission_date', 'result'],
+                'indexes': [models.Index(fields=['user', 'analyte', 'test_date', 'submission_date'], name='series_point_user_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalyteSeriesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit', models.CharField(blank=True, max_length=50, verbose_name='Unit')),
+                ('latest_date', models.DateField(verbose_name='Latest Test Date')),
+                ('latest_value', models.FloatField(verbose_name='Latest Value')),
+                ('previous_date', models.DateField(blank=True, null=True, verbose_name='Previous Test Date')),
+                ('previous_value', models.FloatField(blank=True, null=True, verbose_name='Previous Value')),
+                ('percentage_of_change', models.FloatField(default=0.0, verbose_name='Percentage of Change')),
+                ('point_count', models.PositiveIntegerField(verbose_name='Points')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('analyte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_summaries', to='data.analyte', verbose_name='Analyte')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analyte_series_summaries', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Analyte Series Summary',
+                'verbose_name_plural': 'Analyte Series Summaries',
+                'unique_together': {('user', 'analyte')},
+            },
+        ),
+        migrations.RunPython(build_series, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0019_analyte_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analytedictionarysnapshot',
+            name='test_types',
+            field=models.JSONField(default=dict, verbose_name='Test Types'),
+        ),
+    ]
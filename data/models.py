@@ -4,6 +4,7 @@
 # ==============================================================================
 import uuid
 import logging
+import zlib
 from django.db import models
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
@@ -11,6 +12,8 @@ from django.utils import timezone
 from django.utils.text import slugify
 from decimal import Decimal
 
+from .matching import index_tokens
+
 User = settings.AUTH_USER_MODEL
 logger = logging.getLogger(__name__)
 
@@ -57,12 +60,24 @@ class MedicalTestSubmission(models.Model):
         upload_to='medical_tests/%Y/%m/%d/',
         null=False, blank=False
     )
+    content_sha256 = models.CharField(
+        _("Content SHA-256"), max_length=64, blank=True, null=True, editable=False,
+        help_text=_("SHA-256 of the uploaded file, used to detect re-uploads of the same report.")
+    )
     processing_status = models.CharField(
         _("Processing Status"), max_length=20, choices=StatusChoices.choices,
         default=StatusChoices.PENDING, db_index=True
     )
     processing_details = models.TextField(_("Processing Details"), blank=True, null=True, help_text=_("Logs or error messages from processing."), max_length=4000)
-    extracted_text = models.TextField(_("Extracted Text"), blank=True, null=True, help_text=_("Raw text extracted from the uploaded file."))
+    # Длительности стадий обработки и счетчики страниц/строк (см. data/metrics.py)
+    processing_metrics = models.JSONField(_("Processing Metrics"), null=True, blank=True, editable=False, help_text=_("Per-stage timings (ms) and counters of the last processing run."))
+    trace_processing = models.BooleanField(_("Trace Processing"), default=False, help_text=_("Record per-line parser decisions into processing metrics on the next processing run."))
+    dictionary_version = models.CharField(_("Dictionary Version"), max_length=16, blank=True, default='', db_index=True, editable=False, help_text=_("Analyte dictionary version (AliasIndex.version) the current results were parsed with."))
+    # Аренда задачи обработки (см. data/ingest_queue.py)
+    lease_owner = models.CharField(_("Lease Owner"), max_length=100, blank=True, null=True, help_text=_("Worker currently processing this submission."))
+    lease_expires_at = models.DateTimeField(_("Lease Expires At"), null=True, blank=True, db_index=True)
+    heartbeat_at = models.DateTimeField(_("Last Heartbeat"), null=True, blank=True)
+    processing_attempts = models.PositiveSmallIntegerField(_("Processing Attempts"), default=0)
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
@@ -75,6 +90,9 @@ class MedicalTestSubmission(models.Model):
         verbose_name = _("Medical Test Submission")
         verbose_name_plural = _("Medical Test Submissions")
         ordering = ['-submission_date']
+        indexes = [
+            models.Index(fields=['user', 'content_sha256'], name='submission_user_sha256_idx'),
+        ]
 
 
 class Analyte(models.Model):
@@ -99,12 +117,17 @@ class Analyte(models.Model):
 
     def get_all_names(self):
         """Возвращает список всех известных имен и аббревиатур в нижнем регистре."""
+        return self.collect_names(self.name, self.name_en, self.name_ru, self.name_kk, self.abbreviations)
+
+    @staticmethod
+    def collect_names(name, name_en, name_ru, name_kk, abbreviations):
+        """То же, что get_all_names, но по сырым значениям полей (без экземпляра модели)."""
         names = set()
-        for name_field in [self.name, self.name_en, self.name_ru, self.name_kk]:
+        for name_field in [name, name_en, name_ru, name_kk]:
             if name_field:
                 names.add(name_field.strip().lower())
-        if self.abbreviations:
-            abbrs = [abbr.strip().lower() for abbr in self.abbreviations.split(',') if abbr.strip()]
+        if abbreviations:
+            abbrs = [abbr.strip().lower() for abbr in abbreviations.split(',') if abbr.strip()]
             names.update(abbrs)
         return list(filter(None, names))
 
@@ -129,6 +152,15 @@ class TestResult(models.Model):
     )
     unit = models.CharField(_("Reported Unit"), max_length=50, blank=True, help_text=_("Unit found in the report, might differ from standard."))
     reference_range = models.CharField(_("Reference Range"), max_length=150, blank=True, null=True, help_text=_("Reference range string from the report."))
+    # Границы диапазона, разобранные при загрузке (см. data.tasks.parse_reference_range)
+    ref_low = models.DecimalField(
+        _("Reference Low"), max_digits=14, decimal_places=4, null=True, blank=True,
+        help_text=_("Lower bound parsed from the reference range (empty if open or unparsed).")
+    )
+    ref_high = models.DecimalField(
+        _("Reference High"), max_digits=14, decimal_places=4, null=True, blank=True,
+        help_text=_("Upper bound parsed from the reference range (empty if open or unparsed).")
+    )
     # Поле для хранения текстового статуса из PDF
     status_text = models.CharField(
         _("Status Text"), max_length=100, blank=True, null=True, # <-- НОВОЕ ПОЛЕ
@@ -153,6 +185,218 @@ class TestResult(models.Model):
 
 
 
+class ExtractedTextPage(models.Model):
+    """
+    Текст одной страницы загрузки, сжатый zlib (отдельно от загрузки: списки и
+    детали загрузок его не читают). start_offset — позиция страницы в тексте
+    всего документа (страницы через PAGE_SEPARATOR, см. data/extraction.py).
+    """
+    submission = models.ForeignKey(MedicalTestSubmission, on_delete=models.CASCADE, related_name='text_pages', verbose_name=_("Submission"))
+    page_number = models.PositiveIntegerField(_("Page Number"), help_text=_("1-based page number."))
+    start_offset = models.PositiveIntegerField(_("Start Offset"), help_text=_("Offset of the page in the text of the whole document."))
+    char_count = models.PositiveIntegerField(_("Characters"))
+    compressed_text = models.BinaryField(_("Compressed Text"))
+
+    def __str__(self):
+        return f"Page {self.page_number} of {self.submission_id}"
+
+    @property
+    def text(self):
+        return zlib.decompress(self.compressed_text).decode('utf-8')
+
+    @classmethod
+    def from_page_texts(cls, submission, page_texts, separator):
+        """Несохраненные страницы загрузки из текстов страниц документа."""
+        level = getattr(settings, 'EXTRACTED_TEXT_COMPRESSION_LEVEL', 6)
+        pages = []
+        offset = 0
+        for page_number, page_text in enumerate(page_texts, start=1):
+            pages.append(cls(
+                submission=submission, page_number=page_number, start_offset=offset,
+                char_count=len(page_text), compressed_text=zlib.compress(page_text.encode('utf-8'), level),
+            ))
+            offset += len(page_text) + len(separator)
+        return pages
+
+    @classmethod
+    def document_text(cls, submission):
+        """Текст всего документа (как его разбирал парсер) или пустая строка."""
+        from .extraction import PAGE_SEPARATOR
+        return PAGE_SEPARATOR.join(page.text for page in cls.objects.filter(submission=submission).order_by('page_number'))
+
+    class Meta:
+        verbose_name = _("Extracted Text Page")
+        verbose_name_plural = _("Extracted Text Pages")
+        ordering = ['submission', 'page_number']
+        unique_together = ('submission', 'page_number')
+
+
+class ExtractedTextToken(models.Model):
+    """
+    Обратный индекс извлеченного текста: слово -> загрузки (см. matching.index_tokens).
+    По нему после изменения словаря находятся загрузки, текст которых может
+    содержать новые или измененные алиасы (data/reparse.py).
+    """
+    submission = models.ForeignKey(MedicalTestSubmission, on_delete=models.CASCADE, related_name='text_tokens', verbose_name=_("Submission"))
+    token = models.CharField(_("Token"), max_length=64)
+
+    def __str__(self):
+        return f"{self.token} ({self.submission_id})"
+
+    @classmethod
+    def from_page_texts(cls, submission, page_texts):
+        """Несохраненные слова индекса по текстам страниц документа."""
+        tokens = set()
+        for page_text in page_texts:
+            tokens |= index_tokens(page_text)
+        return [cls(submission=submission, token=token) for token in sorted(tokens)]
+
+    class Meta:
+        verbose_name = _("Extracted Text Token")
+        verbose_name_plural = _("Extracted Text Tokens")
+        unique_together = ('submission', 'token')
+        indexes = [
+            models.Index(fields=['token', 'submission'], name='text_token_lookup_idx'),
+        ]
+
+
+class AnalyteDictionarySnapshot(models.Model):
+    """
+    Алиасы словаря аналитов одной версии (AliasIndex.version): алиас -> [id аналита,
+    имя, единица], и типы тестов: id типа -> [имя, id типичных аналитов].
+    Сравнение снимков дает алиасы и типы, изменившиеся между версиями.
+    """
+    version = models.CharField(_("Version"), max_length=16, unique=True)
+    aliases = models.JSONField(_("Aliases"), default=dict)
+    test_types = models.JSONField(_("Test Types"), default=dict)
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+
+    def __str__(self):
+        return f"v{self.version} ({len(self.aliases)} aliases)"
+
+    class Meta:
+        verbose_name = _("Analyte Dictionary Snapshot")
+        verbose_name_plural = _("Analyte Dictionary Snapshots")
+        ordering = ['-created_at']
+
+
+class UnrecognizedResultLine(models.Model):
+    """
+    Строка отчета, похожая на результат анализа, но без известного аналита.
+    По строке на загрузку (заменяются при повторной обработке); агрегаты по
+    name_key показывают пробелы в словаре аналитов без разбора текста отчетов.
+    """
+    submission = models.ForeignKey(MedicalTestSubmission, on_delete=models.CASCADE, related_name='unrecognized_lines', verbose_name=_("Submission"))
+    line_number = models.PositiveIntegerField(_("Line Number"))
+    line = models.TextField(_("Line"))
+    candidate_name = models.CharField(_("Candidate Name"), max_length=255, help_text=_("Text before the first number, as found in the report."))
+    name_key = models.CharField(_("Name Key"), max_length=255, db_index=True, help_text=_("Lower-cased candidate name with collapsed whitespace, used for grouping."))
+    detected_at = models.DateTimeField(_("Detected At"), default=timezone.now)
+
+    def __str__(self):
+        return f"{self.candidate_name} (line {self.line_number})"
+
+    @staticmethod
+    def make_name_key(candidate_name):
+        return ' '.join(candidate_name.lower().split())[:255]
+
+    @classmethod
+    def dictionary_gaps(cls):
+        """Кандидаты в аналиты, сгруппированные по name_key: чаще встречающиеся — первыми."""
+        return cls.objects.values('name_key').annotate(
+            submissions=models.Count('submission', distinct=True),
+            occurrences=models.Count('id'),
+            last_seen=models.Max('detected_at'),
+        ).order_by('-submissions', '-occurrences', 'name_key')
+
+    class Meta:
+        verbose_name = _("Unrecognized Result Line")
+        verbose_name_plural = _("Unrecognized Result Lines")
+        ordering = ['name_key', 'submission', 'line_number']
+
+
+class LabLayoutTemplate(models.Model):
+    """
+    Шаблон колонок таблицы результатов для раскладки бланка лаборатории
+    (см. data/layouts.py). Создается после обработки отчета, в котором разбор
+    по колонкам совпал с построчным; отчеты с тем же отпечатком разбираются
+    по колонкам, построчный разбор остается запасным для отдельных строк.
+    """
+    fingerprint = models.CharField(_("Fingerprint"), max_length=64, unique=True, help_text=_("Hash of the page size, table header labels and column positions."))
+    header_labels = models.JSONField(_("Header Labels"), default=list, help_text=_("Table header labels, left to right."))
+    columns = models.JSONField(_("Columns"), default=list, help_text=_("Column roles and x-centers: [{'role': ..., 'center': ...}]."))
+    is_active = models.BooleanField(_("Is Active"), default=True, db_index=True, help_text=_("Inactive templates are ignored; reports with this layout are parsed line by line."))
+    sample_submission = models.ForeignKey(MedicalTestSubmission, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_("Sample Submission"))
+    documents_parsed = models.PositiveIntegerField(_("Documents Parsed"), default=0)
+    rows_sliced = models.PositiveIntegerField(_("Rows Parsed by Columns"), default=0)
+    rows_fallback = models.PositiveIntegerField(_("Rows Parsed by Line Patterns"), default=0, help_text=_("Table rows where column slicing gave no result and the line patterns were used."))
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+    last_used_at = models.DateTimeField(_("Last Used At"), null=True, blank=True)
+
+    def __str__(self):
+        return f"{' | '.join(self.header_labels)} ({self.fingerprint[:10]})"
+
+    class Meta:
+        verbose_name = _("Lab Layout Template")
+        verbose_name_plural = _("Lab Layout Templates")
+        ordering = ['-last_used_at', '-created_at']
+
+
+class AnalyteSeriesPoint(models.Model):
+    """
+    Точка ряда значений аналита пользователя: числовой результат с датой теста,
+    единицей (из отчета или стандартной) и референсом — без соединения результата,
+    загрузки и аналита при чтении. Поддерживается data/series.py при записи
+    результатов и удалении загрузок; manage.py rebuild_analyte_series — пересборка.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='analyte_series_points', verbose_name=_("User"))
+    analyte = models.ForeignKey(Analyte, on_delete=models.CASCADE, related_name='series_points', verbose_name=_("Analyte"))
+    submission = models.ForeignKey(MedicalTestSubmission, on_delete=models.CASCADE, related_name='series_points', verbose_name=_("Submission"))
+    result = models.OneToOneField(TestResult, on_delete=models.CASCADE, related_name='series_point', verbose_name=_("Test Result"))
+    test_date = models.DateField(_("Test Date"))
+    # Порядок точек с одной датой теста — по дате загрузки и id результата
+    submission_date = models.DateTimeField(_("Submission Date"))
+    value = models.FloatField(_("Numeric Value"))
+    unit = models.CharField(_("Unit"), max_length=50, blank=True)
+    reference_range = models.CharField(_("Reference Range"), max_length=150, blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.analyte_id} {self.test_date}: {self.value} {self.unit}"
+
+    class Meta:
+        verbose_name = _("Analyte Series Point")
+        verbose_name_plural = _("Analyte Series Points")
+        ordering = ['user', 'analyte', 'test_date', 'submission_date', 'result']
+        indexes = [
+            models.Index(fields=['user', 'analyte', 'test_date', 'submission_date'], name='series_point_user_idx'),
+        ]
+
+
+class AnalyteSeriesSummary(models.Model):
+    """
+    Итог ряда аналита пользователя: последняя и предыдущая точки, единица
+    последней точки и процент изменения (см. data.series.change_percent).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='analyte_series_summaries', verbose_name=_("User"))
+    analyte = models.ForeignKey(Analyte, on_delete=models.CASCADE, related_name='series_summaries', verbose_name=_("Analyte"))
+    unit = models.CharField(_("Unit"), max_length=50, blank=True)
+    latest_date = models.DateField(_("Latest Test Date"))
+    latest_value = models.FloatField(_("Latest Value"))
+    previous_date = models.DateField(_("Previous Test Date"), null=True, blank=True)
+    previous_value = models.FloatField(_("Previous Value"), null=True, blank=True)
+    percentage_of_change = models.FloatField(_("Percentage of Change"), default=0.0)
+    point_count = models.PositiveIntegerField(_("Points"))
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    def __str__(self):
+        return f"{self.analyte_id}: {self.latest_value} {self.unit} ({self.percentage_of_change:+}%)"
+
+    class Meta:
+        verbose_name = _("Analyte Series Summary")
+        verbose_name_plural = _("Analyte Series Summaries")
+        unique_together = ('user', 'analyte')
+
+
 class HealthSummary(models.Model):
     """
     Хранит резюме состояния здоровья, сгенерированное AI, и связанную информацию.
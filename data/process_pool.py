@@ -0,0 +1,36 @@
+# ==============================================================================
+# Файл: data/process_pool.py
+# Описание: Точки входа для дочерних процессов (multiprocessing, spawn).
+# Модуль не импортирует модели на верхнем уровне: при spawn он загружается
+# в новом интерпретаторе до django.setup().
+# ==============================================================================
+import signal
+
+
+def init_django_worker():
+    """Инициализатор дочернего процесса: настройка Django; Ctrl+C обрабатывает родитель."""
+    import django
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def process_claimed_submission(submission_id, lease_owner):
+    """Обрабатывает загрузку, уже захваченную родительским процессом с арендой lease_owner."""
+    from django.db import connection
+    from .tasks import process_pdf_submission_plain
+
+    try:
+        process_pdf_submission_plain(submission_id, lease_owner=lease_owner)
+    finally:
+        connection.close()
+
+
+def reparse_submission_chunk(submission_ids, dry_run=False):
+    """Повторный разбор пачки загрузок по сохраненному тексту (см. data/reparse.py)."""
+    from django.db import connection
+    from .reparse import reparse_chunk
+
+    try:
+        return reparse_chunk(submission_ids, dry_run=dry_run)
+    finally:
+        connection.close()
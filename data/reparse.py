@@ -0,0 +1,270 @@
+# ==============================================================================
+# Файл: data/reparse.py
+# Описание: Повторный разбор загрузок по сохраненному тексту (ExtractedTextPage)
+# без чтения PDF — после изменений словаря аналитов. Пачка загрузок разбирается
+# вне транзакции, затем записывается одной короткой транзакцией.
+# Раскладка таблиц (data/layouts.py) не используется: рамок слов в тексте нет,
+# строки разбираются построчными шаблонами.
+# Выборочный режим: только загрузки, текст которых может содержать алиасы,
+# изменившиеся с версии словаря, которой они разобраны (снимки версий и
+# индекс слов текста — AnalyteDictionarySnapshot, ExtractedTextToken).
+# ==============================================================================
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from .analyte_index import changed_aliases, dictionary_entries, get_alias_index, record_dictionary_snapshot
+from .extraction import PAGE_SEPARATOR, iter_document_lines
+from .matching import index_tokens
+from .metrics import StageTimer
+from .series import refresh_submission_series, submission_series_keys
+from .models import (
+    AnalyteDictionarySnapshot, ExtractedTextPage, ExtractedTextToken, MedicalTestSubmission, TestResult,
+    UnrecognizedResultLine,
+)
+from .tasks import DocumentParser, determine_test_type, extract_test_date
+
+logger = logging.getLogger('data.tasks')
+
+Status = MedicalTestSubmission.StatusChoices
+# Статусы, которые можно разбирать повторно (PENDING/PROCESSING принадлежат воркерам)
+REPARSE_STATUSES = (Status.COMPLETED, Status.FAILED)
+# Размер пачки id в запросах выборочного режима (лимит параметров SQLite)
+ID_BATCH_SIZE = 500
+
+
+def reparse_queryset(user=None, date_from=None, date_to=None, test_type=None, statuses=None):
+    """
+    Загрузки с сохраненным текстом, не захваченные воркером, по фильтрам:
+    пользователь, интервал даты загрузки (включительно), тип теста, статусы
+    (по умолчанию только COMPLETED).
+    """
+    queryset = MedicalTestSubmission.objects.filter(
+        Exists(ExtractedTextPage.objects.filter(submission=OuterRef('pk'))),
+        processing_status__in=statuses or [Status.COMPLETED], lease_owner__isnull=True,
+    )
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    if date_from is not None:
+        queryset = queryset.filter(submission_date__date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(submission_date__date__lte=date_to)
+    if test_type is not None:
+        queryset = queryset.filter(test_type=test_type)
+    return queryset.order_by('submission_date', 'id')
+
+
+
+def _submissions_with_tokens(submissions, tokens):
+    """id загрузок из submissions, в тексте которых есть все слова tokens."""
+    return set(
+        ExtractedTextToken.objects.filter(submission__in=submissions, token__in=tokens)
+        .values('submission').annotate(found=Count('token')).filter(found=len(tokens))
+        .values_list('submission', flat=True)
+    )
+
+
+def split_stale_submissions(queryset, alias_index):
+    """
+    Загрузки queryset, разобранные другой версией словаря: (множество id
+    затронутых, {версия: множество id не затронутых}). Затронута загрузка, текст которой
+    содержит все слова какого-либо алиаса, измененного между снимком ее версии
+    и alias_index (см. matching.index_tokens). Без снимка версии (в том числе
+    загрузки, разобранные до появления версий) — затронута. Загрузки без типа
+    теста затронуты любой сменой версии: тип определяется по словарю, в том
+    числе по связям аналитов с типами тестов, которые алиасы не меняют.
+    """
+    current_entries = dictionary_entries(alias_index)
+    stale = queryset.exclude(dictionary_version=alias_index.version).order_by()
+    versions = set(stale.values_list('dictionary_version', flat=True).distinct())
+    snapshots = dict(AnalyteDictionarySnapshot.objects.filter(version__in=versions).values_list('version', 'aliases'))
+    affected, unaffected = set(), {}
+    for version in versions:
+        group = stale.filter(dictionary_version=version)
+        group_ids = set(group.values_list('id', flat=True))
+        old_entries = snapshots.get(version)
+        if old_entries is None:
+            affected |= group_ids
+            continue
+        token_sets = {frozenset(index_tokens(alias)) for alias in changed_aliases(old_entries, current_entries)}
+        if frozenset() in token_sets:
+            # Алиас без индексируемых слов может встретиться в любом тексте
+            affected |= group_ids
+            continue
+        # Тип теста без алиасов мог смениться (связи аналитов с типами) — без типа затронуты всегда
+        hits = set(group.filter(test_type__isnull=True).values_list('id', flat=True))
+        for tokens in token_sets:
+            hits |= _submissions_with_tokens(group, tokens)
+        affected |= group_ids & hits
+        if group_ids - hits:
+            unaffected[version] = group_ids - hits
+    return affected, unaffected
+
+
+def fast_forward_submissions(unaffected, alias_index):
+    """
+    Отмечает не затронутые изменениями словаря загрузки ({версия: id}) текущей
+    версией без разбора: их результаты при разборе не изменились бы. Загрузки,
+    версия которых с тех пор сменилась, не трогаются. Возвращает число загрузок.
+    """
+    # Снимок новой версии нужен до отметки: по нему будет следующее сравнение
+    record_dictionary_snapshot(alias_index)
+    updated = 0
+    for version, submission_ids in unaffected.items():
+        submission_ids = list(submission_ids)
+        for start in range(0, len(submission_ids), ID_BATCH_SIZE):
+            updated += MedicalTestSubmission.objects.filter(
+                id__in=submission_ids[start:start + ID_BATCH_SIZE], dictionary_version=version, lease_owner__isnull=True,
+            ).update(dictionary_version=alias_index.version)
+    return updated
+
+
+def parse_stored_text(submission, alias_index):
+    """Разбор сохраненного текста загрузки: (DocumentParser, число страниц, текст документа)."""
+    page_texts = [page.text for page in submission.text_pages.all()]
+    parser = DocumentParser(submission, alias_index, log_prefix=f"[Reparse {submission.id}] ")
+    parser.parse_rows((i, line, None) for i, line in iter_document_lines(page_texts))
+    return parser, len(page_texts), PAGE_SEPARATOR.join(page_texts)
+
+
+class ReparsedSubmission:
+    """
+    Загрузка, разобранная заново и готовая к записи: дата, тип теста и детали
+    вычислены до транзакции, в ней остается только запись.
+    """
+    __slots__ = ('submission', 'parser', 'page_count', 'update_fields', 'leading_details', 'trailing_details', 'metrics')
+
+    def __init__(self, submission, parser, page_count, update_fields, leading_details, trailing_details, metrics):
+        self.submission = submission
+        self.parser = parser
+        self.page_count = page_count
+        self.update_fields = update_fields
+        self.leading_details = leading_details
+        self.trailing_details = trailing_details
+        self.metrics = metrics
+
+
+def prepare_reparse(submission, alias_index):
+    """Разбор сохраненного текста загрузки, даты и типа теста (без записи в БД)."""
+    timer = StageTimer()
+    with timer.stage('parse'):
+        parser, page_count, text = parse_stored_text(submission, alias_index)
+    update_fields = {'processing_status': Status.COMPLETED, 'dictionary_version': alias_index.version}
+    leading_details, trailing_details = [], []
+    if submission.test_date:
+        leading_details.append(f"Test Date kept: {submission.test_date.strftime('%d.%m.%Y')}")
+    else:
+        with timer.stage('date'):
+            extracted_date = extract_test_date(text)
+        if extracted_date:
+            update_fields['test_date'] = extracted_date
+            leading_details.append(f"Extracted Test Date: {extracted_date.strftime('%d.%m.%Y')}")
+        else:
+            leading_details.append("Could not extract test date from stored text.")
+    trailing_details.extend(parser.unrecognized_details)
+    if parser.unrecognized_details:
+        leading_details.insert(0, f"Обнаружено {len(parser.unrecognized_details)} строк, похожих на неопознанные результаты (см. ниже).")
+    if submission.test_type_id is None:
+        with timer.stage('test_type'):
+            determined_type = determine_test_type(parser.pending_analyte_ids)
+        if determined_type:
+            update_fields['test_type_id'] = determined_type.id
+            trailing_details.append(f"Automatically determined Test Type: {determined_type.name}")
+        else:
+            trailing_details.append("Could not automatically determine Test Type.")
+    timer.count('pages', page_count)
+    timer.count('lines', parser.line_count)
+    timer.count('unrecognized', len(parser.unrecognized_details))
+    return ReparsedSubmission(submission, parser, page_count, update_fields, leading_details, trailing_details, timer.as_dict())
+
+
+def _write_reparsed(item, batch_size):
+    """
+    Заменяет результаты загрузки результатами повторного разбора (внутри транзакции
+    вызывающего). False — загрузку изменили после чтения (обработка воркером и т.п.).
+    """
+    submission, parser = item.submission, item.parser
+    # Условное обновление первым: захватывает запись и отсекает параллельные изменения
+    claimed = MedicalTestSubmission.objects.filter(
+        id=submission.id, updated_at=submission.updated_at,
+        processing_status=submission.processing_status, lease_owner__isnull=True,
+    ).update(updated_at=timezone.now())
+    if not claimed:
+        return False
+
+    # Точки рядов удаляются каскадом вместе с результатами
+    series_keys = submission_series_keys(submission.id)
+    TestResult.objects.filter(submission=submission).delete()
+    if parser.pending_results:
+        parser.flush_results(batch_size)
+    UnrecognizedResultLine.objects.filter(submission=submission).delete()
+    UnrecognizedResultLine.objects.bulk_create(parser.unrecognized_lines, batch_size=batch_size)
+
+    details = (
+        f"Reparsed from stored text ({item.page_count} pages). Parsed {parser.parsed_results_count} results.\n---\n"
+        + "\n".join(item.leading_details + parser.parsing_details + item.trailing_details)
+    )
+    max_len = MedicalTestSubmission._meta.get_field('processing_details').max_length or 4000
+    # Замеры исходной обработки PDF сохраняются, повторный разбор — отдельным ключом
+    metrics = dict(submission.processing_metrics or {})
+    metrics['reparse'] = {**item.metrics, 'results': parser.parsed_results_count, 'reparsed_at': timezone.now().isoformat()}
+    MedicalTestSubmission.objects.filter(id=submission.id).update(
+        processing_details=details[:max_len], processing_metrics=metrics, **item.update_fields,
+    )
+    # Ряды значений аналитов — в своей точке сохранения: сбой не откатывает записанный
+    # разбор (ряды пересобирает rebuild_analyte_series)
+    try:
+        with transaction.atomic():
+            refresh_submission_series(submission.id, series_keys)
+    except Exception as exc:
+        logger.exception(f"[Reparse {submission.id}] Could not update analyte series: {exc}")
+    return True
+
+
+def reparse_chunk(submission_ids, dry_run=False):
+    """
+    Повторно разбирает пачку загрузок. Возвращает счетчики пачки: reparsed,
+    conflicts (загрузка изменилась после чтения), failed, results (новое число
+    результатов), previous_results (число результатов до разбора).
+    """
+    stats = {'reparsed': 0, 'conflicts': 0, 'failed': 0, 'results': 0, 'previous_results': 0}
+    alias_index = get_alias_index()
+    if not dry_run:
+        record_dictionary_snapshot(alias_index)
+    batch_size = getattr(settings, 'INGEST_RESULTS_BATCH_SIZE', 100)
+    submissions = MedicalTestSubmission.objects.filter(id__in=submission_ids).select_related('test_type').prefetch_related('text_pages')
+
+    parsed = []
+    for submission in submissions:
+        try:
+            parsed.append(prepare_reparse(submission, alias_index))
+        except Exception as exc:
+            logger.exception(f"[Reparse {submission.id}] Parsing stored text failed: {exc}")
+            stats['failed'] += 1
+    stats['previous_results'] = TestResult.objects.filter(submission_id__in=[item.submission.id for item in parsed]).count()
+
+    if dry_run:
+        stats['reparsed'] = len(parsed)
+        stats['results'] = sum(len(item.parser.pending_results) for item in parsed)
+        return stats
+
+    with transaction.atomic():
+        for item in parsed:
+            # Сбой одной загрузки откатывает только ее savepoint
+            try:
+                with transaction.atomic():
+                    written = _write_reparsed(item, batch_size)
+            except Exception as exc:
+                logger.exception(f"[Reparse {item.submission.id}] Writing reparsed results failed: {exc}")
+                stats['failed'] += 1
+                continue
+            if written:
+                stats['reparsed'] += 1
+                stats['results'] += item.parser.parsed_results_count
+            else:
+                logger.warning(f"[Reparse {item.submission.id}] Submission changed since it was read; skipped.")
+                stats['conflicts'] += 1
+    return stats
@@ -0,0 +1,138 @@
+# ==============================================================================
+# Файл: data/series.py
+# Описание: Ряды значений аналитов пользователей (AnalyteSeriesPoint) и их итоги
+# (AnalyteSeriesSummary) — денормализация результатов для статистики и
+# AI-резюме. Точки загрузки заменяются при записи ее результатов (обработка
+# PDF, повторный разбор, копия повторной загрузки), итоги затронутых аналитов
+# пересчитываются; удаление загрузки обрабатывают сигналы ниже.
+# ==============================================================================
+import logging
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Value, When, Window
+from django.db.models.functions import Lag, RowNumber
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import AnalyteSeriesPoint, AnalyteSeriesSummary, MedicalTestSubmission, TestResult
+
+logger = logging.getLogger(__name__)
+
+# Порядок точек ряда (по возрастанию); последняя точка — итоговая
+POINT_ORDER = ('test_date', 'submission_date', 'result_id')
+
+
+def change_percent(value, previous_value):
+    """
+    Выражение БД: процент изменения значения value относительно previous_value
+    (имена аннотаций). Без предыдущего значения или от нуля к нулю — 0,
+    от нуля к ненулевому — 100. Округление до 2 знаков — в Python (round),
+    как в ответе статистики до переноса расчета в БД.
+    """
+    return Case(
+        When(Q(**{f'{previous_value}__isnull': True}) | Q(**{previous_value: 0, value: 0}), then=Value(0.0)),
+        When(**{previous_value: 0}, then=Value(100.0)),
+        default=(F(value) - F(previous_value)) / F(previous_value) * Value(100.0),
+        output_field=FloatField(),
+    )
+
+
+def build_points(results):
+    """Несохраненные точки по queryset TestResult (только числовые, с датой теста)."""
+    rows = results.filter(submission__test_date__isnull=False, value_numeric__isnull=False).values_list(
+        'id', 'submission_id', 'submission__user_id', 'analyte_id', 'submission__test_date',
+        'submission__submission_date', 'value_numeric', 'unit', 'analyte__unit', 'reference_range',
+    )
+    return [
+        AnalyteSeriesPoint(
+            result_id=result_id, submission_id=submission_id, user_id=user_id, analyte_id=analyte_id,
+            test_date=test_date, submission_date=submission_date, value=float(value_numeric),
+            unit=unit or analyte_unit, reference_range=reference_range,
+        )
+        for (result_id, submission_id, user_id, analyte_id, test_date, submission_date,
+             value_numeric, unit, analyte_unit, reference_range) in rows.iterator(chunk_size=2000)
+    ]
+
+
+def refresh_summaries(series_keys):
+    """Пересчитывает итоги рядов по парам (user_id, analyte_id); ряд без точек — без итога."""
+    analytes_by_user = {}
+    for user_id, analyte_id in series_keys:
+        analytes_by_user.setdefault(user_id, set()).add(analyte_id)
+    series = [F('analyte_id')]
+    descending = [F(field).desc() for field in POINT_ORDER]
+    for user_id, analyte_ids in analytes_by_user.items():
+        # Последняя точка каждого ряда с предыдущей (LAG по порядку точек), процентом
+        # изменения и числом точек — одним запросом
+        rows = (
+            AnalyteSeriesPoint.objects.filter(user_id=user_id, analyte_id__in=analyte_ids)
+            .annotate(
+                previous_value=Window(Lag('value'), partition_by=series, order_by=POINT_ORDER),
+                previous_date=Window(Lag('test_date'), partition_by=series, order_by=POINT_ORDER),
+                position=Window(RowNumber(), partition_by=series, order_by=descending),
+                point_count=Window(Count('id'), partition_by=series),
+            )
+            .annotate(change=change_percent('value', 'previous_value'))
+            .filter(position=1)
+            .values_list('analyte_id', 'test_date', 'value', 'unit', 'previous_date', 'previous_value', 'change', 'point_count')
+        )
+        summaries = [
+            AnalyteSeriesSummary(
+                user_id=user_id, analyte_id=analyte_id, unit=unit,
+                latest_date=latest_date, latest_value=latest_value,
+                previous_date=previous_date, previous_value=previous_value,
+                percentage_of_change=round(change, 2), point_count=point_count,
+            )
+            for analyte_id, latest_date, latest_value, unit, previous_date, previous_value, change, point_count in rows
+        ]
+        with transaction.atomic():
+            AnalyteSeriesSummary.objects.filter(user_id=user_id, analyte_id__in=analyte_ids).delete()
+            AnalyteSeriesSummary.objects.bulk_create(summaries)
+
+
+def submission_series_keys(submission_id):
+    """
+    Ряды (user_id, analyte_id) с точками загрузки. Точки удаляются каскадом
+    вместе с результатами, поэтому ряды запоминаются до замены результатов.
+    """
+    return set(AnalyteSeriesPoint.objects.filter(submission_id=submission_id).values_list('user_id', 'analyte_id'))
+
+
+def refresh_submission_series(submission_id, series_keys=()):
+    """
+    Заменяет точки загрузки точками ее текущих результатов и пересчитывает
+    итоги затронутых рядов. series_keys — ряды прежних результатов загрузки,
+    если они уже удалены (см. submission_series_keys). Вызывается в
+    транзакции записи результатов.
+    """
+    series_keys = set(series_keys) | submission_series_keys(submission_id)
+    AnalyteSeriesPoint.objects.filter(submission_id=submission_id).delete()
+    new_points = build_points(TestResult.objects.filter(submission_id=submission_id))
+    AnalyteSeriesPoint.objects.bulk_create(new_points)
+    series_keys.update((point.user_id, point.analyte_id) for point in new_points)
+    refresh_summaries(series_keys)
+    return len(new_points)
+
+
+def rebuild_user_series(user_id, batch_size=1000):
+    """Пересобирает все ряды пользователя по его результатам. Возвращает число точек."""
+    with transaction.atomic():
+        AnalyteSeriesPoint.objects.filter(user_id=user_id).delete()
+        AnalyteSeriesSummary.objects.filter(user_id=user_id).delete()
+        points = build_points(TestResult.objects.filter(submission__user_id=user_id))
+        AnalyteSeriesPoint.objects.bulk_create(points, batch_size=batch_size)
+        refresh_summaries({(user_id, point.analyte_id) for point in points})
+    return len(points)
+
+
+@receiver(pre_delete, sender=MedicalTestSubmission)
+def remember_submission_series(sender, instance, **kwargs):
+    # Точки удаляются каскадом вместе с загрузкой; ряды запоминаются до удаления
+    instance._series_keys = submission_series_keys(instance.id)
+
+
+@receiver(post_delete, sender=MedicalTestSubmission)
+def refresh_deleted_submission_series(sender, instance, **kwargs):
+    series_keys = getattr(instance, '_series_keys', None)
+    if series_keys:
+        refresh_summaries(series_keys)
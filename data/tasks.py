@@ -1,21 +1,46 @@
 import logging
 import threading
+import time
+import tracemalloc
 import re
-from decimal import Decimal, InvalidOperation, Context, ROUND_HALF_UP
-import pdfplumber
+from decimal import InvalidOperation, Context, ROUND_HALF_UP
 from django.db import transaction, OperationalError, models
+from django.db.models import F
 from django.utils import timezone
 from django.conf import settings
-from collections import Counter
 import datetime
+import functools
 from dateutil.parser import parse as date_parse
 from dateutil.parser._parser import ParserError
 
-from .models import MedicalTestSubmission, TestResult, Analyte, TestType
+from .models import ExtractedTextPage, ExtractedTextToken, LabLayoutTemplate, MedicalTestSubmission, TestResult, UnrecognizedResultLine
+from .analyte_index import get_alias_index, record_dictionary_snapshot
+from .extraction import (
+    PAGE_BREAK_MARKER, PAGE_SEPARATOR, extraction_processes, get_extraction_backend,
+    get_fallback_backend, iter_document_lines, iter_pdf_pages, pdf_creation_date,
+)
+from .ingest_queue import lease_duration
+from .layouts import LayoutPass, iter_layout_rows
+from .metrics import LineTrace, StageTimer
+from .series import refresh_submission_series, submission_series_keys
 
 task_logger = logging.getLogger('data.tasks')
 
 # --- Скомпилированные Регулярные Выражения (Оптимизация) ---
+def _leading_chars_guard(patterns):
+    """
+    Опережающая проверка первого символа альтернатив (в обоих регистрах): движок
+    re не перебирает всю альтернативу в позициях, с которых ни один паттерн начаться
+    не может. Пустая строка, если какой-то паттерн начинается с метасимвола.
+    """
+    chars = set()
+    for pattern in patterns:
+        first = pattern.lstrip('(')[:1]
+        if not first or first in '\\[].^$*+?{}|)':
+            return ''
+        chars.update((first.lower(), first.upper()))
+    return '(?=[' + ''.join(sorted(re.escape(char) for char in chars)) + '])'
+
 UNIT_PATTERNS_LIST = [
     r'г/л', r'g/l', r'г/дл', r'g/dl', r'%', r'проц\.?', r'фл', r'f[lL]', r'пг', r'pg',
     r'млн[./\s]?мкл', r'млн[./\s]?мка', r'x\s?10\^?12[/]?л', r'10\^?12[/]?л', r'10\s?\*\s?12[/]?л', r'х\s?10\s?\*\s?12[/]?л',
@@ -28,7 +53,7 @@ UNIT_PATTERNS_LIST = [
     r'CFU/ml', r'титр', r'индекс', r'ratio', r'отн\.?\s*ед\.?', r'в п/з', r'/hpf', r'/lpf',
     r'мл/мин', r'ml/min', r'мм',
 ]
-UNIT_PATTERN_COMPILED = re.compile(r'(?i)\b(' + '|'.join(UNIT_PATTERNS_LIST) + r')\b')
+UNIT_PATTERN_COMPILED = re.compile(r'(?i)\b' + _leading_chars_guard(UNIT_PATTERNS_LIST) + r'(' + '|'.join(UNIT_PATTERNS_LIST) + r')\b')
 
 REF_PATTERNS_LIST = [
      r'(\d+\.?\d*\s*-\s*\d+\.?\d*)',         # X - Y
@@ -40,7 +65,19 @@ REF_PATTERNS_LIST = [
 REF_PATTERN_COMPILED = re.compile(r'(?i)(?:' + '|'.join(REF_PATTERNS_LIST) + r')')
 
 VALUE_PATTERN_COMPILED = re.compile(r'([-+]?\d+([.,]\d+)?)')
-POTENTIAL_RESULT_PATTERN_COMPILED = re.compile(r'([a-zA-Zа-яА-ЯёЁ\s\(\)\-]+)\s+([-+]?\d+([.,]\d+)?).*(?:(\d+\.?\d*\s*-\s*\d+\.?\d*)|(<|<=|>|>=)\s*(\d+\.?\d*))?')
+# Строка вида "<название> <число> ...": максимальный отрезок символов названия
+# (только с его начала) и сразу за ним число через пробел. Захватывающий квантификатор
+# и проверка начала отрезка держат поиск линейным (прежний вариант с жадной группой
+# и ".*" перебирал подстроки длинных текстовых строк квадратично).
+_RESULT_NAME_CHARS = r'a-zA-Zа-яА-ЯёЁ\s\(\)\-'
+POTENTIAL_RESULT_PATTERN_COMPILED = re.compile(
+    r'(?<![' + _RESULT_NAME_CHARS + r'])(?P<run>[' + _RESULT_NAME_CHARS + r']++)'
+    r'(?:(?<=\s)(?=\+?\d)|(?<=\s-)(?=\d))'
+)
+UNRECOGNIZED_SKIP_PATTERN_COMPILED = re.compile(
+    r'^(Показатель|Результат|Норма|Ед\. изм\.|Статус|ГЕМАТОЛОГИЯ|Биохимия|Коагулограмма|Анализ мочи)', re.IGNORECASE
+)
+LETTER_PATTERN_COMPILED = re.compile(r'[а-яА-ЯёЁa-zA-Z]')
 
 # Паттерны для текстового статуса
 STATUS_TEXT_PATTERNS = [
@@ -51,85 +88,103 @@ STATUS_TEXT_PATTERNS = [
     r'(Обнаружено)', r'(Не обнаружено)',
     # Добавь другие варианты, если нужно
 ]
-STATUS_TEXT_PATTERN_COMPILED = re.compile(r'(?i)\b(' + '|'.join(STATUS_TEXT_PATTERNS) + r')\s*$') # Ищем в конце строки
+STATUS_TEXT_PATTERN_COMPILED = re.compile(r'(?i)\b' + _leading_chars_guard(STATUS_TEXT_PATTERNS) + r'(?P<status>' + '|'.join(STATUS_TEXT_PATTERNS) + r')\s*$') # Ищем в конце строки
+
+
+# Один проход по хвосту строки результата: первый референсный диапазон, первая
+# единица измерения и текстовый статус в конце строки. Группы внутри ref/unit/status —
+# те же, что в REF_/UNIT_/STATUS_TEXT_PATTERNS, порядок альтернатив сохранен.
+RESULT_TOKEN_PATTERN_COMPILED = re.compile(
+    r'(?i)(?P<ref>' + '|'.join(REF_PATTERNS_LIST) + r')'
+    r'|\b' + _leading_chars_guard(UNIT_PATTERNS_LIST) + r'(?P<unit>' + '|'.join(UNIT_PATTERNS_LIST) + r')\b'
+    r'|\b' + _leading_chars_guard(STATUS_TEXT_PATTERNS) + r'(?P<status>' + '|'.join(STATUS_TEXT_PATTERNS) + r')\s*$'
+)
+_REF_GROUP_COUNT = REF_PATTERN_COMPILED.groups
+
+# Границы диапазона: "X - Y", "<X", "<=X", ">X", ">=X" (одним выражением)
+REF_BOUNDS_PATTERN_COMPILED = re.compile(
+    r'^\s*(?:(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)\b|(<=|<|>=|>)\s*(\d+(?:\.\d+)?)\b)'
+)
+
+UNIT_NORMALIZATION = {
+    'тыс/мка': 'x10^9/л', 'тыс/мкл': 'x10^9/л', 'тыс./мкл': 'x10^9/л',
+    'млн/мка': 'x10^12/л', 'млн/мкл': 'x10^12/л', 'млн./мкл': 'x10^12/л',
+    'мм/ч': 'мм/час', 'г/дл': 'g/dL', 'пг': 'pg',
+}
+NORMAL_STATUS_TEXTS = {'в норме', 'норма', 'отрицательно', 'не обнаружено'}
+ABNORMAL_STATUS_TEXTS = {'ниже нормы', 'выше нормы', 'патология', 'отклонение', 'положительно', 'обнаружено'}
 
 
 # --- Вспомогательные Функции Парсинга ---
 
+@functools.lru_cache(maxsize=4096)
 def parse_reference_range(range_str):
-    # (Код без изменений)
+    """
+    Нижняя и верхняя границы референсного диапазона (Decimal или None).
+    Результат кэшируется: в отчетах одни и те же диапазоны повторяются постоянно.
+    """
     if not range_str: return None, None
     range_str = str(range_str).strip().replace(',', '.')
-    lower_bound, upper_bound = None, None
-    decimal_context = Context(prec=14)
-    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)\b', range_str)
-    if match:
-        try:
-            lower_bound = decimal_context.create_decimal(match.group(1))
-            upper_bound = decimal_context.create_decimal(match.group(2))
-            return lower_bound, upper_bound
-        except InvalidOperation: pass
-    match = re.match(r'^\s*(<|<=)\s*(\d+(?:\.\d+)?)\b', range_str)
-    if match:
-        try:
-            upper_bound = decimal_context.create_decimal(match.group(2))
-            return None, upper_bound
-        except InvalidOperation: pass
-    match = re.match(r'^\s*(>|>=)\s*(\d+(?:\.\d+)?)\b', range_str)
+    match = REF_BOUNDS_PATTERN_COMPILED.match(range_str)
     if match:
-        try:
-            lower_bound = decimal_context.create_decimal(match.group(2))
-            return lower_bound, None
-        except InvalidOperation: pass
-    match = re.match(r'^\s*0\s*-\s*(\d+(?:\.\d+)?)\b', range_str)
-    if match:
-        try:
-            lower_bound = Decimal('0')
-            upper_bound = decimal_context.create_decimal(match.group(1))
-            return lower_bound, upper_bound
-        except InvalidOperation: pass
+        decimal_context = Context(prec=14)
+        low, high, operator, bound = match.groups()
+        if operator is None:
+            return decimal_context.create_decimal(low), decimal_context.create_decimal(high)
+        if operator.startswith('<'):
+            return None, decimal_context.create_decimal(bound)
+        return decimal_context.create_decimal(bound), None
     task_logger.warning(f"Reference range format not recognized or parsed: '{range_str}'")
     return None, None
 
+def normalize_unit(unit_str):
+    """Приводит найденную единицу к каноническому написанию."""
+    return UNIT_NORMALIZATION.get(unit_str.lower(), unit_str)
+
+def status_abnormality(status_text):
+    """is_abnormal по текстовому статусу: True/False или None, если статус не оценочный."""
+    status_text = status_text.lower()
+    if status_text in NORMAL_STATUS_TEXTS: return False
+    if status_text in ABNORMAL_STATUS_TEXTS: return True
+    return None
+
+def _clean_reference_match(groups, matched_text):
+    """Текст диапазона из совпадения REF-паттерна (последняя непустая группа) или None."""
+    potential_range = next((g for g in groups[::-1] if g), matched_text)
+    if potential_range:
+        cleaned_range = potential_range.strip().replace('(', '').replace(')', '').replace('[', '').replace(']', '')
+        if re.search(r'\d', cleaned_range):
+            return cleaned_range
+    return None
+
 def find_value(segment):
     """Ищет первое числовое значение в сегменте строки."""
     value_match = VALUE_PATTERN_COMPILED.search(segment)
     if value_match:
         value_str = value_match.group(1).replace(',', '.')
-        task_logger.debug(f"  Helper find_value: Found '{value_str}'")
+        task_logger.debug("  Helper find_value: Found '%s'", value_str)
         return value_str, value_match.end()
-    task_logger.debug(f"  Helper find_value: No value found in '{segment}'")
+    task_logger.debug("  Helper find_value: No value found in '%s'", segment)
     return None, -1
 
 def find_unit(segment, default_unit):
     """Ищет первую единицу измерения в сегменте строки."""
     unit_match = UNIT_PATTERN_COMPILED.search(segment)
     if unit_match:
-        unit_str = unit_match.group(1)
-        # Нормализация
-        if unit_str.lower() in ['тыс/мка', 'тыс/мкл', 'тыс./мкл']: unit_str = 'x10^9/л'
-        if unit_str.lower() in ['млн/мка', 'млн/мкл', 'млн./мкл']: unit_str = 'x10^12/л'
-        if unit_str.lower() in ['мм/ч']: unit_str = 'мм/час'
-        if unit_str.lower() in ['г/дл']: unit_str = 'g/dL'
-        if unit_str.lower() in ['пг']: unit_str = 'pg'
-        task_logger.debug(f"    Helper find_unit: Found '{unit_str}'")
+        unit_str = normalize_unit(unit_match.group(1))
+        task_logger.debug("    Helper find_unit: Found '%s'", unit_str)
         return unit_str
-    task_logger.debug(f"    Helper find_unit: Not found in '{segment}', using default '{default_unit}'")
+    task_logger.debug("    Helper find_unit: Not found in '%s', using default '%s'", segment, default_unit)
     return default_unit
 
 def find_reference_range(segment):
     """Ищет первый референсный диапазон в сегменте строки."""
     ref_match = REF_PATTERN_COMPILED.search(segment)
     if ref_match:
-        potential_range = next((g for g in ref_match.groups()[::-1] if g), ref_match.group(0))
-        if potential_range:
-            cleaned_range = potential_range.strip().replace('(', '').replace(')', '').replace('[', '').replace(']', '')
-            if re.search(r'\d', cleaned_range):
-                task_logger.debug(f"    Helper find_reference_range: Found '{cleaned_range}'")
-                return cleaned_range
-            else:
-                task_logger.debug(f"    Helper find_reference_range: Potential match '{cleaned_range}' ignored (no digits).")
-    task_logger.debug(f"    Helper find_reference_range: Not found in '{segment}'.")
+        cleaned_range = _clean_reference_match(ref_match.groups(), ref_match.group(0))
+        task_logger.debug("    Helper find_reference_range: %r in '%s'.", cleaned_range, segment)
+        return cleaned_range
+    task_logger.debug("    Helper find_reference_range: Not found in '%s'.", segment)
     return None
 
 def find_status_text(line):
@@ -137,113 +192,557 @@ def find_status_text(line):
     status_match = STATUS_TEXT_PATTERN_COMPILED.search(line)
     if status_match:
         status_text = status_match.group(1).strip()
-        task_logger.debug(f"    Helper find_status_text: Found status text '{status_text}'")
-        # Определяем is_abnormal на основе текста
-        is_abnormal = None
-        if status_text.lower() in ['в норме', 'норма', 'отрицательно', 'не обнаружено']:
-            is_abnormal = False
-        elif status_text.lower() in ['ниже нормы', 'выше нормы', 'патология', 'отклонение', 'положительно', 'обнаружено']:
-            is_abnormal = True
-        return status_text, is_abnormal
-    task_logger.debug(f"    Helper find_status_text: No status text found.")
+        task_logger.debug("    Helper find_status_text: Found status text '%s'", status_text)
+        return status_text, status_abnormality(status_text)
+    task_logger.debug("    Helper find_status_text: No status text found.")
     return None, None
 
 
+class ResultLineTokens:
+    """Значение, единица, диапазон с границами и текстовый статус строки результата."""
+    __slots__ = ('value', 'unit', 'reference_range', 'lower_bound', 'upper_bound', 'status_text', 'is_abnormal')
+
+    def __init__(self, value, unit, reference_range, lower_bound, upper_bound, status_text, is_abnormal):
+        self.value = value
+        self.unit = unit
+        self.reference_range = reference_range
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.status_text = status_text
+        self.is_abnormal = is_abnormal
+
+
+def tokenize_result_line(line, match_end, default_unit):
+    """
+    Разбирает часть строки после алиаса аналита (line[match_end:]) вместо цепочки
+    find_value/find_reference_range/find_unit/find_status_text: каждый участок хвоста
+    просматривается один раз, диапазон не разбирается повторно строковыми regex.
+    Результат совпадает с этой цепочкой, включая нормализацию единиц.
+    Возвращает None, если числового значения нет.
+
+    is_abnormal здесь — только по текстовому статусу; границы диапазона
+    разбираются всегда, когда диапазон найден (сохраняются в ref_low/ref_high).
+    """
+    segment = line[match_end:].strip()
+    value_match = VALUE_PATTERN_COMPILED.search(segment)
+    if not value_match:
+        return None
+    tail = segment[value_match.end():]
+    rest = tail.strip()
+    reference_range = unit = status_match = None
+    # Первый токен после значения — общим выражением; остальное ищется с его начала:
+    # единица может начинаться внутри диапазона ("6.5 - 10^9/л"), поэтому не с конца.
+    first = RESULT_TOKEN_PATTERN_COMPILED.search(rest)
+    if first is not None and first.group('status') is not None:
+        status_match = first
+    elif first is not None:
+        if first.group('ref') is not None:
+            reference_range = _clean_reference_match(first.groups()[1:1 + _REF_GROUP_COUNT], first.group('ref'))
+            unit_match = UNIT_PATTERN_COMPILED.search(rest, first.start())
+            if unit_match is not None:
+                unit = normalize_unit(unit_match.group(1))
+        else:
+            unit = normalize_unit(first.group('unit'))
+            ref_match = REF_PATTERN_COMPILED.search(rest, first.start())
+            if ref_match is not None:
+                reference_range = _clean_reference_match(ref_match.groups(), ref_match.group(0))
+        status_match = STATUS_TEXT_PATTERN_COMPILED.search(rest, first.end())
+
+    status_text = is_abnormal = None
+    if status_match is not None and status_match.start() == 0 and tail[:1] and not tail[:1].isspace():
+        # Статус вплотную к значению ("5Норма"): граница слова считается по всей строке
+        status_match = STATUS_TEXT_PATTERN_COMPILED.search(line)
+    if status_match is not None:
+        status_text = status_match.group('status').strip()
+        is_abnormal = status_abnormality(status_text)
+
+    lower_bound = upper_bound = None
+    if reference_range:
+        lower_bound, upper_bound = parse_reference_range(reference_range)
+    return ResultLineTokens(
+        value_match.group(1).replace(',', '.'), unit or default_unit, reference_range,
+        lower_bound, upper_bound, status_text, is_abnormal,
+    )
+
+
+def tokenize_result_cells(cells, default_unit):
+    """
+    Значение, единица, диапазон и статус из ячеек строки таблицы, разрезанной
+    по шаблону колонок (см. data/layouts.py). Каждое поле ищется только в своей
+    ячейке; единица, не известная UNIT_PATTERNS_LIST, и любой текст статуса
+    берутся как есть. Возвращает None, если в ячейке значения нет числа.
+    """
+    value_match = VALUE_PATTERN_COMPILED.search(cells.get('value', ''))
+    if not value_match:
+        return None
+    unit = reference_range = status_text = is_abnormal = None
+    unit_cell = cells.get('unit')
+    if unit_cell:
+        unit_match = UNIT_PATTERN_COMPILED.search(unit_cell)
+        unit = normalize_unit(unit_match.group(1) if unit_match else unit_cell.strip())
+    reference_cell = cells.get('reference')
+    if reference_cell:
+        ref_match = REF_PATTERN_COMPILED.search(reference_cell)
+        if ref_match:
+            reference_range = _clean_reference_match(ref_match.groups(), ref_match.group(0))
+    status_cell = cells.get('status')
+    if status_cell:
+        status_text = ' '.join(status_cell.split())
+        is_abnormal = status_abnormality(status_text)
+
+    lower_bound = upper_bound = None
+    if reference_range:
+        lower_bound, upper_bound = parse_reference_range(reference_range)
+    return ResultLineTokens(
+        value_match.group(1).replace(',', '.'), unit or default_unit, reference_range,
+        lower_bound, upper_bound, status_text, is_abnormal,
+    )
+
+
+def potential_result_name(line):
+    """
+    Название из строки, похожей на результат ("<название> <число> ..."), или None.
+    Совпадает с group(1).strip() прежнего POTENTIAL_RESULT_PATTERN_COMPILED.
+    """
+    for match in POTENTIAL_RESULT_PATTERN_COMPILED.finditer(line):
+        run = match.group('run')
+        # Без последнего пробела перед числом (или пробела и знака минус)
+        name = run[:-2] if run.endswith('-') else run[:-1]
+        if name:
+            return name.strip()
+    return None
+
+
+def save_results_in_batches(results, batch_size=100):
+    """
+    Сохраняет объекты TestResult пачками через bulk_create.
+
+    Каждая пачка выполняется в собственном savepoint. Если пачка падает, она
+    повторяется построчно, чтобы ошибка относилась к конкретному результату.
+    Возвращает список ошибок той же длины, что и results (None — строка сохранена).
+    """
+    errors = [None] * len(results)
+    for start in range(0, len(results), batch_size):
+        chunk = results[start:start + batch_size]
+        try:
+            with transaction.atomic():
+                TestResult.objects.bulk_create(chunk)
+            continue
+        except Exception as bulk_err:
+            task_logger.warning(f"Bulk insert of {len(chunk)} results failed ({bulk_err}); retrying row by row.")
+        for offset, result in enumerate(chunk):
+            try:
+                with transaction.atomic():
+                    result.save(force_insert=True)
+            except OperationalError as db_op_err:
+                task_logger.error(f"DB operational error saving result for analyte {result.analyte_id}: {db_op_err}")
+                errors[start + offset] = db_op_err
+            except Exception as db_err:
+                task_logger.exception(f"Error saving result for analyte {result.analyte_id}: {db_err}", exc_info=True)
+                errors[start + offset] = db_err
+    return errors
+
+
 # --- Функция определения типа теста ---
+TEST_TYPE_SCORE_THRESHOLD = 50.0
+
 def determine_test_type(found_analyte_ids):
-    # (Код без изменений)
+    """
+    Определяет тип теста по найденным аналитам через обратный индекс
+    аналит -> типы (data/analyte_index.py), без запросов к БД.
+    Возвращает TestTypeRecord лучшего кандидата с оценкой не ниже порога или None.
+    """
     if not found_analyte_ids:
         task_logger.warning("Cannot determine test type: no analytes found.")
         return None
     task_logger.debug(f"Attempting to determine test type from {len(found_analyte_ids)} found analyte IDs.")
     try:
-        test_types = TestType.objects.prefetch_related('typical_analytes').all()
-        if not test_types.exists():
+        alias_index = get_alias_index()
+        if not alias_index.test_types:
             task_logger.warning("No TestTypes found in the database.")
             return None
-        type_scores = Counter()
-        found_set = set(found_analyte_ids)
-        for test_type in test_types:
-            typical_ids = set(test_type.typical_analytes.values_list('id', flat=True))
-            if not typical_ids: continue
-            intersection_count = len(found_set.intersection(typical_ids))
-            match_percentage = (intersection_count / len(typical_ids)) * 100 if typical_ids else 0
-            type_scores[test_type] = match_percentage
-            task_logger.debug(f"  TestType '{test_type.name}': Found {intersection_count}/{len(typical_ids)} typical analytes ({match_percentage:.1f}%)")
-        if not type_scores:
-             task_logger.warning("No test types with associated typical analytes found.")
-             return None
-        threshold = 50.0
-        best_match_type = None
-        highest_score = -1
-        for test_type, score in type_scores.items():
-             if score >= threshold and score > highest_score:
-                 highest_score = score
-                 best_match_type = test_type
-        if best_match_type:
-            task_logger.info(f"Determined TestType as: {best_match_type.name} (Score: {highest_score:.1f}%)")
-            return best_match_type
-        else:
-            task_logger.warning(f"Could not determine test type meeting threshold ({threshold}%). Max score: {max(type_scores.values()) if type_scores else 0:.1f}%")
-            return None
+        candidates = alias_index.rank_test_types(found_analyte_ids)
+        for candidate in candidates:
+            task_logger.debug("  TestType '%s': Found %s/%s typical analytes (%.1f%%)", candidate.test_type.name, candidate.matched, candidate.test_type.typical_count, candidate.score)
+        if candidates and candidates[0].score >= TEST_TYPE_SCORE_THRESHOLD:
+            best = candidates[0]
+            task_logger.info(f"Determined TestType as: {best.test_type.name} (Score: {best.score:.1f}%)")
+            return best.test_type
+        task_logger.warning(f"Could not determine test type meeting threshold ({TEST_TYPE_SCORE_THRESHOLD}%). Max score: {candidates[0].score if candidates else 0:.1f}%")
+        return None
     except Exception as e:
         task_logger.error(f"Error during test type determination: {e}", exc_info=True)
         return None
 
 # --- Функция извлечения даты теста ---
+TEST_DATE_PATTERN_COMPILED = re.compile(r'(\d{1,2}[./-]\d{1,2}[./-]\d{4}|\d{4}[./-]\d{1,2}[./-]\d{1,2})')
+TEST_DATE_KEYWORDS = [
+    r'Дата и время взятия биоматериала', r'Биоматериалды алу мерзімі',
+    r'Дата взятия', r'Дата анализа', r'Дата исследования',
+    r'Test Date', r'Collection Date', r'Дата поступления образца',
+    r'Үлгінің келіп түскен күні', r'Дата регистрации заявки',
+    r'Жолдаманы тіркеу мерзімі',
+]
+TEST_DATE_KEYWORD_PATTERN_COMPILED = re.compile('|'.join(TEST_DATE_KEYWORDS), re.IGNORECASE)
+# Форматы "день первым", которые dateutil(dayfirst=True) понимает так же; остальное — через dateutil
+TEST_DATE_FAST_FORMATS = ('%d.%m.%Y', '%d/%m/%Y', '%d-%m-%Y')
+
+
+def parse_test_date(date_str):
+    """Дата из строки: strptime для типовых форматов, иначе dateutil (dayfirst)."""
+    for date_format in TEST_DATE_FAST_FORMATS:
+        try:
+            return datetime.datetime.strptime(date_str, date_format).date()
+        except ValueError:
+            continue
+    return date_parse(date_str, dayfirst=True).date()
+
+
+def is_plausible_test_date(value):
+    return datetime.date(1990, 1, 1) <= value <= timezone.localdate() + datetime.timedelta(days=1)
+
+
+def _header_region_end(text, pages):
+    """Позиция конца первых pages страниц текста (pages <= 0 — весь текст)."""
+    if pages <= 0:
+        return len(text)
+    position = -1
+    for _ in range(pages):
+        position = text.find(PAGE_SEPARATOR, position + 1)
+        if position == -1:
+            return len(text)
+    return position
+
+
 def extract_test_date(text):
-    # (Код без изменений)
-    date_pattern = r'(\d{1,2}[./-]\d{1,2}[./-]\d{4}|\d{4}[./-]\d{1,2}[./-]\d{1,2})'
-    keywords = [
-        r'Дата и время взятия биоматериала', r'Биоматериалды алу мерзімі',
-        r'Дата взятия', r'Дата анализа', r'Дата исследования',
-        r'Test Date', r'Collection Date', r'Дата поступления образца',
-        r'Үлгінің келіп түскен күні', r'Дата регистрации заявки',
-        r'Жолдаманы тіркеу мерзімі',
-    ]
-    lines = text.split('\n')
-    for i, line in enumerate(lines):
-        for keyword in keywords:
-            if re.search(keyword, line, re.IGNORECASE):
-                task_logger.debug(f"Found keyword '{keyword}' in line: {line}")
-                search_area = line + "\n" + "\n".join(lines[i+1:i+3])
-                date_match = re.search(date_pattern, search_area)
-                if date_match:
-                    date_str = date_match.group(1)
-                    task_logger.debug(f"Potential date string found: '{date_str}'")
-                    try:
-                        parsed_date = date_parse(date_str, dayfirst=True).date()
-                        if datetime.date(1990, 1, 1) <= parsed_date <= timezone.localdate() + datetime.timedelta(days=1):
-                             task_logger.info(f"Extracted test date: {parsed_date}")
-                             return parsed_date
-                        else:
-                             task_logger.warning(f"Parsed date {parsed_date} is outside the plausible range.")
-                    except (ParserError, ValueError) as e:
-                        task_logger.warning(f"Could not parse date string '{date_str}': {e}")
+    """
+    Дата теста по ключевым словам в шапке отчета: ищется строка с ключевым словом
+    (одно общее выражение) в первых TEST_DATE_SEARCH_PAGES страницах, дата — в ней
+    и в двух следующих строках.
+    """
+    region_end = _header_region_end(text, getattr(settings, 'TEST_DATE_SEARCH_PAGES', 2))
+    position = 0
+    while True:
+        keyword_match = TEST_DATE_KEYWORD_PATTERN_COMPILED.search(text, position, region_end)
+        if not keyword_match:
+            break
+        line_start = text.rfind('\n', 0, keyword_match.start()) + 1
+        line_end = text.find('\n', keyword_match.end())
+        if line_end == -1: line_end = len(text)
+        # Строка с ключевым словом и две следующие
+        area_end = line_end
+        for _ in range(2):
+            if area_end >= len(text): break
+            area_end = text.find('\n', area_end + 1)
+            if area_end == -1: area_end = len(text)
+        position = line_end + 1
+
+        task_logger.debug(f"Found keyword '{keyword_match.group(0)}' in line: {text[line_start:line_end]}")
+        date_match = TEST_DATE_PATTERN_COMPILED.search(text, line_start, area_end)
+        if date_match:
+            date_str = date_match.group(1)
+            task_logger.debug(f"Potential date string found: '{date_str}'")
+            try:
+                parsed_date = parse_test_date(date_str)
+                if is_plausible_test_date(parsed_date):
+                     task_logger.info(f"Extracted test date: {parsed_date}")
+                     return parsed_date
+                else:
+                     task_logger.warning(f"Parsed date {parsed_date} is outside the plausible range.")
+            except (ParserError, ValueError) as e:
+                task_logger.warning(f"Could not parse date string '{date_str}': {e}")
     task_logger.warning("Could not extract a plausible test date from the PDF text.")
     return None
 
 
+# --- Шаблоны Раскладки Лабораторий (см. data/layouts.py) ---
+# Кэш процесса: отпечаток -> (момент устаревания, (id, columns) или None)
+_layout_template_cache = {}
+LAYOUT_TEMPLATE_CACHE_MAX = 1024
+
+def _cache_layout_template(fingerprint, template):
+    if len(_layout_template_cache) >= LAYOUT_TEMPLATE_CACHE_MAX:
+        _layout_template_cache.clear()
+    ttl = getattr(settings, 'LAB_LAYOUT_CACHE_SECONDS', 300)
+    _layout_template_cache[fingerprint] = (time.monotonic() + ttl, template)
+
+def find_layout_template(fingerprint):
+    """
+    (id, columns) активного шаблона раскладки с этим отпечатком или None.
+    Ответ (и его отсутствие) кэшируется в процессе на LAB_LAYOUT_CACHE_SECONDS:
+    отключение шаблона в админке вступает в силу в пределах этого времени.
+    """
+    cached = _layout_template_cache.get(fingerprint)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    template = LabLayoutTemplate.objects.filter(fingerprint=fingerprint, is_active=True).values_list('id', 'columns').first()
+    _cache_layout_template(fingerprint, template)
+    return template
+
+def update_layout_template(layout_pass, submission_id):
+    """
+    После разбора: счетчики использованного шаблона, либо (режим 'learning')
+    новый шаблон, если разбор по колонкам совпал с построчным не меньше чем в
+    LAB_LAYOUT_MIN_ROWS строках и доля совпадений не ниже LAB_LAYOUT_MIN_AGREEMENT.
+    Возвращает созданный шаблон или None.
+    """
+    if layout_pass.mode == 'template':
+        LabLayoutTemplate.objects.filter(id=layout_pass.template_id).update(
+            documents_parsed=F('documents_parsed') + 1,
+            rows_sliced=F('rows_sliced') + layout_pass.rows_sliced,
+            rows_fallback=F('rows_fallback') + layout_pass.rows_fallback,
+            last_used_at=timezone.now(),
+        )
+        return None
+    if layout_pass.mode != 'learning':
+        return None
+    if (layout_pass.rows_agreed < getattr(settings, 'LAB_LAYOUT_MIN_ROWS', 5)
+            or layout_pass.agreement() < getattr(settings, 'LAB_LAYOUT_MIN_AGREEMENT', 0.9)):
+        return None
+    # Шаблон с этим отпечатком мог появиться параллельно или быть отключен вручную — не трогаем
+    template, created = LabLayoutTemplate.objects.get_or_create(
+        fingerprint=layout_pass.fingerprint,
+        defaults={
+            'header_labels': layout_pass.header_labels,
+            'columns': layout_pass.columns.as_list(),
+            'sample_submission_id': submission_id,
+        },
+    )
+    if not created:
+        return None
+    transaction.on_commit(lambda: _cache_layout_template(template.fingerprint, (template.id, template.columns)))
+    return template
+
+
 # --- Основная Функция Обработки PDF (v14) ---
-def process_pdf_submission_plain(submission_id):
+class DocumentParser:
+    """
+    Разбор строк одного документа в результаты анализов: найденные (еще не
+    сохраненные) результаты, детали разбора и строки, похожие на результаты
+    неизвестных аналитов. Общий для обработки PDF и повторного разбора
+    сохраненного текста (data/reparse.py).
+    """
+
+    def __init__(self, submission, alias_index, layout_pass=None, trace=None, log_prefix=''):
+        self.submission = submission
+        self.alias_index = alias_index
+        self.layout_pass = layout_pass if layout_pass is not None else LayoutPass()
+        self.trace = trace
+        self.log_prefix = log_prefix
+        # Сохраненные flush_results() результаты и их аналиты (для определения типа теста)
+        self.saved_results = []
+        self.found_analyte_ids = []
+        self.reset()
+
+    def reset(self):
+        """Состояние нового прохода по документу (сохраненные результаты не сбрасываются)."""
+        self.line_count = 0
+        self.parsing_details = []
+        # (TestResult, аналит, индекс деталей в parsing_details) до сохранения пачкой
+        self.pending_results = []
+        self.unrecognized_details = []
+        self.unrecognized_lines = []
+        self.processed_analytes = set()
+        if self.trace is not None: self.trace.clear()
+        self.layout_pass.reset()
+
+    @property
+    def parsed_results_count(self):
+        return len(self.saved_results)
+
+    @property
+    def pending_analyte_ids(self):
+        """Аналиты найденных, еще не сохраненных результатов (тип теста до записи)."""
+        return [analyte.id for _, analyte, _ in self.pending_results]
+
+    def parse_rows(self, rows):
+        """Разбирает строки документа: (номер строки, строка, ячейки по колонкам или None)."""
+        alias_index = self.alias_index
+        analyte_map = alias_index.alias_map
+        alias_matcher = alias_index.matcher
+        layout_pass = self.layout_pass
+        trace = self.trace
+        processed_analytes = self.processed_analytes
+
+        def accept(alias):
+            return analyte_map[alias].id not in processed_analytes
+
+        for i, line, cells in rows:
+            self.line_count = i + 1
+            line = line.strip()
+            if not line or line == PAGE_BREAK_MARKER: continue
+
+            found_analyte_on_line = None
+            matched_alias = None
+            tokens = None
+
+            # Строка таблицы известной раскладки: алиас ищется только в ячейке
+            # названия, значение, единица, диапазон и статус — каждый в своей ячейке
+            column_match = column_tokens = None
+            if cells is not None and 'name' in cells:
+                column_match = alias_index.find_in_cell(cells['name'], accept=accept)
+                if column_match:
+                    column_tokens = tokenize_result_cells(cells, analyte_map[column_match[0]].unit)
+                    if column_tokens is None: column_match = None
+
+            parsed_by_columns = column_match is not None and layout_pass.mode == 'template'
+            if parsed_by_columns:
+                matched_alias = column_match[0]
+                found_analyte_on_line = analyte_map[matched_alias]
+                tokens = column_tokens
+                layout_pass.rows_sliced += 1
+            else:
+                # Один проход автомата по строке вместо отдельного regex на каждый алиас;
+                # приоритет "самый длинный алиас" сохранен порядком sorted_aliases.
+                best_match = alias_matcher.find_best(line, accept=accept)
+                if best_match:
+                    matched_alias, _, match_end_index = best_match
+                    found_analyte_on_line = analyte_map[matched_alias]
+                    task_logger.debug("Potential match: Alias='%s', Analyte='%s' in line %s", matched_alias, found_analyte_on_line.name, i)
+                    # Значение, единица, диапазон и статус — одним проходом по хвосту строки
+                    tokens = tokenize_result_line(line, match_end_index, found_analyte_on_line.unit)
+                if cells is not None and layout_pass.mode == 'learning' and (tokens or column_match):
+                    # Сверка разбора по колонкам с построчным (решение о сохранении шаблона)
+                    layout_pass.rows_compared += 1
+                    if (tokens and column_match and analyte_map[column_match[0]].id == found_analyte_on_line.id
+                            and column_tokens.value == tokens.value
+                            and column_tokens.reference_range == tokens.reference_range):
+                        layout_pass.rows_agreed += 1
+                elif cells is not None and layout_pass.mode == 'template' and tokens:
+                    layout_pass.rows_fallback += 1
+
+            if found_analyte_on_line:
+                analyte = found_analyte_on_line
+
+                if tokens:
+                    value_str = tokens.value
+                    try:
+                        decimal_context = Context(prec=14, rounding=ROUND_HALF_UP)
+                        value_numeric = decimal_context.create_decimal(value_str)
+                        ref_range_str = tokens.reference_range
+                        unit_str = tokens.unit
+                        status_text_from_pdf = tokens.status_text
+
+                        # --- Определение is_abnormal (Приоритет у текста) ---
+                        is_abnormal_flag = tokens.is_abnormal
+                        if is_abnormal_flag is None and ref_range_str and value_numeric is not None:
+                            lower_bound, upper_bound = tokens.lower_bound, tokens.upper_bound
+                            try:
+                                if lower_bound is not None and value_numeric < lower_bound: is_abnormal_flag = True
+                                elif upper_bound is not None and value_numeric > upper_bound: is_abnormal_flag = True
+                                elif lower_bound is not None and upper_bound is not None: is_abnormal_flag = False
+                                task_logger.debug("    Abnormality check by range: Value=%s, Abnormal=%s", value_numeric, is_abnormal_flag)
+                            except TypeError as comp_err:
+                                task_logger.warning(f"    Could not compare value {value_numeric} with range bounds: {comp_err}")
+                            except Exception as range_check_err:
+                                 task_logger.error(f"    Error during range abnormality check: {range_check_err}")
+
+                        # --- Создание Объекта TestResult (сохраняется пачкой, см. _flush_pending_results) ---
+                        result = TestResult(
+                            submission=self.submission, analyte_id=analyte.id,
+                            value=value_str[:100], value_numeric=value_numeric,
+                            unit=(unit_str[:50] if unit_str else analyte.unit),
+                            reference_range=(ref_range_str[:150] if ref_range_str else None),
+                            ref_low=tokens.lower_bound, ref_high=tokens.upper_bound,
+                            status_text=(status_text_from_pdf[:100] if status_text_from_pdf else None), # <-- Сохраняем текст
+                            is_abnormal=is_abnormal_flag, # Сохраняем True/False/None
+                            extracted_at=timezone.now()
+                        )
+                        # Аналит считается занятым сразу, чтобы пара (submission, analyte) оставалась уникальной
+                        self.processed_analytes.add(analyte.id)
+                        details = f"Parsed {analyte.name} ('{matched_alias}'): {value_str} {unit_str or ''}"
+                        if ref_range_str: details += f" (Ref: {ref_range_str})"
+                        # Используем текстовый статус в логе, если он есть
+                        if status_text_from_pdf:
+                             details += f" (Status: {status_text_from_pdf})"
+                        elif is_abnormal_flag is not None:
+                             details += f" (Abnormal: {is_abnormal_flag})"
+                        self.parsing_details.append(details)
+                        self.pending_results.append((result, analyte, len(self.parsing_details) - 1))
+                        if trace is not None:
+                            trace.add(
+                                i, line, 'result', analyte=analyte.name, alias=matched_alias, value=value_str,
+                                unit=unit_str, reference_range=ref_range_str, status_text=status_text_from_pdf,
+                                is_abnormal=is_abnormal_flag, source=('columns' if parsed_by_columns else 'line'),
+                            )
+
+                    except InvalidOperation:
+                         task_logger.warning(f"Value '{value_str}' not valid Decimal for {analyte.name} on line {i}.")
+                         self.parsing_details.append(f"Invalid number '{value_str}' for {analyte.name}.")
+                         if trace is not None: trace.add(i, line, 'invalid_number', analyte=analyte.name, value=value_str)
+                else:
+                     task_logger.debug("  No numeric value found after alias '%s' for %s on line %s.", matched_alias, analyte.name, i)
+                     if trace is not None: trace.add(i, line, 'no_value', analyte=analyte.name, alias=matched_alias)
+            else:
+                # Строка без известного аналита: похожа ли она на неопознанный результат
+                if len(line.split()) < 3 or UNRECOGNIZED_SKIP_PATTERN_COMPILED.match(line):
+                    if trace is not None: trace.add(i, line, 'skipped')
+                    continue
+                potential_name = potential_result_name(line)
+                if potential_name is not None and len(potential_name) > 3 and LETTER_PATTERN_COMPILED.search(potential_name):
+                    log_message = f"Возможно, неопознанный результат (строка {i}): '{line}'"
+                    self.unrecognized_details.append(log_message)
+                    self.unrecognized_lines.append(UnrecognizedResultLine(
+                        submission=self.submission, line_number=i, line=line,
+                        candidate_name=potential_name[:255],
+                        name_key=UnrecognizedResultLine.make_name_key(potential_name),
+                    ))
+                    # Итог — одним предупреждением после разбора; строки есть в деталях и таблице
+                    task_logger.debug("%s", log_message)
+                    if trace is not None: trace.add(i, line, 'unrecognized', candidate=potential_name)
+                elif trace is not None:
+                    trace.add(i, line, 'no_match')
+
+
+    def flush_results(self, batch_size):
+        """Сохраняет найденные результаты пачками; детали несохраненных заменяются ошибкой."""
+        batch = self.pending_results[:]
+        self.pending_results.clear()
+        saved_count = 0
+        errors = save_results_in_batches([result for result, _, _ in batch], batch_size)
+        for (result, analyte, details_index), error in zip(batch, errors):
+            if error is None:
+                self.saved_results.append(result)
+                self.found_analyte_ids.append(analyte.id)
+                saved_count += 1
+            elif isinstance(error, OperationalError):
+                self.parsing_details[details_index] = f"DB error saving result for {analyte.name}."
+            else:
+                self.parsing_details[details_index] = f"Error saving result for {analyte.name}."
+        task_logger.info(f"{self.log_prefix}Saved {saved_count}/{len(batch)} results in bulk.")
+
+
+class LeaseLostError(Exception):
+    """Загрузку забрал другой воркер (или сменился статус): результаты прогона не записываются."""
+
+
+def process_pdf_submission_plain(submission_id, lease_owner=None):
+    """
+    Обрабатывает загруженный PDF. Если передан lease_owner, загрузка уже взята
+    в работу этим владельцем (см. data/ingest_queue.py); иначе задача сама
+    переводит ее из PENDING/FAILED в PROCESSING и берет аренду на себя.
+    """
     task_id = f"thread-{threading.get_ident()}"
     task_logger.info(f"[PDF Task {task_id}] Starting for submission ID: {submission_id}")
     submission = None
     extracted_text = ""
     page_count = 0
     processing_error = None
-    parsed_results_count = 0
-    parsing_details = []
-    created_results_list = []
-    found_analyte_ids_for_typing = []
     determined_type = None
     extracted_date = None
-    processed_line_indices = set()
+    dictionary_version = None
+    # Загрузка переведена в COMPLETED/FAILED этим прогоном
+    finalized = False
+    # Длительности стадий и счетчики, сохраняются в processing_metrics (см. data/metrics.py)
+    timer = StageTimer()
+    # Трассировка решений парсера по строкам (только для загрузок с trace_processing)
+    trace = None
 
     try:
         # --- Получение Объекта Загрузки ---
         try:
-            submission = MedicalTestSubmission.objects.select_related('test_type', 'user').get(id=submission_id)
+            with timer.stage('fetch'):
+                submission = MedicalTestSubmission.objects.select_related('test_type', 'user').get(id=submission_id)
             task_logger.info(f"[PDF Task {task_id}] Found submission {submission.id} for user {submission.user.id}")
         except MedicalTestSubmission.DoesNotExist:
             task_logger.error(f"[PDF Task {task_id}] Submission {submission_id} not found. Aborting.")
@@ -251,25 +750,44 @@ def process_pdf_submission_plain(submission_id):
         except OperationalError as db_err:
              task_logger.error(f"[PDF Task {task_id}] DB error fetching submission {submission_id}: {db_err}. Aborting.")
              return
+        if submission.trace_processing:
+            trace = LineTrace(getattr(settings, 'INGEST_TRACE_BUFFER_LINES', 500))
 
         # --- Предварительные Проверки ---
         if not submission.uploaded_file or not hasattr(submission.uploaded_file, 'path') or not submission.uploaded_file.name.lower().endswith('.pdf'):
             error_msg = "No valid PDF file associated with this submission."
             MedicalTestSubmission.objects.filter(id=submission_id).update(
                 processing_status=MedicalTestSubmission.StatusChoices.FAILED,
-                processing_details=error_msg, updated_at=timezone.now()
+                processing_details=error_msg, lease_owner=None, lease_expires_at=None,
+                updated_at=timezone.now()
             )
             return
 
         # --- Обновление Статуса на PROCESSING (Атомарно) ---
-        updated_count = MedicalTestSubmission.objects.filter(
-            id=submission_id,
-            processing_status__in=[MedicalTestSubmission.StatusChoices.PENDING, MedicalTestSubmission.StatusChoices.FAILED]
-        ).update(
-            processing_status=MedicalTestSubmission.StatusChoices.PROCESSING,
-            processing_details=f"Task {task_id} started processing...",
-            extracted_text="", test_date=None, updated_at=timezone.now()
-        )
+        with timer.stage('claim'):
+            now = timezone.now()
+            if lease_owner:
+                # Загрузка уже захвачена воркером очереди с арендой lease_owner
+                updated_count = MedicalTestSubmission.objects.filter(
+                    id=submission_id,
+                    processing_status=MedicalTestSubmission.StatusChoices.PROCESSING,
+                    lease_owner=lease_owner,
+                ).update(
+                    processing_details=f"Task {task_id} started processing...",
+                    test_date=None, updated_at=now
+                )
+            else:
+                lease_owner = task_id
+                updated_count = MedicalTestSubmission.objects.filter(
+                    id=submission_id,
+                    processing_status__in=[MedicalTestSubmission.StatusChoices.PENDING, MedicalTestSubmission.StatusChoices.FAILED]
+                ).update(
+                    processing_status=MedicalTestSubmission.StatusChoices.PROCESSING,
+                    processing_details=f"Task {task_id} started processing...",
+                    lease_owner=lease_owner, lease_expires_at=now + lease_duration(), heartbeat_at=now,
+                    processing_attempts=F('processing_attempts') + 1,
+                    test_date=None, updated_at=now
+                )
         if updated_count == 0:
             try:
                 current_status = MedicalTestSubmission.objects.get(id=submission_id).processing_status
@@ -277,216 +795,227 @@ def process_pdf_submission_plain(submission_id):
             except MedicalTestSubmission.DoesNotExist:
                  task_logger.error(f"[PDF Task {task_id}] Submission {submission_id} disappeared.")
             return
-        submission.refresh_from_db()
+        with timer.stage('claim'):
+            submission.refresh_from_db()
         task_logger.info(f"[PDF Task {task_id}] Set status to PROCESSING for {submission_id}.")
 
-        # --- Извлечение Текста из PDF ---
+        # --- Карта Алиасов Аналитов (кэш процесса, см. data/analyte_index.py) ---
         try:
-            pdf_path = submission.uploaded_file.path
-            task_logger.info(f"[PDF Task {task_id}] Reading PDF file: {pdf_path}")
-            full_text_list = []
-            with pdfplumber.open(pdf_path) as pdf:
-                page_count = len(pdf.pages)
-                task_logger.info(f"[PDF Task {task_id}] PDF has {page_count} pages. Extracting text...")
-                for i, page in enumerate(pdf.pages):
-                    page_text = page.extract_text(x_tolerance=1.5, y_tolerance=1.5, layout=False) or ""
-                    full_text_list.append(page_text)
-            extracted_text = "\n<-- Page Break -->\n".join(full_text_list)
-            submission.extracted_text = extracted_text
-            task_logger.info(f"[PDF Task {task_id}] Text extraction complete. Length: {len(extracted_text)}")
-        except FileNotFoundError:
-            task_logger.error(f"[PDF Task {task_id}] PDF file not found at path: {submission.uploaded_file.path}", exc_info=True)
-            processing_error = f"File Not Found Error: PDF file missing."
-            raise
-        except Exception as pdf_err:
-            task_logger.exception(f"[PDF Task {task_id}] Error reading/extracting PDF {submission_id}: {pdf_err}", exc_info=True)
-            processing_error = f"PDF Reading/Extraction Error: {str(pdf_err)[:500]}"
-            raise
-
-        # --- Извлечение Даты Теста ---
-        if not submission.test_date:
-            extracted_date = extract_test_date(extracted_text)
-            if extracted_date:
-                submission.test_date = extracted_date
-                parsing_details.append(f"Extracted Test Date: {extracted_date.strftime('%d.%m.%Y')}")
-            else:
-                parsing_details.append("Could not extract test date from PDF.")
-        else:
-            parsing_details.append(f"Test Date was pre-filled by user: {submission.test_date.strftime('%d.%m.%Y')}")
-
-        # Сохраняем извлеченный текст и дату (если нашли)
-        submission.save(update_fields=['extracted_text', 'test_date', 'updated_at'])
-
-        # --- Построение Карты Алиасов Аналитов ---
-        task_logger.info(f"[PDF Task {task_id}] Building analyte alias map...")
-        analyte_map = {}
-        try:
-            all_analytes = Analyte.objects.prefetch_related('typical_test_types').all()
-            for analyte in all_analytes:
-                aliases = analyte.get_all_names()
-                for alias in aliases:
-                    if not alias: continue
-                    if alias in analyte_map:
-                        existing_analyte = analyte_map[alias]
-                        if len(analyte.name) > len(existing_analyte.name):
-                            analyte_map[alias] = analyte
-                    else:
-                        analyte_map[alias] = analyte
-            task_logger.info(f"[PDF Task {task_id}] Built map with {len(analyte_map)} unique aliases for {len(all_analytes)} analytes.")
+            with timer.stage('alias_map'):
+                alias_index = get_alias_index()
+            analyte_map = alias_index.alias_map
+            task_logger.info(f"[PDF Task {task_id}] Using alias index v{alias_index.version} with {len(analyte_map)} unique aliases for {len(alias_index.analytes)} analytes.")
+            dictionary_version = alias_index.version
         except Exception as map_build_err:
              task_logger.exception(f"[PDF Task {task_id}] Error building analyte map: {map_build_err}", exc_info=True)
              processing_error = f"Error building analyte map: {str(map_build_err)[:500]}"
              raise
+        try:
+            # Снимок алиасов версии: по нему повторный разбор выбирает затронутые загрузки
+            record_dictionary_snapshot(alias_index)
+        except Exception as snapshot_err:
+            task_logger.warning(f"[PDF Task {task_id}] Could not record analyte dictionary snapshot v{alias_index.version}: {snapshot_err}")
 
-        # --- Парсинг Результатов ---
-        task_logger.info(f"[PDF Task {task_id}] Starting result parsing...")
-        lines = extracted_text.split('\n')
-        sorted_aliases = sorted(analyte_map.keys(), key=len, reverse=True)
-        processed_analytes_in_submission = set()
+        # --- Потоковый разбор PDF: страницы -> строки -> совпадения -> результаты ---
+        # Каждая страница разбирается сразу после извлечения. До конца документа
+        # в памяти остаются только тексты страниц (сохраняются в ExtractedTextPage)
+        # и найденные результаты; список строк всего документа не строится.
+        trace_memory = getattr(settings, 'INGEST_TRACE_MEMORY', False)
+        if trace_memory:
+            if not tracemalloc.is_tracing(): tracemalloc.start()
+            tracemalloc.reset_peak()
 
-        with transaction.atomic():
-            deleted_count, _ = TestResult.objects.filter(submission=submission).delete()
-            if deleted_count > 0: task_logger.info(f"[PDF Task {task_id}] Deleted {deleted_count} old results.")
+        pdf_path = submission.uploaded_file.path
+        task_logger.info(f"[PDF Task {task_id}] Reading PDF file: {pdf_path} (extraction processes: {extraction_processes() or 1})")
+        page_texts = []
 
-            # --- Основной цикл парсинга известных аналитов ---
-            for i, line in enumerate(lines):
-                line = line.strip()
-                if not line or line == '<-- Page Break -->': continue
-                # task_logger.debug(f"Processing Line {i}: '{line}'")
+        def _stream_pages(backend, layouts=False):
+            nonlocal page_count, processing_error
+            try:
+                for page in timer.timed_iter(iter_pdf_pages(pdf_path, backend, layouts), 'extract'):
+                    page_texts.append(page.text if layouts else page)
+                    page_count = len(page_texts)
+                    yield page
+            except FileNotFoundError:
+                task_logger.error(f"[PDF Task {task_id}] PDF file not found at path: {pdf_path}", exc_info=True)
+                processing_error = "File Not Found Error: PDF file missing."
+                raise
+            except Exception as pdf_err:
+                task_logger.exception(f"[PDF Task {task_id}] Error reading/extracting PDF {submission_id}: {pdf_err}", exc_info=True)
+                processing_error = f"PDF Reading/Extraction Error: {str(pdf_err)[:500]}"
+                raise
 
-                found_analyte_on_line = None
-                matched_alias = None
-                match_object = None
+        # Разбор таблицы по шаблону колонок лаборатории (data/layouts.py)
+        use_layouts = getattr(settings, 'LAB_LAYOUT_TEMPLATES', False)
+        layout_pass = LayoutPass()
+        parser = DocumentParser(submission, alias_index, layout_pass, trace, log_prefix=f"[PDF Task {task_id}] ")
 
-                for alias in sorted_aliases:
-                    try:
-                        pattern = r'(?i)\b' + re.escape(alias) + r'(?=\W|$)'
-                        match = re.search(pattern, line)
-                    except re.error as re_err:
-                         task_logger.error(f"Regex error for alias '{alias}': {re_err}")
-                         continue
-
-                    if match:
-                        potential_analyte = analyte_map[alias]
-                        if potential_analyte.id not in processed_analytes_in_submission:
-                            is_part_of_longer_match = False
-                            # ... (проверка на частичное совпадение) ...
-                            if is_part_of_longer_match: continue
-
-                            task_logger.debug(f"Potential match: Alias='{alias}', Analyte='{potential_analyte.name}' in line {i}")
-                            found_analyte_on_line = potential_analyte
-                            matched_alias = alias
-                            match_object = match
-                            break
-
-                if found_analyte_on_line:
-                    processed_line_indices.add(i)
-                    analyte = found_analyte_on_line
-                    match_end_index = match_object.end()
-                    task_logger.debug(f"Processing line {i} for analyte: '{analyte.name}' (via '{matched_alias}')")
-                    potential_segment = line[match_end_index:].strip()
-                    task_logger.debug(f"  Segment after alias: '{potential_segment}'")
-
-                    value_str, value_end_index = find_value(potential_segment)
-
-                    if value_str:
-                        try:
-                            decimal_context = Context(prec=14, rounding=ROUND_HALF_UP)
-                            value_numeric = decimal_context.create_decimal(value_str)
-                            search_unit_ref_segment = potential_segment[value_end_index:].strip()
-
-                            ref_range_str = find_reference_range(search_unit_ref_segment)
-                            unit_str = find_unit(search_unit_ref_segment, analyte.unit)
-                            status_text_from_pdf, is_abnormal_from_text = find_status_text(line) # <-- Ищем текст статуса
-
-                            # --- Определение is_abnormal (Приоритет у текста) ---
-                            is_abnormal_flag = is_abnormal_from_text
-                            if is_abnormal_flag is None and ref_range_str and value_numeric is not None:
-                                lower_bound, upper_bound = parse_reference_range(ref_range_str)
-                                task_logger.debug(f"    Parsed range bounds: Lower={lower_bound}, Upper={upper_bound}")
-                                try:
-                                    if lower_bound is not None and value_numeric < lower_bound: is_abnormal_flag = True
-                                    elif upper_bound is not None and value_numeric > upper_bound: is_abnormal_flag = True
-                                    elif lower_bound is not None and upper_bound is not None: is_abnormal_flag = False
-                                    task_logger.debug(f"    Abnormality check by range: Value={value_numeric}, Abnormal={is_abnormal_flag}")
-                                except TypeError as comp_err:
-                                    task_logger.warning(f"    Could not compare value {value_numeric} with range bounds: {comp_err}")
-                                except Exception as range_check_err:
-                                     task_logger.error(f"    Error during range abnormality check: {range_check_err}")
-
-                            # --- Создание Объекта TestResult ---
-                            try:
-                                result = TestResult.objects.create(
-                                    submission=submission, analyte=analyte,
-                                    value=value_str[:100], value_numeric=value_numeric,
-                                    unit=(unit_str[:50] if unit_str else analyte.unit),
-                                    reference_range=(ref_range_str[:150] if ref_range_str else None),
-                                    status_text=(status_text_from_pdf[:100] if status_text_from_pdf else None), # <-- Сохраняем текст
-                                    is_abnormal=is_abnormal_flag, # Сохраняем True/False/None
-                                    extracted_at=timezone.now()
-                                )
-                                created_results_list.append(result)
-                                parsed_results_count += 1
-                                processed_analytes_in_submission.add(analyte.id)
-                                found_analyte_ids_for_typing.append(analyte.id)
-                                details = f"Parsed {analyte.name} ('{matched_alias}'): {value_str} {unit_str or ''}"
-                                if ref_range_str: details += f" (Ref: {ref_range_str})"
-                                # Используем текстовый статус в логе, если он есть
-                                if status_text_from_pdf:
-                                     details += f" (Status: {status_text_from_pdf})"
-                                elif is_abnormal_flag is not None:
-                                     details += f" (Abnormal: {is_abnormal_flag})"
-                                parsing_details.append(details)
-                                task_logger.info(f"[PDF Task {task_id}] Created result for {analyte.name} (ID: {result.id})")
-                            except OperationalError as db_op_err:
-                                task_logger.error(f"DB operational error saving result for {analyte.name}: {db_op_err}")
-                                parsing_details.append(f"DB error saving result for {analyte.name}.")
-                            except Exception as db_err:
-                                 task_logger.exception(f"Error saving result for {analyte.name}: {db_err}", exc_info=True)
-                                 parsing_details.append(f"Error saving result for {analyte.name}.")
-
-                        except InvalidOperation:
-                             task_logger.warning(f"Value '{value_str}' not valid Decimal for {analyte.name} on line {i}.")
-                             parsing_details.append(f"Invalid number '{value_str}' for {analyte.name}.")
-                    else:
-                         task_logger.debug(f"  No numeric value found after alias '{matched_alias}' for {analyte.name} on line {i}.")
-
-            # --- Цикл для поиска неопознанных строк ---
-            task_logger.info(f"[PDF Task {task_id}] Checking for potentially unrecognized results...")
-            unrecognized_count = 0
-            for i, line in enumerate(lines):
-                line = line.strip()
-                if not line or line == '<-- Page Break -->' or i in processed_line_indices: continue
-                if len(line.split()) < 3 or re.match(r'^(Показатель|Результат|Норма|Ед\. изм\.|Статус|ГЕМАТОЛОГИЯ|Биохимия|Коагулограмма|Анализ мочи)', line, re.IGNORECASE): continue
-                potential_match = POTENTIAL_RESULT_PATTERN_COMPILED.search(line)
-                if potential_match:
-                    potential_name = potential_match.group(1).strip()
-                    if len(potential_name) > 3 and re.search(r'[а-яА-ЯёЁa-zA-Z]', potential_name):
-                        log_message = f"Возможно, неопознанный результат (строка {i}): '{line}'"
-                        parsing_details.append(log_message)
-                        task_logger.warning(log_message)
-                        unrecognized_count += 1
-            if unrecognized_count > 0:
-                parsing_details.insert(0, f"Обнаружено {unrecognized_count} строк, похожих на неопознанные результаты (см. ниже).")
-            # --- Конец цикла для неопознанных ---
+        def _iter_rows(backend):
+            """(номер строки, строка, ячейки по колонкам или None) документа."""
+            if use_layouts:
+                return iter_layout_rows(_stream_pages(backend, layouts=True), layout_pass, find_layout_template)
+            return ((i, line, None) for i, line in iter_document_lines(_stream_pages(backend)))
+
+        batch_size = getattr(settings, 'INGEST_RESULTS_BATCH_SIZE', 100)
+
+        def _parse_pass(backend):
+            """Один проход по документу: извлечение страниц выбранным бэкендом и разбор строк."""
+            nonlocal page_count
+            page_texts.clear(); page_count = 0
+            parser.reset()
+            task_logger.info(f"[PDF Task {task_id}] Starting result parsing ({backend.name} text)...")
+            parser.parse_rows(_iter_rows(backend))
+
+        # --- Основной цикл: известные аналиты и строки, похожие на неопознанные результаты ---
+        # Быстрый бэкенд (по умолчанию pypdfium2); если его текст не дал ни одного
+        # результата (скан, нестандартная раскладка), документ разбирается заново запасным.
+        # Извлечение и разбор чередуются постранично: время разбора — длительность
+        # проходов за вычетом времени, ушедшего на получение страниц.
+        passes_started = time.perf_counter()
+        text_backend = get_extraction_backend()
+        _parse_pass(text_backend)
+        fallback_backend = get_fallback_backend()
+        fallback_used = False
+        if not parser.pending_results and fallback_backend and fallback_backend.name != text_backend.name:
+            task_logger.info(f"[PDF Task {task_id}] No analytes found in {text_backend.name} text; re-extracting with {fallback_backend.name}.")
+            text_backend = fallback_backend
+            fallback_used = True
+            _parse_pass(text_backend)
+        timer.add('parse', time.perf_counter() - passes_started - timer.elapsed('extract'))
+        unrecognized_details = parser.unrecognized_details
+        # Детали до и после строк разбора (parser.parsing_details индексируются
+        # при сохранении результатов, поэтому в них ничего не вставляется)
+        leading_details = []
+        trailing_details = []
+        timer.count('text_backend', text_backend.name)
+        timer.count('fallback_used', fallback_used)
+        timer.count('pages', page_count)
+        timer.count('lines', parser.line_count)
+        for name, value in layout_pass.as_dict().items():
+            timer.count(name, value)
+
+        extracted_text = PAGE_SEPARATOR.join(page_texts)
+        text_pages = ExtractedTextPage.from_page_texts(submission, page_texts, PAGE_SEPARATOR)
+        text_tokens = ExtractedTextToken.from_page_texts(submission, page_texts)
+        page_texts.clear()
+        task_logger.info(f"[PDF Task {task_id}] Text extraction complete ({page_count} pages, {text_backend.name}). Length: {len(extracted_text)}")
+
+        # --- Извлечение Даты Теста ---
+        if not submission.test_date:
+            date_detail = "Extracted Test Date"
+            with timer.stage('date'):
+                extracted_date = extract_test_date(extracted_text)
+                if not extracted_date and getattr(settings, 'TEST_DATE_FROM_PDF_METADATA', True):
+                    # Дешевый запасной кандидат: дата создания PDF (обычно день выдачи результата)
+                    metadata_date = pdf_creation_date(pdf_path)
+                    if metadata_date and is_plausible_test_date(metadata_date):
+                        extracted_date = metadata_date
+                        date_detail = "Test Date from PDF creation date"
+                        task_logger.info(f"[PDF Task {task_id}] Using PDF creation date {metadata_date} as test date.")
+            if extracted_date:
+                submission.test_date = extracted_date
+                leading_details.append(f"{date_detail}: {extracted_date.strftime('%d.%m.%Y')}")
+            else:
+                leading_details.append("Could not extract test date from PDF.")
+        else:
+            leading_details.append(f"Test Date was pre-filled by user: {submission.test_date.strftime('%d.%m.%Y')}")
+
+        timer.count('unrecognized', len(unrecognized_details))
+        if unrecognized_details:
+            task_logger.warning(f"[PDF Task {task_id}] {len(unrecognized_details)} lines look like results of unknown analytes (see processing details).")
+        trailing_details.extend(unrecognized_details)
+        if unrecognized_details:
+            leading_details.insert(0, f"Обнаружено {len(unrecognized_details)} строк, похожих на неопознанные результаты (см. ниже).")
+
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            task_logger.info(f"[PDF Task {task_id}] Peak traced memory: {peak_memory / 1048576:.1f} MiB for {page_count} pages.")
+            trailing_details.append(f"Peak traced memory: {peak_memory / 1048576:.1f} MiB.")
 
         # --- Определение Типа Теста ---
         determined_type = None
         if not submission.test_type:
-            determined_type = determine_test_type(found_analyte_ids_for_typing)
+            with timer.stage('test_type'):
+                determined_type = determine_test_type(parser.pending_analyte_ids)
             if determined_type:
-                parsing_details.append(f"Automatically determined Test Type: {determined_type.name}")
+                trailing_details.append(f"Automatically determined Test Type: {determined_type.name}")
             else:
-                 parsing_details.append("Could not automatically determine Test Type.")
+                 trailing_details.append("Could not automatically determine Test Type.")
         else:
-             parsing_details.append(f"Test Type was pre-selected by user: {submission.test_type.name}")
+             trailing_details.append(f"Test Type was pre-selected by user: {submission.test_type.name}")
 
-        # --- Финальный Статус: Успех ---
-        submission.processing_status = MedicalTestSubmission.StatusChoices.COMPLETED
-        final_details = f"PDF processed ({page_count} pages). Parsed {parsed_results_count} results.\n---\n" + "\n".join(parsing_details)
-        max_len = MedicalTestSubmission._meta.get_field('processing_details').max_length or 4000
-        submission.processing_details = final_details[:max_len]
-        processing_error = None
+        # --- Запись: одна короткая транзакция ---
+        # Разбор, дата и тип теста уже вычислены; в транзакции только запись: старые
+        # результаты и текст заменяются новыми, статус COMPLETED — последним UPDATE.
+        # Потерянная аренда (загрузку забрал другой воркер) откатывает весь блок.
+        with timer.stage('write'), transaction.atomic():
+            # Точки рядов удаляются каскадом вместе с результатами
+            series_keys = submission_series_keys(submission_id)
+            deleted_count, _ = TestResult.objects.filter(submission=submission).delete()
+            if deleted_count > 0: task_logger.info(f"[PDF Task {task_id}] Deleted {deleted_count} old results.")
+            ExtractedTextPage.objects.filter(submission=submission).delete()
+            ExtractedTextPage.objects.bulk_create(text_pages, batch_size=batch_size)
+            ExtractedTextToken.objects.filter(submission=submission).delete()
+            ExtractedTextToken.objects.bulk_create(text_tokens)
+            if parser.pending_results:
+                parser.flush_results(batch_size)
+            # Неопознанные строки этой загрузки (для сводки пробелов словаря); их сбой не
+            # должен откатывать результаты, поэтому — в собственном savepoint
+            try:
+                with transaction.atomic():
+                    UnrecognizedResultLine.objects.filter(submission=submission).delete()
+                    UnrecognizedResultLine.objects.bulk_create(parser.unrecognized_lines, batch_size=batch_size)
+            except Exception as unrecognized_err:
+                task_logger.warning(f"[PDF Task {task_id}] Could not store {len(parser.unrecognized_lines)} unrecognized lines: {unrecognized_err}")
+            # Шаблон раскладки: счетчики или новый шаблон — в той же транзакции, в своем savepoint
+            learned_template = None
+            if layout_pass.mode is not None:
+                try:
+                    with transaction.atomic():
+                        learned_template = update_layout_template(layout_pass, submission_id)
+                except Exception as layout_err:
+                    task_logger.warning(f"[PDF Task {task_id}] Could not update lab layout template: {layout_err}")
+
+            # --- Финальный Статус: Успех ---
+            final_details = f"PDF processed ({page_count} pages). Parsed {parser.parsed_results_count} results.\n---\n" + "\n".join(leading_details + parser.parsing_details + trailing_details)
+            max_len = MedicalTestSubmission._meta.get_field('processing_details').max_length or 4000
+            update_fields = {
+                'processing_status': MedicalTestSubmission.StatusChoices.COMPLETED,
+                'processing_details': final_details[:max_len],
+                'lease_owner': None,
+                'lease_expires_at': None,
+                'dictionary_version': dictionary_version,
+                'updated_at': timezone.now(),
+            }
+            if determined_type:
+                update_fields['test_type_id'] = determined_type.id
+            if extracted_date:
+                update_fields['test_date'] = extracted_date
+            final_update_count = MedicalTestSubmission.objects.filter(
+                id=submission_id,
+                processing_status=MedicalTestSubmission.StatusChoices.PROCESSING,
+                lease_owner=lease_owner
+            ).update(**update_fields)
+            if not final_update_count:
+                raise LeaseLostError(f"Submission {submission_id} status not PROCESSING (or lease lost) before commit; results discarded.")
+            # Ряды значений аналитов пользователя — по записанным результатам и дате теста;
+            # сбой не откатывает обработку (ряды пересобирает rebuild_analyte_series)
+            try:
+                with transaction.atomic():
+                    refresh_submission_series(submission_id, series_keys)
+            except Exception as series_err:
+                task_logger.warning(f"[PDF Task {task_id}] Could not update analyte series: {series_err}")
+        finalized = True
+        task_logger.info(f"[PDF Task {task_id}] Marked submission {submission_id} as {MedicalTestSubmission.StatusChoices.COMPLETED}.")
+        timer.count('results', parser.parsed_results_count)
+        if learned_template is not None:
+            task_logger.info(f"[PDF Task {task_id}] Learned lab layout template {learned_template.fingerprint[:10]} ({layout_pass.rows_agreed}/{layout_pass.rows_compared} rows agreed).")
+        elif layout_pass.mode == 'template':
+            task_logger.info(f"[PDF Task {task_id}] Parsed table by lab layout template {layout_pass.fingerprint[:10]}: {layout_pass.rows_sliced} rows by columns, {layout_pass.rows_fallback} by line patterns.")
+
+    except LeaseLostError as lease_err:
+        # Загрузка принадлежит другому прогону: ни результатов, ни статуса FAILED
+        task_logger.warning(f"[PDF Task {task_id}] {lease_err}")
 
     except Exception as exc:
         task_logger.exception(f"[PDF Task {task_id}] Unhandled error during processing {submission_id}: {exc}", exc_info=True)
@@ -495,26 +1024,32 @@ def process_pdf_submission_plain(submission_id):
 
     finally:
         if submission:
-            final_status = MedicalTestSubmission.StatusChoices.FAILED if processing_error else MedicalTestSubmission.StatusChoices.COMPLETED
-            details_to_save = processing_error if processing_error else submission.processing_details
             try:
-                update_fields = {
-                    'processing_status': final_status,
-                    'processing_details': details_to_save,
-                    'updated_at': timezone.now()
-                }
-                if determined_type and final_status == MedicalTestSubmission.StatusChoices.COMPLETED:
-                     update_fields['test_type'] = determined_type
-                if extracted_date and final_status == MedicalTestSubmission.StatusChoices.COMPLETED:
-                     update_fields['test_date'] = extracted_date
-
-                final_update_count = MedicalTestSubmission.objects.filter(
-                    id=submission_id,
-                    processing_status=MedicalTestSubmission.StatusChoices.PROCESSING
-                ).update(**update_fields)
+                if not finalized and processing_error:
+                    with timer.stage('final_update'):
+                        final_update_count = MedicalTestSubmission.objects.filter(
+                            id=submission_id,
+                            processing_status=MedicalTestSubmission.StatusChoices.PROCESSING,
+                            lease_owner=lease_owner
+                        ).update(
+                            processing_status=MedicalTestSubmission.StatusChoices.FAILED,
+                            processing_details=processing_error, lease_owner=None, lease_expires_at=None,
+                            updated_at=timezone.now()
+                        )
+                    finalized = final_update_count > 0
+                    if finalized: task_logger.info(f"[PDF Task {task_id}] Marked submission {submission_id} as {MedicalTestSubmission.StatusChoices.FAILED}.")
+                    else: task_logger.warning(f"[PDF Task {task_id}] Submission {submission_id} status not PROCESSING (or lease lost) during final update.")
 
-                if final_update_count > 0: task_logger.info(f"[PDF Task {task_id}] Marked submission {submission_id} as {final_status}.")
-                else: task_logger.warning(f"[PDF Task {task_id}] Submission {submission_id} status not PROCESSING during final update.")
+                if finalized:
+                    # Отдельный короткий UPDATE после коммита: в замерах есть и длительность записи
+                    metrics = timer.as_dict()
+                    if trace is not None:
+                        # Трассировка одноразовая: флаг снимается после прогона
+                        metrics['trace'] = trace.as_dict()
+                        MedicalTestSubmission.objects.filter(id=submission_id).update(processing_metrics=metrics, trace_processing=False)
+                    else:
+                        MedicalTestSubmission.objects.filter(id=submission_id).update(processing_metrics=metrics)
+                    task_logger.info(f"[PDF Task {task_id}] Stage timings (ms): {metrics['stages_ms']}, total {metrics['total_ms']} ms.")
             except OperationalError as final_db_err:
                 task_logger.error(f"DB error during final status update for {submission_id}: {final_db_err}")
             except Exception as final_save_err:
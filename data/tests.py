@@ -1,3 +1,994 @@
-from django.test import TestCase
+import datetime
+import importlib
+import io
+import json
+import re
+import signal
+import tempfile
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import Executor, Future
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.serializers import MetricDataSerializer
+
+from . import analyte_index, ingest_queue, tasks
+from .benchmark import STAGES, build_corpus, build_pdf, run_benchmark
+from .extraction import (
+    EXTRACTION_BACKENDS, PAGE_BREAK_MARKER, PAGE_SEPARATOR, PageLayout, TextBox, iter_pdf_pages, pdf_creation_date,
+)
+from .layouts import LayoutPass, iter_layout_rows
+from .analyte_index import changed_aliases, dictionary_entries, get_alias_index, invalidate_alias_index, record_dictionary_snapshot
+from .models import (
+    Analyte, AnalyteDictionarySnapshot, AnalyteSeriesPoint, AnalyteSeriesSummary, ExtractedTextPage,
+    ExtractedTextToken, LabLayoutTemplate, MedicalTestSubmission, TestResult, TestType, UnrecognizedResultLine,
+)
+from .reparse import fast_forward_submissions, reparse_chunk, split_stale_submissions
+from .series import refresh_submission_series
+from .tasks import find_reference_range, find_status_text, find_unit, find_value, parse_reference_range, tokenize_result_line
+
+# Строки отчетов, на которых сверяются быстрые реализации с прежними
+SAMPLE_LINES = [
+    'Гемоглобин 129 г/л 117 - 155 В норме',
+    'Гематокрит 41,3 % 35 - 45',
+    'Эритроциты 4.27 x10^12/л 3.9 - 5.6 В норме',
+    'WBC (Лейкоциты) 6.5 - 10^9/л 4.0 - 9.0',
+    'Тромбоциты 383 тыс/мкл 150-400 Выше нормы',
+    'СОЭ 11 мм/ч (2 - 20)',
+    'Глюкоза 5,8 ммоль/л [3.9 - 6.1]',
+    'Холестерин общий <5.2 ммоль/л',
+    'Ферритин 12 нг/мл >15 Ниже нормы',
+    'ТТГ 2.1 мМЕ/л 0.4-4.0 Норма',
+    'HBsAg отрицательно',
+    'Гомоцистеин 9.5 мкмоль/л',
+    'Креатинин 0 - 97 мкмоль/л',
+    'Биоматериалды алу орны / Место забора биоматериала: ПП_Манаса 59',
+    'Показатель Результат Норма Ед. изм. Статус',
+    'АЛТ (аланинаминотрансфераза) 25 Ед/л до 41',
+]
+
+
+class StaleSubmissionSplitTests(TestCase):
+    """Выбор загрузок для повторного разбора после изменения словаря (data/reparse.py)."""
+
+    def setUp(self):
+        # Снимки прошлых тестов откатаны вместе с их транзакциями
+        analyte_index._recorded_versions.clear()
+        invalidate_alias_index()
+        self.user = get_user_model().objects.create_user('reparse', 'reparse@example.com', 'password')
+        self.test_type = TestType.objects.create(name='Тестовый профиль')
+        self.analyte = Analyte.objects.create(name='Тестовый аналит', unit='ед')
+
+    def _submission(self, version, test_type=None):
+        return MedicalTestSubmission.objects.create(
+            user=self.user, uploaded_file='medical_tests/test.pdf', test_type=test_type,
+            test_date=datetime.date(2025, 1, 1), processing_status=MedicalTestSubmission.StatusChoices.COMPLETED,
+            dictionary_version=version,
+        )
+
+    def test_test_type_link_change_affects_untyped_submissions(self):
+        old_index = get_alias_index()
+        record_dictionary_snapshot(old_index)
+        untyped = self._submission(old_index.version)
+        typed = self._submission(old_index.version, test_type=self.test_type)
+
+        # Меняются только связи аналита с типами тестов: алиасы те же
+        self.analyte.typical_test_types.add(self.test_type)
+        invalidate_alias_index()
+        new_index = get_alias_index()
+        self.assertNotEqual(old_index.version, new_index.version)
+        self.assertEqual(changed_aliases(dictionary_entries(old_index), dictionary_entries(new_index)), set())
+
+        snapshot = AnalyteDictionarySnapshot.objects.get(version=old_index.version)
+        self.assertEqual(snapshot.test_types[str(self.test_type.id)], [self.test_type.name, []])
+
+        queryset = MedicalTestSubmission.objects.filter(id__in=[untyped.id, typed.id])
+        affected, unaffected = split_stale_submissions(queryset, new_index)
+        self.assertEqual(affected, {untyped.id})
+        self.assertEqual(unaffected, {old_index.version: {typed.id}})
+
+        self.assertEqual(fast_forward_submissions(unaffected, new_index), 1)
+        untyped.refresh_from_db()
+        self.assertEqual(untyped.dictionary_version, old_index.version)
+        new_snapshot = AnalyteDictionarySnapshot.objects.get(version=new_index.version)
+        self.assertEqual(new_snapshot.test_types[str(self.test_type.id)], [self.test_type.name, [str(self.analyte.id)]])
+
+
+class BenchmarkTests(TestCase):
+    """Бенчмарк конвейера (data/benchmark.py) на корпусе из одного документа."""
+
+    def test_build_corpus_covers_all_analytes(self):
+        corpus = build_corpus(documents=1)
+        analyte_count = Analyte.objects.count()
+        self.assertEqual(corpus['analytes'], analyte_count)
+        self.assertEqual(len(corpus['texts']), 1)
+        self.assertEqual(len(corpus['pdfs']), 1)
+        # Заголовок отчета (3 строки) и строка на каждый аналит
+        self.assertEqual(len(corpus['texts'][0].split('\n')), analyte_count + 3)
+        self.assertTrue(corpus['pdfs'][0].startswith(b'%PDF-'))
+        self.assertGreater(corpus['pdf_analytes'], 0)
+
+    def test_run_benchmark_reports_every_stage(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            report = run_benchmark(documents=1)
+        self.assertEqual(report['corpus']['documents'], 1)
+        expected = {f'extraction_{name}' for name in EXTRACTION_BACKENDS} | set(STAGES) - {'extraction'}
+        self.assertEqual(set(report['stages']), expected)
+        for stage, result in report['stages'].items():
+            with self.subTest(stage=stage):
+                self.assertGreater(result['items'], 0)
+                self.assertGreaterEqual(result['total_s'], 0)
+                self.assertIsNotNone(result['p50_ms'])
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+                self.assertGreaterEqual(result['peak_memory_kib'], 0)
+                if result['total_s']:
+                    self.assertGreater(result['throughput_per_s'], 0)
+        # Стадии с записью в БД откатываются
+        self.assertFalse(MedicalTestSubmission.objects.exists())
+
+    def test_extraction_follows_layout_setting(self):
+        for layouts in (False, True):
+            with self.subTest(layouts=layouts), tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root, LAB_LAYOUT_TEMPLATES=layouts), \
+                    mock.patch('data.benchmark.iter_pdf_pages', wraps=iter_pdf_pages) as iter_pages:
+                report = run_benchmark(documents=1, stages=['extraction'])
+                self.assertEqual(report['meta']['lab_layout_templates'], layouts)
+                self.assertEqual(set(report['stages']), {f'extraction_{name}' for name in EXTRACTION_BACKENDS})
+                # Два прохода на бэкенд: замер времени и замер памяти
+                self.assertEqual(iter_pages.call_count, 2 * len(EXTRACTION_BACKENDS))
+                self.assertTrue(all(call.args[2] is layouts for call in iter_pages.call_args_list))
+
+
+class AliasMatcherTests(TestCase):
+    """AliasMatcher (Ахо-Корасик) против прежнего перебора алиасов через re.search."""
+
+    @staticmethod
+    def _regex_find_best(sorted_aliases, line, accept=None):
+        for alias in sorted_aliases:
+            match = re.search(r'(?i)\b' + re.escape(alias) + r'(?=\W|$)', line)
+            if match and (accept is None or accept(alias)):
+                return alias, match.start(), match.end()
+        return None
+
+    def test_find_best_matches_regex_loop(self):
+        invalidate_alias_index()
+        index = get_alias_index()
+        lines = SAMPLE_LINES + build_corpus(documents=1)['texts'][0].split('\n')
+        for line in lines:
+            with self.subTest(line=line):
+                self.assertEqual(index.matcher.find_best(line), self._regex_find_best(index.sorted_aliases, line))
+
+    def test_find_best_respects_accept(self):
+        invalidate_alias_index()
+        index = get_alias_index()
+        for line in SAMPLE_LINES:
+            first = index.matcher.find_best(line)
+            if first is None:
+                continue
+            # Как в парсере: уже найденный аналит пропускается
+            taken = index.alias_map[first[0]].id
+            accept = lambda alias: index.alias_map[alias].id != taken
+            with self.subTest(line=line):
+                self.assertEqual(index.matcher.find_best(line, accept), self._regex_find_best(index.sorted_aliases, line, accept))
+
+
+class AliasIndexInvalidationTests(TestCase):
+    """Индекс алиасов процесса сбрасывается изменением словаря только после коммита."""
+
+    def setUp(self):
+        invalidate_alias_index()
+        self.analyte = Analyte.objects.order_by('name').first()
+        self.index = get_alias_index()
+
+    def test_alias_edit_invalidates_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.analyte.abbreviations = f"{self.analyte.abbreviations or ''}, Zqx-7"
+            self.analyte.save()
+            # До коммита воркеры разбирают по прежнему словарю
+            self.assertIs(get_alias_index(), self.index)
+            self.assertNotIn('zqx-7', get_alias_index().alias_map)
+        self.assertEqual(len(callbacks), 1)
+        index = get_alias_index()
+        self.assertIsNot(index, self.index)
+        self.assertEqual(index.alias_map['zqx-7'].id, self.analyte.id)
+        self.assertNotEqual(index.version, self.index.version)
+
+    def test_test_type_link_invalidates_after_commit(self):
+        test_type = TestType.objects.exclude(typical_analytes=self.analyte).order_by('name').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.analyte.typical_test_types.add(test_type)
+            self.assertIs(get_alias_index(), self.index)
+        self.assertIn(test_type.id, get_alias_index().analytes[self.analyte.id].typical_test_type_ids)
+
+    def test_rollback_keeps_index(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.analyte.delete()
+                    raise DatabaseError('rolled back')
+            except DatabaseError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertIs(get_alias_index(), self.index)
+
+
+class TokenizeResultLineTests(TestCase):
+    """tokenize_result_line против прежней цепочки find_value/find_reference_range/find_unit/find_status_text."""
+
+    @staticmethod
+    def _helper_chain(line, match_end, default_unit):
+        segment = line[match_end:].strip()
+        value, value_end = find_value(segment)
+        if not value:
+            return None
+        rest = segment[value_end:].strip()
+        reference_range = find_reference_range(rest)
+        status_text, is_abnormal = find_status_text(line)
+        return value, find_unit(rest, default_unit), reference_range, status_text, is_abnormal
+
+    def test_tokens_match_helper_chain(self):
+        invalidate_alias_index()
+        index = get_alias_index()
+        lines = SAMPLE_LINES + build_corpus(documents=1)['texts'][0].split('\n')
+        compared = 0
+        for line in lines:
+            match = index.matcher.find_best(line)
+            match_end = match[2] if match else 0
+            default_unit = index.alias_map[match[0]].unit if match else 'ед'
+            expected = self._helper_chain(line, match_end, default_unit)
+            tokens = tokenize_result_line(line, match_end, default_unit)
+            with self.subTest(line=line):
+                if expected is None:
+                    self.assertIsNone(tokens)
+                    continue
+                compared += 1
+                self.assertEqual(
+                    (tokens.value, tokens.unit, tokens.reference_range, tokens.status_text, tokens.is_abnormal), expected,
+                )
+                if tokens.is_abnormal is None and tokens.reference_range:
+                    self.assertEqual((tokens.lower_bound, tokens.upper_bound), parse_reference_range(tokens.reference_range))
+        self.assertGreater(compared, len(SAMPLE_LINES) // 2)
+
+
+class LayoutRowsTests(TestCase):
+    """iter_layout_rows: разбирается текст страниц, рамки дают только ячейки."""
+
+    @staticmethod
+    def _page(text, rows):
+        boxes = [
+            TextBox(top, x0, x0 + 30, word)
+            for top, words in rows
+            for x0, word in words
+        ]
+        return PageLayout(text, 600, 800, boxes)
+
+    def test_rows_are_page_text_lines(self):
+        header = [(50, 'Показатель'), (200, 'Результат'), (300, 'Норма'), (400, 'Ед.')]
+        row = [(50, 'Гемоглобин'), (200, '129'), (300, '117-155'), (400, 'г/л')]
+        # Текст страницы с другими пробелами и строкой, которой нет среди рамок
+        text = 'Лаборатория\nПоказатель Результат Норма Ед.\nГемоглобин  129 117-155 г/л\nГемоглобин 129 117-155 г/л'
+        page = self._page(text, [(10, header), (30, row), (50, row)])
+        layout_pass = LayoutPass()
+        rows = list(iter_layout_rows([page, page], layout_pass, lambda fingerprint: None))
+
+        self.assertEqual(layout_pass.mode, 'learning')
+        lines = text.split('\n')
+        self.assertEqual([line for _, line, _ in rows], lines + [PAGE_BREAK_MARKER] + lines)
+        self.assertEqual([i for i, _, _ in rows], list(range(len(rows))))
+        cells = {'name': 'Гемоглобин', 'value': '129', 'reference': '117-155', 'unit': 'г/л'}
+        self.assertEqual([row_cells for _, _, row_cells in rows[:4]], [None, None, cells, cells])
+
+
+class _InlineExecutor(Executor):
+    """Пул процессов воркера, выполняющий задачи сразу в текущем потоке (то же соединение с тестовой БД)."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+class IngestQueueTests(TestCase):
+    """Устойчивая очередь обработки (data/ingest_queue.py) и команда run_ingest_worker."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('queue', 'queue@example.com', 'password')
+
+    def _submission(self, minutes_ago=0, **fields):
+        submission = MedicalTestSubmission.objects.create(
+            user=self.user, uploaded_file='medical_tests/queue.pdf', **fields,
+        )
+        # Порядок очереди — по дате загрузки
+        MedicalTestSubmission.objects.filter(id=submission.id).update(
+            submission_date=timezone.now() - datetime.timedelta(minutes=minutes_ago),
+        )
+        return submission
+
+    def _expired(self, attempts, **fields):
+        return self._submission(
+            processing_status=MedicalTestSubmission.StatusChoices.PROCESSING, lease_owner='crashed-worker',
+            lease_expires_at=timezone.now() - datetime.timedelta(seconds=1), processing_attempts=attempts, **fields,
+        )
+
+    def test_leased_row_is_not_claimed_twice(self):
+        submission = self._submission()
+        self.assertEqual(ingest_queue.claim_next_submission('worker-a'), submission.id)
+        self.assertIsNone(ingest_queue.claim_next_submission('worker-b'))
+        submission.refresh_from_db()
+        self.assertEqual(submission.processing_status, MedicalTestSubmission.StatusChoices.PROCESSING)
+        self.assertEqual(submission.lease_owner, 'worker-a')
+        self.assertEqual(submission.processing_attempts, 1)
+        self.assertGreater(submission.lease_expires_at, timezone.now())
+
+    def test_compare_and_set_skips_candidate_claimed_by_another_worker(self):
+        oldest = self._submission(minutes_ago=2)
+        newer = self._submission(minutes_ago=1)
+        lease_update = ingest_queue._lease_update
+
+        def claimed_meanwhile(owner, now):
+            # Другой воркер захватывает самую старую запись между чтением кандидатов и условным UPDATE
+            if not MedicalTestSubmission.objects.filter(lease_owner='worker-b').exists():
+                MedicalTestSubmission.objects.filter(id=oldest.id).update(**lease_update('worker-b', now))
+            return lease_update(owner, now)
+
+        self.assertFalse(connection.features.has_select_for_update_skip_locked)
+        with mock.patch.object(ingest_queue, '_lease_update', side_effect=claimed_meanwhile):
+            self.assertEqual(ingest_queue.claim_next_submission('worker-a'), newer.id)
+        oldest.refresh_from_db()
+        self.assertEqual((oldest.lease_owner, oldest.processing_attempts), ('worker-b', 1))
+
+    def test_expired_lease_is_reclaimed(self):
+        submission = self._expired(attempts=1)
+        self.assertEqual(ingest_queue.claim_next_submission('worker-a'), submission.id)
+        submission.refresh_from_db()
+        self.assertEqual((submission.lease_owner, submission.processing_attempts), ('worker-a', 2))
+        self.assertGreater(submission.lease_expires_at, timezone.now())
+
+    @override_settings(INGEST_MAX_ATTEMPTS=3)
+    def test_exhausted_attempts_become_failed(self):
+        submission = self._expired(attempts=3)
+        self.assertIsNone(ingest_queue.claim_next_submission('worker-a'))
+        self.assertEqual(ingest_queue.fail_exhausted_submissions(), 1)
+        submission.refresh_from_db()
+        self.assertEqual(submission.processing_status, MedicalTestSubmission.StatusChoices.FAILED)
+        self.assertIsNone(submission.lease_owner)
+        self.assertIsNone(submission.lease_expires_at)
+        self.assertEqual(ingest_queue.fail_exhausted_submissions(), 0)
+
+    def test_renew_leases_extends_only_given_owners(self):
+        kept = self._expired(attempts=1)
+        other = self._expired(attempts=1, notes='другой воркер')
+        MedicalTestSubmission.objects.filter(id=other.id).update(lease_owner='other-worker')
+        self.assertEqual(ingest_queue.renew_leases(['crashed-worker']), 1)
+        kept.refresh_from_db()
+        other.refresh_from_db()
+        self.assertGreater(kept.lease_expires_at, timezone.now())
+        self.assertLess(other.lease_expires_at, timezone.now())
+
+    def test_lease_keeper_heartbeats_held_owners(self):
+        keeper = ingest_queue.LeaseKeeper(interval=0.01)
+        self.addCleanup(keeper.stop)
+        with mock.patch.object(ingest_queue, 'renew_leases') as renew:
+            with keeper.hold('worker-a'):
+                deadline = time.monotonic() + 5
+                while not renew.called and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            renew.assert_called_with(['worker-a'])
+            # Отпущенный владелец больше не продлевается
+            renew.reset_mock()
+            time.sleep(0.05)
+            renew.assert_not_called()
+
+    def test_worker_once_drains_queue(self):
+        handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+        self.addCleanup(lambda: [signal.signal(signum, handler) for signum, handler in handlers.items()])
+        pdf = build_pdf(['Lab report', 'WBC 6.5 10^9/L 4.0 - 9.0', 'PLT 250 10^9/L 150 - 400'])
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            submissions = []
+            for minutes_ago in (2, 1):
+                submission = self._submission(minutes_ago=minutes_ago)
+                submission.uploaded_file.save('queue.pdf', ContentFile(pdf), save=True)
+                submissions.append(submission)
+            stdout = io.StringIO()
+            with mock.patch('data.management.commands.run_ingest_worker.ProcessPoolExecutor', _InlineExecutor):
+                call_command('run_ingest_worker', '--once', '--concurrency', '2', stdout=stdout)
+        self.assertIn('Ingest worker stopped.', stdout.getvalue())
+        self.assertEqual(ingest_queue.queue_depth(), {'pending': 0, 'processing': 0})
+        for submission in submissions:
+            submission.refresh_from_db()
+            with self.subTest(submission=submission.id):
+                self.assertEqual(submission.processing_status, MedicalTestSubmission.StatusChoices.COMPLETED)
+                self.assertIsNone(submission.lease_owner)
+                self.assertEqual(submission.processing_attempts, 1)
+                self.assertTrue(submission.results.exists())
+
+
+class AnalyteSeriesTests(TestCase):
+    """Ряды значений аналитов (data/series.py) и статистика, которая их читает."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('series', 'series@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.analytes = {
+            name: Analyte.objects.create(name=name, unit='ед')
+            for name in ('Маркер рост', 'Маркер один', 'Маркер от нуля', 'Маркер ноль', 'Маркер падение')
+        }
+
+    def _submission(self, day, values, user=None):
+        """Загрузка с датой теста 2025-01-day и результатами {имя аналита: (значение, единица)}."""
+        submission = MedicalTestSubmission.objects.create(
+            user=user or self.user, uploaded_file='medical_tests/series.pdf', test_date=datetime.date(2025, 1, day),
+            processing_status=MedicalTestSubmission.StatusChoices.COMPLETED,
+        )
+        TestResult.objects.bulk_create([
+            TestResult(
+                submission=submission, analyte=self.analytes[name], value=str(value),
+                value_numeric=Decimal(str(value)), unit=unit,
+            )
+            for name, (value, unit) in values.items()
+        ])
+        refresh_submission_series(submission.id)
+        return submission
+
+    def _populate(self):
+        first = self._submission(1, {
+            'Маркер рост': (10, 'г/л'), 'Маркер от нуля': (0, ''), 'Маркер ноль': (0, ''), 'Маркер падение': (8, ''),
+        })
+        second = self._submission(2, {
+            'Маркер рост': (12.5, 'г/л'), 'Маркер один': (7, 'мг'), 'Маркер от нуля': (5, ''), 'Маркер ноль': (0, ''),
+            'Маркер падение': (6, 'ммоль/л'),
+        })
+        return first, second
+
+    def _summaries(self):
+        return {
+            summary.analyte.name: summary
+            for summary in AnalyteSeriesSummary.objects.filter(user=self.user).select_related('analyte')
+        }
+
+    def _previous_statistics(self):
+        """Статистика так, как ее считало представление до переноса расчета в БД."""
+        grouped_results = defaultdict(list)
+        results = TestResult.objects.filter(
+            submission__user=self.user, submission__test_date__isnull=False, value_numeric__isnull=False,
+        ).select_related('submission', 'analyte').order_by('analyte__name', 'submission__test_date', 'submission__submission_date', 'id')
+        for result in results:
+            grouped_results[result.analyte.name].append({
+                "date": result.submission.test_date, "value": float(result.value_numeric),
+                "unit": result.unit or result.analyte.unit,
+            })
+        data = []
+        for analyte_name, history in grouped_results.items():
+            values = [{"date": point["date"], "value": point["value"]} for point in history]
+            percentage_of_change = 0.0
+            if len(values) >= 2:
+                latest_value, previous_value = values[-1]["value"], values[-2]["value"]
+                if previous_value != 0:
+                    percentage_of_change = round((latest_value - previous_value) / previous_value * 100, 2)
+                elif latest_value != 0:
+                    percentage_of_change = 100.0
+            data.append({
+                "name_of_component": analyte_name, "name_of_unit": history[-1]["unit"],
+                "percentage_of_change": percentage_of_change, "list_of_all_the_values": values,
+            })
+        return MetricDataSerializer(data, many=True).data
+
+    def test_summary_percentages(self):
+        self._populate()
+        summaries = self._summaries()
+        expected = {
+            # имя: (последнее, предыдущее, процент, точек, единица)
+            'Маркер рост': (12.5, 10.0, 25.0, 2, 'г/л'),
+            'Маркер один': (7.0, None, 0.0, 1, 'мг'),
+            'Маркер от нуля': (5.0, 0.0, 100.0, 2, 'ед'),
+            'Маркер ноль': (0.0, 0.0, 0.0, 2, 'ед'),
+            'Маркер падение': (6.0, 8.0, -25.0, 2, 'ммоль/л'),
+        }
+        self.assertEqual(set(summaries), set(expected))
+        for name, values in expected.items():
+            summary = summaries[name]
+            with self.subTest(analyte=name):
+                self.assertEqual(
+                    (summary.latest_value, summary.previous_value, summary.percentage_of_change, summary.point_count, summary.unit),
+                    values,
+                )
+        self.assertIsNone(summaries['Маркер один'].previous_date)
+        self.assertEqual(summaries['Маркер рост'].previous_date, datetime.date(2025, 1, 1))
+
+    def test_statistics_match_previous_computation(self):
+        self._populate()
+        self._submission(3, {'Маркер рост': (11.3, 'г/л'), 'Маркер падение': (6, '')})
+        # Точки другого пользователя в статистику не попадают
+        other = get_user_model().objects.create_user('other', 'other@example.com', 'password')
+        self._submission(4, {'Маркер рост': (99, 'г/л')}, user=other)
+
+        response = self.client.get('/api/health-statistics/')
+        self.assertEqual(response.status_code, 200)
+        expected = json.loads(json.dumps(self._previous_statistics(), default=str))
+        self.assertEqual(json.loads(json.dumps(response.data, default=str)), expected)
+        self.assertEqual(len(expected), len(self.analytes))
+
+    def test_delete_submission_refreshes_summaries(self):
+        first, second = self._populate()
+        second.delete()
+        summaries = self._summaries()
+        # Ряд из единственной точки удаленной загрузки исчезает, остальные — по первой загрузке
+        self.assertNotIn('Маркер один', summaries)
+        self.assertEqual((summaries['Маркер рост'].latest_value, summaries['Маркер рост'].point_count), (10.0, 1))
+        self.assertEqual(summaries['Маркер рост'].percentage_of_change, 0.0)
+        self.assertFalse(AnalyteSeriesPoint.objects.filter(submission_id=second.id).exists())
+
+        first.delete()
+        self.assertFalse(AnalyteSeriesSummary.objects.filter(user=self.user).exists())
+
+    def test_reparse_refreshes_summaries(self):
+        first, second = self._populate()
+        # Сохраненный текст второй загрузки дает другое значение и другой набор аналитов
+        page_text = 'Маркер рост 15 г/л\nМаркер один 9 мг'
+        ExtractedTextPage.objects.bulk_create(ExtractedTextPage.from_page_texts(second, [page_text], PAGE_SEPARATOR))
+        invalidate_alias_index()
+
+        stats = reparse_chunk([second.id])
+        self.assertEqual((stats['reparsed'], stats['failed']), (1, 0))
+        summaries = self._summaries()
+        self.assertEqual(
+            (summaries['Маркер рост'].latest_value, summaries['Маркер рост'].previous_value, summaries['Маркер рост'].percentage_of_change),
+            (15.0, 10.0, 50.0),
+        )
+        self.assertEqual(summaries['Маркер один'].latest_value, 9.0)
+        # Результатов второй загрузки по остальным аналитам больше нет
+        self.assertEqual((summaries['Маркер от нуля'].latest_value, summaries['Маркер от нуля'].point_count), (0.0, 1))
+        self.assertEqual(
+            AnalyteSeriesPoint.objects.filter(submission_id=second.id).count(),
+            TestResult.objects.filter(submission_id=second.id).count(),
+        )
+
+
+# Отчет с датой теста, заголовком таблицы (колонки разделены широкими промежутками), двумя
+# известными аналитами и строкой, похожей на результат неизвестного аналита
+class SaveResultsInBatchesTests(TestCase):
+    """Пачка с ошибочной строкой сохраняется построчно (save_results_in_batches)."""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('batches', 'batches@example.com', 'password')
+        self.submission = MedicalTestSubmission.objects.create(user=user, uploaded_file='medical_tests/batches.pdf')
+        self.analytes = list(Analyte.objects.order_by('name')[:3])
+
+    def test_failed_row_is_reported_and_rest_saved(self):
+        results = [
+            TestResult(submission=self.submission, analyte=analyte, value=value)
+            for analyte, value in zip(self.analytes, ['1.5', None, '3'])
+        ]
+        with self.assertLogs('data.tasks', 'WARNING') as logs:
+            errors = tasks.save_results_in_batches(results, batch_size=2)
+
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], IntegrityError)
+        self.assertIsNone(errors[2])
+        self.assertEqual(
+            set(TestResult.objects.filter(submission=self.submission).values_list('analyte_id', flat=True)),
+            {self.analytes[0].id, self.analytes[2].id},
+        )
+        # Построчно повторяется только упавшая пачка
+        self.assertEqual(len([line for line in logs.output if 'retrying row by row' in line]), 1)
+        self.assertTrue(any(str(self.analytes[1].id) in line for line in logs.output if line.startswith('ERROR')))
+
+
+INGEST_REPORT_LINES = [
+    'Lab report',
+    'Test Date: 15.01.2025',
+    'Parameter          Result          Unit          Reference',
+    'WBC          6.5          10^9/L          4.0 - 9.0',
+    'PLT          250          10^9/L          150 - 400',
+    'Foobarase          12.5          U/L          1 - 10',
+]
+
+
+class IngestWriteTransactionTests(TestCase):
+    """Запись результатов обработки PDF одной транзакцией (process_pdf_submission_plain)."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        invalidate_alias_index()
+        self.user = get_user_model().objects.create_user('ingest', 'ingest@example.com', 'password')
+        self.submission = MedicalTestSubmission(
+            user=self.user, test_date=datetime.date(2025, 1, 1),
+            processing_status=MedicalTestSubmission.StatusChoices.PROCESSING, lease_owner='worker-a',
+            lease_expires_at=timezone.now() + datetime.timedelta(minutes=5),
+        )
+        self.submission.uploaded_file.save('report.pdf', ContentFile(build_pdf(INGEST_REPORT_LINES)), save=True)
+
+    def _rows(self):
+        submission_id = self.submission.id
+        return {
+            'results': TestResult.objects.filter(submission_id=submission_id).count(),
+            'pages': ExtractedTextPage.objects.filter(submission_id=submission_id).count(),
+            'tokens': ExtractedTextToken.objects.filter(submission_id=submission_id).count(),
+            'unrecognized': UnrecognizedResultLine.objects.filter(submission_id=submission_id).count(),
+            'points': AnalyteSeriesPoint.objects.filter(submission_id=submission_id).count(),
+        }
+
+    def test_lost_lease_rolls_back_whole_write(self):
+        # Прежний прогон оставил результат и неопознанную строку
+        analyte = Analyte.objects.order_by('name').first()
+        TestResult.objects.create(submission=self.submission, analyte=analyte, value='1', value_numeric=Decimal('1'))
+        UnrecognizedResultLine.objects.create(
+            submission=self.submission, line_number=1, line='Old 1', candidate_name='Old', name_key='old',
+        )
+        parse_rows = tasks.DocumentParser.parse_rows
+
+        def parse_then_lose_lease(parser, rows):
+            parse_rows(parser, rows)
+            # Пока шел разбор, аренда истекла и загрузку забрал другой воркер
+            MedicalTestSubmission.objects.filter(id=self.submission.id).update(lease_owner='worker-b')
+
+        with mock.patch.object(tasks.DocumentParser, 'parse_rows', parse_then_lose_lease):
+            tasks.process_pdf_submission_plain(self.submission.id, lease_owner='worker-a')
+
+        self.assertEqual(self._rows(), {'results': 1, 'pages': 0, 'tokens': 0, 'unrecognized': 1, 'points': 0})
+        self.assertEqual(TestResult.objects.get(submission=self.submission).analyte_id, analyte.id)
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.processing_status, MedicalTestSubmission.StatusChoices.PROCESSING)
+        self.assertEqual(self.submission.lease_owner, 'worker-b')
+
+    def test_completed_write_stores_everything(self):
+        with mock.patch.object(tasks, 'iter_pdf_pages', wraps=tasks.iter_pdf_pages) as iter_pages:
+            tasks.process_pdf_submission_plain(self.submission.id, lease_owner='worker-a')
+        # Без LAB_LAYOUT_TEMPLATES рамки слов не извлекаются
+        self.assertEqual([call.args[2] for call in iter_pages.call_args_list], [False])
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.processing_status, MedicalTestSubmission.StatusChoices.COMPLETED)
+        self.assertEqual(self.submission.test_date, datetime.date(2025, 1, 15))
+        rows = self._rows()
+        self.assertEqual(rows['results'], 2)
+        self.assertEqual(rows['points'], 2)
+        self.assertEqual(rows['pages'], 1)
+        self.assertGreater(rows['tokens'], 0)
+        self.assertEqual(rows['unrecognized'], 1)
+
+    def test_series_failure_keeps_results(self):
+        with mock.patch.object(tasks, 'refresh_submission_series', side_effect=DatabaseError('series table is locked')):
+            tasks.process_pdf_submission_plain(self.submission.id, lease_owner='worker-a')
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.processing_status, MedicalTestSubmission.StatusChoices.COMPLETED)
+        self.assertIsNone(self.submission.lease_owner)
+        rows = self._rows()
+        self.assertEqual((rows['results'], rows['pages'], rows['unrecognized'], rows['points']), (2, 1, 1, 0))
+
+    def _claim_again(self):
+        MedicalTestSubmission.objects.filter(id=self.submission.id).update(
+            processing_status=MedicalTestSubmission.StatusChoices.PROCESSING, lease_owner='worker-a',
+            lease_expires_at=timezone.now() + datetime.timedelta(minutes=5),
+        )
+
+    def _results(self):
+        return sorted(
+            TestResult.objects.filter(submission_id=self.submission.id)
+            .values_list('analyte__name', 'value', 'unit', 'reference_range', 'ref_low', 'ref_high', 'is_abnormal')
+        )
+
+    @override_settings(PDF_EXTRACTION_PROCESSES=1, PDF_TEXT_FALLBACK_BACKEND=None)
+    def test_backends_give_same_results(self):
+        results = {}
+        for name in EXTRACTION_BACKENDS:
+            self._claim_again()
+            with override_settings(PDF_TEXT_BACKEND=name):
+                tasks.process_pdf_submission_plain(self.submission.id, lease_owner='worker-a')
+            self.submission.refresh_from_db()
+            self.assertEqual(self.submission.processing_metrics['text_backend'], name)
+            self.assertEqual(self.submission.test_date, datetime.date(2025, 1, 15))
+            results[name] = (self._results(), self._rows())
+        self.assertEqual(len(results['pdfium'][0]), 2)
+        self.assertEqual(results['pdfium'], results['pdfplumber'])
+
+    @override_settings(PDF_EXTRACTION_PROCESSES=1, PDF_TEXT_BACKEND='pdfium', PDF_TEXT_FALLBACK_BACKEND='pdfplumber')
+    def test_fallback_backend_when_no_results(self):
+        # Текст без распознанных показателей (как у скана с текстовым слоем-мусором)
+        with mock.patch.object(EXTRACTION_BACKENDS['pdfium'], 'iter_pages', return_value=iter(['Lab report\n###'])) as pdfium_pages:
+            tasks.process_pdf_submission_plain(self.submission.id, lease_owner='worker-a')
+        pdfium_pages.assert_called_once()
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.processing_metrics['text_backend'], 'pdfplumber')
+        self.assertIs(self.submission.processing_metrics['fallback_used'], True)
+        self.assertEqual(self._rows()['results'], 2)
+
+    @override_settings(PDF_EXTRACTION_PROCESSES=1, PDF_TEXT_BACKEND='pdfium', PDF_TEXT_FALLBACK_BACKEND='pdfplumber')
+    def test_no_fallback_when_results_found(self):
+        with mock.patch.object(EXTRACTION_BACKENDS['pdfplumber'], 'iter_pages') as pdfplumber_pages:
+            tasks.process_pdf_submission_plain(self.submission.id, lease_owner='worker-a')
+        pdfplumber_pages.assert_not_called()
+        self.submission.refresh_from_db()
+        self.assertIs(self.submission.processing_metrics['fallback_used'], False)
+
+    @override_settings(LAB_LAYOUT_TEMPLATES=True)
+    def test_layout_template_failure_keeps_results(self):
+        def failing_template_update(layout_pass, submission_id):
+            # Частичная запись до сбоя откатывается вместе с savepoint
+            LabLayoutTemplate.objects.create(fingerprint=layout_pass.fingerprint, columns=[])
+            raise DatabaseError('layout template table is locked')
+
+        with mock.patch.object(tasks, 'update_layout_template', side_effect=failing_template_update) as update:
+            tasks.process_pdf_submission_plain(self.submission.id, lease_owner='worker-a')
+        update.assert_called_once()
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.processing_status, MedicalTestSubmission.StatusChoices.COMPLETED)
+        self.assertEqual(self.submission.processing_metrics['layout'], 'learning')
+        self.assertFalse(LabLayoutTemplate.objects.exists())
+        self.assertEqual(self._rows()['results'], 2)
+
+
+def with_creation_date(pdf, raw_date):
+    """Дописывает к PDF инкрементное обновление со словарем Info (CreationDate)."""
+    size = int(re.search(rb'/Size (\d+)', pdf).group(1))
+    previous_xref = int(re.search(rb'startxref\n(\d+)', pdf).group(1))
+    info_offset = len(pdf)
+    pdf += b'%d 0 obj\n<< /CreationDate (%s) >>\nendobj\n' % (size, raw_date.encode('ascii'))
+    xref_offset = len(pdf)
+    pdf += b'xref\n%d 1\n%010d 00000 n \n' % (size, info_offset)
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R /Prev %d >>\nstartxref\n%d\n%%%%EOF\n' % (
+        size + 1, size, previous_xref, xref_offset,
+    )
+    return pdf
+
+
+class TestDateExtractionTests(TestCase):
+    """Дата теста: ключевые слова только в шапке (TEST_DATE_SEARCH_PAGES), иначе дата создания PDF."""
+
+    pages = ['Lab report\nTest Date: 15.01.2025', 'WBC 6.5 10^9/L 4.0 - 9.0', 'Comment\nTest Date: 20.03.2025']
+
+    @override_settings(TEST_DATE_SEARCH_PAGES=2)
+    def test_header_date(self):
+        self.assertEqual(tasks.extract_test_date(PAGE_SEPARATOR.join(self.pages)), datetime.date(2025, 1, 15))
+
+    def test_body_date_outside_header_is_ignored(self):
+        text = PAGE_SEPARATOR.join(['Lab report', *self.pages[1:]])
+        with override_settings(TEST_DATE_SEARCH_PAGES=2):
+            self.assertIsNone(tasks.extract_test_date(text))
+        with override_settings(TEST_DATE_SEARCH_PAGES=0):
+            self.assertEqual(tasks.extract_test_date(text), datetime.date(2025, 3, 20))
+
+    def test_pdf_creation_date(self):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+            pdf_file.write(with_creation_date(build_pdf(['Lab report']), "D:20250203120000+05'00'"))
+            pdf_file.flush()
+            self.assertEqual(pdf_creation_date(pdf_file.name), datetime.date(2025, 2, 3))
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+            pdf_file.write(build_pdf(['Lab report']))
+            pdf_file.flush()
+            self.assertIsNone(pdf_creation_date(pdf_file.name))
+
+
+@override_settings(TEST_DATE_SEARCH_PAGES=2, TEST_DATE_FROM_PDF_METADATA=True, PDF_EXTRACTION_PROCESSES=1)
+class SubmissionTestDateTests(TestCase):
+    """Дата теста загрузки при обработке PDF (process_pdf_submission_plain)."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = get_user_model().objects.create_user('dates', 'dates@example.com', 'password')
+
+    def _process(self, lines, creation_date=None):
+        pdf = build_pdf(lines)
+        if creation_date:
+            pdf = with_creation_date(pdf, creation_date)
+        submission = MedicalTestSubmission(
+            user=self.user, processing_status=MedicalTestSubmission.StatusChoices.PROCESSING, lease_owner='worker-a',
+            lease_expires_at=timezone.now() + datetime.timedelta(minutes=5),
+        )
+        submission.uploaded_file.save('dated.pdf', ContentFile(pdf), save=True)
+        tasks.process_pdf_submission_plain(submission.id, lease_owner='worker-a')
+        submission.refresh_from_db()
+        self.assertEqual(submission.processing_status, MedicalTestSubmission.StatusChoices.COMPLETED)
+        return submission
+
+    def test_header_date_wins_over_metadata(self):
+        submission = self._process(INGEST_REPORT_LINES, creation_date='D:20250203120000')
+        self.assertEqual(submission.test_date, datetime.date(2025, 1, 15))
+        self.assertIn('Extracted Test Date: 15.01.2025', submission.processing_details)
+
+    def test_body_date_falls_back_to_metadata(self):
+        # Дата в тексте только на третьей странице (например, дата подписи врача)
+        lines = [line for line in INGEST_REPORT_LINES if not line.startswith('Test Date')]
+        lines += [f'Comment line {number}' for number in range(140)] + ['Test Date: 20.03.2025']
+        submission = self._process(lines, creation_date='D:20250203120000')
+        self.assertEqual(submission.test_date, datetime.date(2025, 2, 3))
+        self.assertIn('Test Date from PDF creation date: 03.02.2025', submission.processing_details)
+        self.assertEqual(ExtractedTextPage.objects.filter(submission=submission).count(), 3)
+
+    @override_settings(TEST_DATE_FROM_PDF_METADATA=False)
+    def test_metadata_fallback_can_be_disabled(self):
+        lines = [line for line in INGEST_REPORT_LINES if not line.startswith('Test Date')]
+        submission = self._process(lines, creation_date='D:20250203120000')
+        self.assertIsNone(submission.test_date)
+        self.assertIn('Could not extract test date from PDF.', submission.processing_details)
+
+
+class TextTokenMigrationTests(TestCase):
+    """Индекс слов, построенный миграцией 0018, совпадает с индексом новых загрузок."""
+
+    def test_backfill_matches_index_tokens(self):
+        migration = importlib.import_module('data.migrations.0018_dictionary_versions')
+        user = get_user_model().objects.create_user('tokens', 'tokens@example.com', 'password')
+        submission = MedicalTestSubmission.objects.create(user=user, uploaded_file='medical_tests/tokens.pdf')
+        # 'İ' в нижнем регистре — два символа; AliasMatcher и index_tokens оставляют его как есть
+        page_texts = ['İnterleukin İL-6 7,5 pg/ml\nГЕМОГЛОБИН 129 г/л', 'Straße ÀBC_1 2025']
+        ExtractedTextPage.objects.bulk_create(ExtractedTextPage.from_page_texts(submission, page_texts, PAGE_SEPARATOR))
+
+        migration.build_text_tokens(django_apps, None)
+        backfilled = set(ExtractedTextToken.objects.filter(submission=submission).values_list('token', flat=True))
+        expected = {token.token for token in ExtractedTextToken.from_page_texts(submission, page_texts)}
+        self.assertEqual(backfilled, expected)
+        self.assertIn('İnterleukin', backfilled)
+
+
+class ExtractedTextMigrationTests(TransactionTestCase):
+    """Миграция 0017 переносит extracted_text в страницы и собирает его обратно без потерь."""
+
+    before = [('data', '0016_lablayouttemplate')]
+    after = [('data', '0017_extracted_text_pages')]
+
+    def _migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self._migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_round_trip(self):
+        text = PAGE_SEPARATOR.join(['Гемоглобин 129 г/л', '', 'Глюкоза 5,8 ммоль/л\nСОЭ 11 мм/ч'])
+        old_apps = self._migrate(self.before)
+        user = get_user_model().objects.create_user('migration', 'migration@example.com', 'password')
+        Submission = old_apps.get_model('data', 'MedicalTestSubmission')
+        submission = Submission.objects.create(user_id=user.id, uploaded_file='medical_tests/a.pdf', extracted_text=text)
+        empty = Submission.objects.create(user_id=user.id, uploaded_file='medical_tests/b.pdf', extracted_text='')
+
+        new_apps = self._migrate(self.after)
+        Page = new_apps.get_model('data', 'ExtractedTextPage')
+        pages = list(Page.objects.filter(submission_id=submission.id).order_by('page_number'))
+        self.assertEqual([page.page_number for page in pages], [1, 2, 3])
+        self.assertEqual(
+            [text[page.start_offset:page.start_offset + page.char_count] for page in pages],
+            [zlib.decompress(page.compressed_text).decode('utf-8') for page in pages],
+        )
+        self.assertEqual([page.char_count for page in pages], [len(part) for part in text.split(PAGE_SEPARATOR)])
+        self.assertFalse(Page.objects.filter(submission_id=empty.id).exists())
+
+        old_apps = self._migrate(self.before)
+        Submission = old_apps.get_model('data', 'MedicalTestSubmission')
+        self.assertEqual(Submission.objects.get(id=submission.id).extracted_text, text)
+
+
+@override_settings(PDF_EXTRACTION_PROCESSES=1)
+class ReferenceBoundsBackfillTests(TestCase):
+    """backfill_reference_bounds восстанавливает те же границы, что записывает разбор новых загрузок."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        invalidate_alias_index()
+        user = get_user_model().objects.create_user('bounds', 'bounds@example.com', 'password')
+        submission = MedicalTestSubmission(
+            user=user, processing_status=MedicalTestSubmission.StatusChoices.PROCESSING, lease_owner='worker-a',
+            lease_expires_at=timezone.now() + datetime.timedelta(minutes=5),
+        )
+        submission.uploaded_file.save('bounds.pdf', ContentFile(build_pdf(INGEST_REPORT_LINES)), save=True)
+        tasks.process_pdf_submission_plain(submission.id, lease_owner='worker-a')
+
+        # Строки кириллических отчетов — как их сохраняет DocumentParser.parse_rows
+        index = get_alias_index()
+        results = []
+        # Результат одного аналита на загрузку (как в парсере)
+        analyte_ids = set(TestResult.objects.filter(submission=submission).values_list('analyte_id', flat=True))
+        for line in SAMPLE_LINES + build_corpus(documents=1)['texts'][0].split('\n'):
+            match = index.matcher.find_best(line, lambda alias: index.alias_map[alias].id not in analyte_ids)
+            tokens = tokenize_result_line(line, match[2], index.alias_map[match[0]].unit) if match else None
+            if tokens is not None and tokens.reference_range:
+                analyte_ids.add(index.alias_map[match[0]].id)
+                results.append(TestResult(
+                    submission=submission, analyte_id=index.alias_map[match[0]].id, value=tokens.value,
+                    unit=tokens.unit, reference_range=tokens.reference_range,
+                    ref_low=tokens.lower_bound, ref_high=tokens.upper_bound,
+                ))
+        TestResult.objects.bulk_create(results)
+
+    def _stored(self):
+        return {
+            result_id: (reference_range, ref_low, ref_high)
+            for result_id, reference_range, ref_low, ref_high
+            in TestResult.objects.values_list('id', 'reference_range', 'ref_low', 'ref_high')
+        }
+
+    def test_backfill_matches_ingest(self):
+        stored = self._stored()
+        self.assertGreater(len(stored), len(SAMPLE_LINES) // 2)
+        self.assertTrue(any(low is not None or high is not None for _, low, high in stored.values()))
+        for reference_range, low, high in stored.values():
+            self.assertEqual((low, high), parse_reference_range(reference_range))
+
+        TestResult.objects.update(ref_low=None, ref_high=None)
+        output = io.StringIO()
+        call_command('backfill_reference_bounds', '--batch-size', '3', stdout=output)
+        self.assertEqual(self._stored(), stored)
+        updated = sum(1 for _, low, high in stored.values() if low is not None or high is not None)
+        self.assertIn(f'{updated} of {len(stored)} scanned results updated', output.getvalue())
+
+        # Повторный прогон (в том числе с --recompute) ничего не меняет
+        output = io.StringIO()
+        call_command('backfill_reference_bounds', '--recompute', stdout=output)
+        self.assertIn(f'0 of {len(stored)} scanned results updated', output.getvalue())
+        self.assertEqual(self._stored(), stored)
+
+@override_settings(SQLITE_JOURNAL_MODE='WAL', SQLITE_SYNCHRONOUS='NORMAL', SQLITE_BUSY_TIMEOUT_MS=1234)
+class SqlitePragmaTests(TestCase):
+    """PRAGMA нового соединения SQLite (data/db.py) и их вывод в db_maintenance."""
+
+    def setUp(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        settings_dict = {**connection.settings_dict, 'NAME': f'{db_dir.name}/pragmas.sqlite3'}
+        self.db = type(connections['default'])(settings_dict, alias='pragmas')
+        self.addCleanup(self.db.close)
+
+    def _pragma(self, name):
+        with self.db.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_new_connection_is_configured(self):
+        self.db.ensure_connection()
+        self.assertEqual(self._pragma('journal_mode'), 'wal')
+        self.assertEqual(self._pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self._pragma('busy_timeout'), 1234)
+
+    @override_settings(SQLITE_JOURNAL_MODE='', SQLITE_SYNCHRONOUS='FULL', SQLITE_BUSY_TIMEOUT_MS=None)
+    def test_empty_settings_keep_defaults(self):
+        self.db.ensure_connection()
+        self.assertEqual(self._pragma('journal_mode'), 'delete')
+        self.assertEqual(self._pragma('synchronous'), 2)  # FULL
+        # Django по умолчанию ждет блокировку 5 с (timeout драйвера sqlite3)
+        self.assertEqual(self._pragma('busy_timeout'), 5000)
+
+    @override_settings(SQLITE_SYNCHRONOUS='SOMETIMES')
+    def test_invalid_setting_is_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'SQLITE_SYNCHRONOUS'):
+            self.db.ensure_connection()
+
+    def test_db_maintenance_reports_pragmas(self):
+        output = io.StringIO()
+        with mock.patch('data.management.commands.db_maintenance.connection', self.db):
+            call_command('db_maintenance', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertIn('journal_mode=wal, synchronous=1, busy_timeout=1234', lines[0])
+        self.assertTrue(lines[1].startswith('ANALYZE done'))
+        self.assertTrue(lines[2].startswith('Checkpoint TRUNCATE:'))
@@ -0,0 +1,38 @@
+# ==============================================================================
+# Файл: data/uploadhandlers.py
+# Описание: Обработчики загрузки файлов, считающие SHA-256 содержимого
+# по мере записи потока (без повторного чтения файла).
+# Подключаются через FILE_UPLOAD_HANDLERS в settings.py.
+# ==============================================================================
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadMixin:
+    """Добавляет загруженному файлу атрибут content_sha256."""
+
+    def new_file(self, *args, **kwargs):
+        self._sha256 = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # Чанк сохранен этим обработчиком (а не передан следующему)
+            self._sha256.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.content_sha256 = self._sha256.hexdigest()
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -22,6 +22,7 @@ from rest_framework.views import APIView
 from rest_framework import status
 
 from .models import MedicalTestSubmission
+from .deduplication import is_file_shared
 
 view_logger = logging.getLogger('data.views')
 
@@ -99,7 +100,9 @@ class DeleteSubmissionView(APIView):
         submission = get_object_or_404(MedicalTestSubmission, id=submission_id, user=request.user)
 
         file_path = None
-        if submission.uploaded_file and hasattr(submission.uploaded_file, 'path'):
+        # Файл повторной загрузки может быть общим с другими загрузками (см. data/deduplication.py)
+        file_shared = is_file_shared(submission)
+        if submission.uploaded_file and hasattr(submission.uploaded_file, 'path') and not file_shared:
             file_path = submission.uploaded_file.path
 
         try:
@@ -112,7 +115,9 @@ class DeleteSubmissionView(APIView):
             # on the MedicalTestSubmission model. If you have such a signal, this manual
             # os.remove is not needed here and might even cause issues if the file is already gone.
             # If you DON'T have a post_delete signal for file cleanup:
-            if file_path and os.path.exists(file_path):
+            if file_shared:
+                view_logger.info(f"File of submission {submission_id} is shared with other submissions; kept on disk.")
+            elif file_path and os.path.exists(file_path):
                 try:
                     os.remove(file_path)
                     view_logger.info(f"File deleted from disk: {file_path}")
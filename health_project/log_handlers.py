@@ -0,0 +1,104 @@
+# ==============================================================================
+# Файл: health_project/log_handlers.py
+# Описание: Неблокирующий вывод логов: запись ставится в очередь, форматирование
+# и запись в поток выполняет фоновый QueueListener. Подключается в LOGGING
+# (health_project/settings.py) как обычный обработчик.
+# ==============================================================================
+import copy
+import logging
+import os
+import queue
+import random
+import weakref
+from logging.handlers import QueueHandler, QueueListener
+
+
+class _QueueListener(QueueListener):
+    """QueueListener, который при остановке ждет места в полной очереди (а не падает с queue.Full)."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Обработчик, который только кладет запись в очередь. Фоновый поток выводит ее
+    через StreamHandler с форматтером этого обработчика (setFormatter из dictConfig
+    передается ему), поэтому вызывающий поток не ждет форматирования и ввода-вывода.
+
+    При переполнении очереди записи ниже WARNING отбрасываются (счетчик dropped),
+    WARNING и выше ждут места в очереди.
+
+    Поток-слушатель не переживает fork (например, gunicorn --preload), поэтому
+    в дочернем процессе очередь и слушатель создаются заново.
+    """
+
+    def __init__(self, queue_size=10000, stream=None):
+        super().__init__(queue.Queue(queue_size))
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.target = logging.StreamHandler(stream)
+        self.listener = None
+        self._start_listener()
+        handler_ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: _restart_after_fork(handler_ref))
+
+    def _start_listener(self):
+        self.listener = _QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Подставляем аргументы сразу (они могут измениться), остальное — в фоновом потоке
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Дожидаемся вывода уже поставленных записей
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+            if self.dropped:
+                self.target.handle(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Log queue overflow: dropped {self.dropped} records below WARNING.",
+                }))
+            self.target.close()
+        super().close()
+
+
+def _restart_after_fork(handler_ref):
+    handler = handler_ref()
+    if handler is not None and handler.listener is not None:
+        handler.queue = queue.Queue(handler.queue_size)
+        handler._start_listener()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает записи уровня level и ниже с вероятностью sample_rate (0..1),
+    записи выше level — всегда. Для частых отладочных сообщений горячего пути.
+    """
+
+    def __init__(self, sample_rate=1.0, level='DEBUG'):
+        super().__init__()
+        self.sample_rate = float(sample_rate)
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+
+    def filter(self, record):
+        if record.levelno > self.level or self.sample_rate >= 1.0:
+            return True
+        return random.random() < self.sample_rate
@@ -80,6 +80,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Транзакции сразу берут блокировку записи: ожидание по busy_timeout
+            # вместо "database is locked" при повышении чтения до записи
+            'transaction_mode': os.getenv('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+        },
     }
 }
 
@@ -189,19 +194,108 @@ CORS_ALLOW_HEADERS = [
 # CORS_ALLOW_CREDENTIALS = True # Если используешь cookies
 
 # Настройки логирования
+# Логи пишутся в консоль из фонового потока (health_project/log_handlers.py), чтобы
+# обработка не ждала вывода; LOG_ASYNC=False — прежний синхронный StreamHandler.
+# Отладочные записи можно выборочно пропускать (LOG_DEBUG_SAMPLE_RATE от 0 до 1).
+# Уровень логгера обработки PDF задается отдельно (INGEST_LOG_LEVEL): построчный
+# DEBUG-вывод заметно замедляет разбор, для одной загрузки вместо него есть трассировка
+# (MedicalTestSubmission.trace_processing).
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'True') == 'True'
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+INGEST_LOG_LEVEL = os.getenv('INGEST_LOG_LEVEL', 'INFO')
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': { 'verbose': { 'format': '{levelname} [{asctime}] [{module}:{lineno}] {message}', 'style': '{', }, },
-    'handlers': { 'console': { 'class': 'logging.StreamHandler', 'formatter': 'verbose', }, },
+    'filters': {
+        'sample_debug': { '()': 'health_project.log_handlers.SamplingFilter', 'sample_rate': LOG_DEBUG_SAMPLE_RATE, },
+    },
+    'handlers': {
+        'console': {
+            'class': 'health_project.log_handlers.AsyncQueueHandler' if LOG_ASYNC else 'logging.StreamHandler',
+            'formatter': 'verbose', 'filters': ['sample_debug'],
+        },
+    },
     'loggers': {
         'django': { 'handlers': ['console'], 'level': 'INFO', 'propagate': True, }, # Оставляем DEBUG для отладки
         'users': { 'handlers': ['console'], 'level': 'DEBUG' if DEBUG else 'INFO', 'propagate': False, },
         'data': { 'handlers': ['console'], 'level': 'DEBUG' if DEBUG else 'INFO', 'propagate': False, },
-        'data.tasks': { 'handlers': ['console'], 'level': 'DEBUG' if DEBUG else 'INFO', 'propagate': False, },
+        'data.tasks': { 'handlers': ['console'], 'level': INGEST_LOG_LEVEL, 'propagate': False, },
         'api': { 'handlers': ['console'], 'level': 'DEBUG' if DEBUG else 'INFO', 'propagate': False, },
         'allauth': { 'handlers': ['console'], 'level': 'DEBUG', 'propagate': True, }, # Оставляем DEBUG для отладки allauth
     },
 }
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'your-openai-api-key')
+
+# --- Настройки обработки загруженных PDF (data.tasks) ---
+# Размер пачки bulk_create при сохранении распознанных результатов
+INGEST_RESULTS_BATCH_SIZE = int(os.getenv('INGEST_RESULTS_BATCH_SIZE', 100))
+# Текст отчетов хранится постранично со сжатием zlib (уровень 1-9);
+# API отдает за один запрос не больше EXTRACTED_TEXT_MAX_PAGES страниц
+EXTRACTED_TEXT_COMPRESSION_LEVEL = int(os.getenv('EXTRACTED_TEXT_COMPRESSION_LEVEL', '6'))
+EXTRACTED_TEXT_MAX_PAGES = int(os.getenv('EXTRACTED_TEXT_MAX_PAGES', '20'))
+# Пул потоков фоновой обработки в веб-процессе: число потоков и максимум ожидающих задач
+INGEST_WORKER_POOL_SIZE = int(os.getenv('INGEST_WORKER_POOL_SIZE', 2))
+INGEST_WORKER_QUEUE_LIMIT = int(os.getenv('INGEST_WORKER_QUEUE_LIMIT', 50))
+# Значение заголовка Retry-After при отказе из-за переполненной очереди (секунды)
+INGEST_RETRY_AFTER_SECONDS = int(os.getenv('INGEST_RETRY_AFTER_SECONDS', 30))
+# 'thread' — обработка в пуле веб-процесса; 'queue' — загрузки остаются PENDING
+# и забираются командой `manage.py run_ingest_worker`
+INGEST_BACKEND = os.getenv('INGEST_BACKEND', 'thread')
+# Аренда задачи очереди: срок, период продления и число попыток до FAILED
+INGEST_LEASE_SECONDS = int(os.getenv('INGEST_LEASE_SECONDS', 300))
+INGEST_HEARTBEAT_SECONDS = int(os.getenv('INGEST_HEARTBEAT_SECONDS', 30))
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', 3))
+INGEST_POLL_SECONDS = float(os.getenv('INGEST_POLL_SECONDS', 5))
+# Извлечение текста PDF в пуле процессов: число процессов (0/1 — последовательно)
+# и минимальное число страниц, начиная с которого пул используется
+PDF_EXTRACTION_PROCESSES = int(os.getenv('PDF_EXTRACTION_PROCESSES', 0))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 4))
+# Повторная загрузка того же PDF (по SHA-256) переиспользует файл и результаты
+INGEST_DEDUPLICATE_UPLOADS = os.getenv('INGEST_DEDUPLICATE_UPLOADS', 'True') == 'True'
+# Обработчики загрузки, считающие SHA-256 файла во время приема (data/uploadhandlers.py)
+FILE_UPLOAD_HANDLERS = [
+    'data.uploadhandlers.HashingMemoryFileUploadHandler',
+    'data.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+# Замер пикового потребления памяти (tracemalloc) при разборе каждого PDF.
+# Замедляет обработку; tracemalloc общий для процесса, поэтому при параллельной
+# обработке в потоках пик включает и соседние задачи
+INGEST_TRACE_MEMORY = os.getenv('INGEST_TRACE_MEMORY', 'False') == 'True'
+# Сколько последних решений парсера хранить при трассировке загрузки (trace_processing)
+INGEST_TRACE_BUFFER_LINES = int(os.getenv('INGEST_TRACE_BUFFER_LINES', '500'))
+# Бэкенд извлечения текста PDF ('pdfium' — быстрый нативный, 'pdfplumber' — посимвольная
+# раскладка) и запасной бэкенд, если в тексте основного не нашлось ни одного аналита
+# (пустое значение — без повторного извлечения)
+PDF_TEXT_BACKEND = os.getenv('PDF_TEXT_BACKEND', 'pdfium')
+PDF_TEXT_FALLBACK_BACKEND = os.getenv('PDF_TEXT_FALLBACK_BACKEND', 'pdfplumber') or None
+# Дата теста ищется по ключевым словам в первых N страницах текста (0 — во всем документе);
+# если не найдена — берется дата создания PDF из метаданных (можно отключить)
+TEST_DATE_SEARCH_PAGES = int(os.getenv('TEST_DATE_SEARCH_PAGES', '2'))
+TEST_DATE_FROM_PDF_METADATA = os.getenv('TEST_DATE_FROM_PDF_METADATA', 'True') == 'True'
+# Шаблоны колонок таблиц лабораторий (data/layouts.py): отчеты с известной раскладкой
+# разбираются по колонкам. Шаблон сохраняется, если в отчете разбор по колонкам
+# совпал с построчным хотя бы в LAB_LAYOUT_MIN_ROWS строках и в доле строк
+# не ниже LAB_LAYOUT_MIN_AGREEMENT. Выключено по умолчанию: с шаблонами каждая
+# страница извлекается вместе с рамками слов (у pdfplumber — extract_words), даже
+# если заголовок таблицы в отчете не найден
+LAB_LAYOUT_TEMPLATES = os.getenv('LAB_LAYOUT_TEMPLATES', 'False') == 'True'
+LAB_LAYOUT_MIN_ROWS = int(os.getenv('LAB_LAYOUT_MIN_ROWS', '5'))
+LAB_LAYOUT_MIN_AGREEMENT = float(os.getenv('LAB_LAYOUT_MIN_AGREEMENT', '0.9'))
+# Сколько секунд процесс помнит найденный (или отсутствующий) шаблон раскладки
+LAB_LAYOUT_CACHE_SECONDS = int(os.getenv('LAB_LAYOUT_CACHE_SECONDS', '300'))
+# Настройка соединений SQLite (data/db.py): режим журнала (WAL — чтение не ждет
+# записи), synchronous (NORMAL безопасен в WAL), ожидание блокировки записи (мс),
+# размер отображения файла БД в память (байты, 0 — выключено) и кэш страниц
+# (отрицательное значение — в КиБ). Пустое значение — настройка SQLite по умолчанию.
+# Режим WAL сохраняется в самом файле БД при первом соединении (в том числе при
+# manage.py check), поэтому при DEBUG он по умолчанию не включается
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', '' if DEBUG else 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')
+SQLITE_BUSY_TIMEOUT_MS = int(SQLITE_BUSY_TIMEOUT_MS) if SQLITE_BUSY_TIMEOUT_MS else None
+SQLITE_MMAP_SIZE = os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))
+SQLITE_MMAP_SIZE = int(SQLITE_MMAP_SIZE) if SQLITE_MMAP_SIZE else None
+SQLITE_CACHE_SIZE = os.getenv('SQLITE_CACHE_SIZE', '-65536')
+SQLITE_CACHE_SIZE = int(SQLITE_CACHE_SIZE) if SQLITE_CACHE_SIZE else None
@@ -0,0 +1,106 @@
+import io
+import logging
+import random
+import threading
+import weakref
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from .log_handlers import AsyncQueueHandler, SamplingFilter, _restart_after_fork
+
+
+def make_record(level, msg, *args):
+    return logging.makeLogRecord({
+        'name': 'health_project.tests', 'levelno': level, 'levelname': logging.getLevelName(level),
+        'msg': msg, 'args': args,
+    })
+
+
+class AsyncQueueHandlerTests(SimpleTestCase):
+    """Очередь логов: переполнение, вывод при закрытии и перезапуск слушателя после fork."""
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = AsyncQueueHandler(queue_size=1, stream=self.stream)
+        self.handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.addCleanup(self.handler.close)
+
+    def _block_output(self):
+        """Слушатель застревает на первой записи, пока не выставлен release."""
+        entered, release = threading.Event(), threading.Event()
+        emit = self.handler.target.emit
+
+        def blocking_emit(record):
+            entered.set()
+            release.wait(5)
+            emit(record)
+
+        self.handler.target.emit = blocking_emit
+        self.addCleanup(release.set)
+        return entered, release
+
+    def test_full_queue_drops_only_records_below_warning(self):
+        entered, release = self._block_output()
+        self.handler.handle(make_record(logging.INFO, 'first %s', 1))
+        self.assertTrue(entered.wait(5))
+        self.handler.handle(make_record(logging.INFO, 'queued'))
+        self.handler.handle(make_record(logging.DEBUG, 'dropped'))
+        self.assertEqual(self.handler.dropped, 1)
+
+        # WARNING не отбрасывается, а ждет места в очереди
+        warning = threading.Thread(target=self.handler.handle, args=(make_record(logging.WARNING, 'kept'),))
+        warning.start()
+        warning.join(0.2)
+        self.assertTrue(warning.is_alive())
+        release.set()
+        warning.join(5)
+        self.assertFalse(warning.is_alive())
+
+        self.handler.close()
+        self.assertEqual(self.stream.getvalue().splitlines(), [
+            'INFO first 1', 'INFO queued', 'WARNING kept',
+            'WARNING Log queue overflow: dropped 1 records below WARNING.',
+        ])
+
+    def test_restart_after_fork(self):
+        # Как в дочернем процессе после fork: поток-слушатель родителя не скопирован
+        old_queue, old_listener = self.handler.queue, self.handler.listener
+        _restart_after_fork(weakref.ref(self.handler))
+        self.assertIsNot(self.handler.queue, old_queue)
+        self.assertIsNot(self.handler.listener, old_listener)
+        self.assertIs(self.handler.listener.queue, self.handler.queue)
+        old_listener.stop()
+
+        self.handler.handle(make_record(logging.INFO, 'after fork'))
+        self.handler.close()
+        self.assertEqual(self.stream.getvalue().splitlines(), ['INFO after fork'])
+
+    def test_closed_handler_is_not_restarted(self):
+        self.handler.close()
+        _restart_after_fork(weakref.ref(self.handler))
+        self.assertIsNone(self.handler.listener)
+
+
+class SamplingFilterTests(SimpleTestCase):
+    """Выборка записей уровня level и ниже; записи выше level проходят всегда."""
+
+    def test_sampled_levels(self):
+        sampling = SamplingFilter(sample_rate=0.25, level='DEBUG')
+        with mock.patch('health_project.log_handlers.random.random', side_effect=[0.1, 0.3, 0.2, 0.9]) as draw:
+            passed = [sampling.filter(make_record(logging.DEBUG, 'hot path')) for _ in range(4)]
+            self.assertTrue(sampling.filter(make_record(logging.INFO, 'always')))
+        self.assertEqual(passed, [True, False, True, False])
+        self.assertEqual(draw.call_count, 4)
+
+    def test_sample_rate(self):
+        sampling = SamplingFilter(sample_rate='0.1', level=logging.INFO)
+        random.seed(17)
+        passed = sum(sampling.filter(make_record(logging.INFO, 'sampled')) for _ in range(20000))
+        self.assertAlmostEqual(passed / 20000, 0.1, delta=0.01)
+
+    def test_full_rate_passes_everything(self):
+        sampling = SamplingFilter()
+        with mock.patch('health_project.log_handlers.random.random') as draw:
+            self.assertTrue(all(sampling.filter(make_record(logging.DEBUG, 'debug')) for _ in range(10)))
+        draw.assert_not_called()